@@ -0,0 +1,455 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from contraction_hierarchies import ContractionHierarchy
+from graph import (BidirectionalDijkstra, CSRGraph, Dijkstra, AStar, Graph,
+                   GridIndex, TravelTimeAStar, great_circle_distance)
+from landmarks import ALT, Landmarks
+
+"""
+Benchmarks for the routing code in graph.py.
+
+Generates grid and random geometric graphs of increasing size (or reads
+given .graph files) and measures reading the graph, the largest
+connected component, single source searches, point to point queries with
+every algorithm and a distance matrix. Reports running times, settled
+node counts and memory, and writes the results as JSON, so that two runs
+(e.g. before and after a change) can be compared with --compare.
+
+Example:
+    python3 benchmark.py --kinds grid geometric --sizes 10000 100000 \\
+        --output after.json --compare before.json
+
+"""
+
+# Lower left corner of the generated graphs.
+ORIGIN = (48.0, 7.8)
+# Max speeds of the generated arcs (km/h).
+MAX_SPEEDS = (30, 50, 70, 100, 130)
+
+
+def write_grid_graph(file_name, num_nodes, spacing=100.0, seed=0):
+    """Write a grid road network with about num_nodes nodes.
+
+    Neighbouring nodes are spacing meters apart (jittered a little). Each
+    of the two arcs between neighbours exists with probability 0.95, so
+    the graph is not strongly connected everywhere.
+
+    >>> import shutil
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> file_name = os.path.join(tmp_dir, "grid.graph")
+    >>> write_grid_graph(file_name, 100)
+    >>> graph = CSRGraph()
+    >>> graph.read_graph_from_file(file_name)
+    >>> graph.get_num_nodes(), 300 < graph.get_num_arcs() < 360
+    (100, True)
+    >>> shutil.rmtree(tmp_dir)
+    """
+    rand = random.Random(seed)
+    side = max(1, int(round(math.sqrt(num_nodes))))
+    (latitude_step, longitude_step) = _degrees(spacing)
+    coordinates = []
+    for row in range(side):
+        for column in range(side):
+            coordinates.append((
+                ORIGIN[0] + (row + rand.uniform(-0.2, 0.2)) * latitude_step,
+                ORIGIN[1] + (column + rand.uniform(-0.2, 0.2)) *
+                longitude_step))
+    arcs = []
+    for row in range(side):
+        for column in range(side):
+            node_id = row * side + column
+            for (other_row, other_column) in ((row, column + 1),
+                                              (row + 1, column)):
+                if other_row < side and other_column < side:
+                    other_id = other_row * side + other_column
+                    max_speed = rand.choice(MAX_SPEEDS)
+                    for (tail, head) in ((node_id, other_id),
+                                         (other_id, node_id)):
+                        if rand.random() < 0.95:
+                            arcs.append((tail, head, max_speed))
+    _write_graph_file(file_name, coordinates, arcs, rand)
+
+
+def write_random_geometric_graph(file_name, num_nodes, degree=6.0, seed=0):
+    """Write a random geometric graph with num_nodes nodes.
+
+    The nodes are spread uniformly over a square with 100 meters per node
+    on average, and every pair of nodes closer than a radius (chosen for
+    the given average degree) is connected by arcs in both directions.
+
+    >>> import shutil
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> file_name = os.path.join(tmp_dir, "geometric.graph")
+    >>> write_random_geometric_graph(file_name, 200)
+    >>> graph = Graph()
+    >>> graph.read_graph_from_file(file_name)
+    >>> graph.get_num_nodes(), 800 < graph.get_num_arcs() < 1600
+    (200, True)
+    >>> shutil.rmtree(tmp_dir)
+    """
+    rand = random.Random(seed)
+    side = 100.0 * math.sqrt(num_nodes)
+    (latitude_step, longitude_step) = _degrees(side)
+    coordinates = [(ORIGIN[0] + rand.random() * latitude_step,
+                    ORIGIN[1] + rand.random() * longitude_step)
+                   for _ in range(num_nodes)]
+    radius = math.sqrt(degree / math.pi) * 100.0
+    index = GridIndex([latitude for (latitude, _) in coordinates],
+                      [longitude for (_, longitude) in coordinates])
+    arcs = []
+    for (node_id, (latitude, longitude)) in enumerate(coordinates):
+        for (other_id, _) in index.k_nearest(latitude, longitude,
+                                             4 * int(degree) + 8, radius):
+            if other_id != node_id:
+                arcs.append((node_id, other_id, rand.choice(MAX_SPEEDS)))
+    _write_graph_file(file_name, coordinates, arcs, rand)
+
+
+def _degrees(meters):
+    """Return the degrees of latitude and longitude spanning the given
+    meters near ORIGIN."""
+    latitude_step = math.degrees(meters / 6371000.0)
+    return (latitude_step,
+            latitude_step / math.cos(math.radians(ORIGIN[0])))
+
+
+def _write_graph_file(file_name, coordinates, arcs, rand):
+    """Write nodes and (tail, head, max_speed) arcs in .graph format."""
+    arcs.sort()
+    with open(file_name, "w") as f:
+        f.write("# Number of nodes.\n%d\n" % len(coordinates))
+        f.write("# Number of arcs.\n%d\n" % len(arcs))
+        f.write("# Node information.\n")
+        for (node_id, (latitude, longitude)) in enumerate(coordinates):
+            f.write("%d %.7f %.7f\n" % (node_id, latitude, longitude))
+        f.write("# Arc information.\n")
+        for (tail, head, max_speed) in arcs:
+            distance = great_circle_distance(*(coordinates[tail] +
+                                               coordinates[head]))
+            # Roads are a little longer than the straight line.
+            distance = int(math.ceil(distance * rand.uniform(1.0, 1.3)))
+            f.write("%d %d %d %d\n" % (tail, head, distance, max_speed))
+
+
+class Measurement:
+    """Context manager measuring time and memory of a benchmark step.
+
+    With trace_memory, the peak of the memory allocated by Python during
+    the step is measured with tracemalloc, which slows down the step.
+
+    >>> with Measurement() as m:
+    ...     _ = sum(range(1000))
+    >>> sorted(m.result())
+    ['max_rss_kb', 'seconds']
+    """
+
+    def __init__(self, trace_memory=False):
+        self._trace_memory = trace_memory
+
+    def __enter__(self):
+        if self._trace_memory:
+            tracemalloc.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._start
+        self.peak_bytes = None
+        if self._trace_memory:
+            self.peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return False
+
+    def result(self, **values):
+        """Return the measurement and the given values as a dict."""
+        values["seconds"] = round(self.seconds, 6)
+        # Peak resident set size of the process so far (kB on Linux).
+        values["max_rss_kb"] = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss
+        if self.peak_bytes is not None:
+            values["peak_bytes"] = self.peak_bytes
+        return values
+
+
+def _settled(*searches):
+    """Return the number of nodes settled by the last searches."""
+    return sum(search.settled.count(1) for search in searches)
+
+
+class _UnguidedAStar(TravelTimeAStar):
+    """Dijkstra's algorithm on the unrounded travel times, to check the
+    results of TravelTimeAStar with."""
+
+    def _potential_function(self, source, target):
+        return lambda node_id: 0
+
+
+def _mean(values):
+    return sum(values) / len(values) if values else 0.0
+
+
+def benchmark_graph(file_name, graph_class=CSRGraph, num_queries=20,
+                    matrix_size=(10, 100), preprocessing=False,
+                    trace_memory=False, seed=0):
+    """Run all benchmarks on the graph in the given .graph file.
+
+    Returns a dict of results. The query nodes are drawn at random from
+    the largest strongly connected component, so that all queries have a
+    result. With preprocessing, ALT and contraction hierarchies are
+    measured as well (including their preprocessing). A* on the
+    unrounded travel times ("astar_exact") is checked against Dijkstra on
+    these, all others against Dijkstra.
+
+    >>> import shutil
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> file_name = os.path.join(tmp_dir, "grid.graph")
+    >>> write_grid_graph(file_name, 100)
+    >>> results = benchmark_graph(file_name, num_queries=2,
+    ...                           matrix_size=(2, 3), preprocessing=True)
+    >>> sorted(results["point_to_point"])
+    ['alt', 'astar', 'astar_exact', 'bidirectional', 'ch', 'dijkstra']
+    >>> results["point_to_point"]["astar"]["all_correct"]
+    True
+    >>> os.remove(file_name)
+
+    On a random geometric graph, many short arcs take 0 s when rounded,
+    which turns A* into Dijkstra, but A* on the unrounded travel times
+    still settles only a part of the nodes Dijkstra settles:
+    >>> write_random_geometric_graph(file_name, 2000)
+    >>> results = benchmark_graph(file_name, num_queries=5)
+    >>> point_to_point = results["point_to_point"]
+    >>> point_to_point["astar_exact"]["all_correct"]
+    True
+    >>> (point_to_point["astar_exact"]["mean_settled"] <
+    ...  0.5 * point_to_point["dijkstra"]["mean_settled"])
+    True
+    >>> shutil.rmtree(tmp_dir)
+    """
+    rand = random.Random(seed)
+    results = {"file": os.path.basename(file_name),
+               "graph_class": graph_class.__name__}
+    graph = graph_class()
+    with Measurement(trace_memory) as m:
+        graph.read_graph_from_file(file_name)
+    results["load"] = m.result(num_nodes=graph.get_num_nodes(),
+                               num_arcs=graph.get_num_arcs())
+    with Measurement(trace_memory) as m:
+        marked_nodes = []
+        graph.compute_lcc(marked_nodes, strongly=True)
+    results["lcc"] = m.result(num_nodes=len(marked_nodes))
+    graph.set_arc_costs_to_travel_time(130)
+    queries = [(rand.choice(marked_nodes), rand.choice(marked_nodes))
+               for _ in range(num_queries)]
+
+    # Single source searches.
+    times = []
+    settled = []
+    for (source, _) in queries:
+        with Measurement() as m:
+            graph.compute_shortest_paths(source)
+        times.append(m.seconds)
+        settled.append(_settled(graph._get_search(Dijkstra)))
+    results["single_source"] = {"mean_seconds": _mean(times),
+                                "mean_settled": _mean(settled)}
+
+    # Point to point queries, checked against Dijkstra.
+    expected = [graph.shortest_path(s, t)[0] for (s, t) in queries]
+    unguided = _UnguidedAStar(graph)
+    expected_unrounded = []
+    for (source, target) in queries:
+        unguided.run(source, target)
+        expected_unrounded.append(unguided.distances[target])
+    algorithms = [
+        ("dijkstra", graph.shortest_path,
+         lambda: [graph._get_search(Dijkstra)]),
+        ("bidirectional", graph.bidirectional_shortest_path,
+         lambda: [graph._get_search(BidirectionalDijkstra).forward,
+                  graph._get_search(BidirectionalDijkstra).backward]),
+        ("astar", graph.astar_shortest_path,
+         lambda: [graph._get_search(AStar)]),
+        ("astar_exact",
+         lambda source, target: graph.astar_shortest_path(source, target,
+                                                          True),
+         lambda: [graph._get_search(TravelTimeAStar)])]
+    preprocessing_results = {}
+    if preprocessing:
+        with Measurement(trace_memory) as m:
+            landmarks = Landmarks(graph)
+            landmarks.select_landmarks(16)
+        preprocessing_results["alt"] = m.result(num_landmarks=16)
+        alt = ALT(graph, landmarks)
+
+        def alt_query(source, target):
+            alt.run(source, target)
+            return (alt.distances[target], None)
+        algorithms.append(("alt", alt_query, lambda: [alt]))
+        with Measurement(trace_memory) as m:
+            ch = ContractionHierarchy(graph)
+            ch.contract()
+        preprocessing_results["ch"] = m.result(
+            num_shortcuts=ch.get_num_shortcuts())
+        algorithms.append(("ch", ch.query, lambda: ch._get_searches()))
+    results["preprocessing"] = preprocessing_results
+    results["point_to_point"] = {}
+    for (name, query, searches) in algorithms:
+        times = []
+        settled = []
+        all_correct = True
+        for ((source, target), distance, unrounded) in zip(
+                queries, expected, expected_unrounded):
+            with Measurement() as m:
+                result = query(source, target)
+            times.append(m.seconds)
+            settled.append(_settled(*searches()))
+            if name == "astar_exact":
+                # Sums along different but equally fast paths can differ
+                # in the last bits.
+                correct = math.isclose(result[0], unrounded, rel_tol=1e-9)
+            else:
+                correct = result[0] == distance
+            all_correct = all_correct and correct
+        results["point_to_point"][name] = {
+            "mean_seconds": _mean(times), "mean_settled": _mean(settled),
+            "all_correct": all_correct}
+
+    # Distance matrix.
+    (num_sources, num_targets) = matrix_size
+    sources = [rand.choice(marked_nodes) for _ in range(num_sources)]
+    targets = [rand.choice(marked_nodes) for _ in range(num_targets)]
+    with Measurement(trace_memory) as m:
+        graph.distance_matrix(sources, targets)
+    results["matrix"] = m.result(num_sources=num_sources,
+                                 num_targets=num_targets)
+    return results
+
+
+def run_benchmarks(kinds, sizes, directory, **options):
+    """Generate the graphs of the given kinds and sizes (if they do not
+    exist yet) and benchmark them. Returns a list of results."""
+    generators = {"grid": write_grid_graph,
+                  "geometric": write_random_geometric_graph}
+    results = []
+    for kind in kinds:
+        for size in sizes:
+            file_name = os.path.join(directory, "%s_%d.graph" % (kind, size))
+            if not os.path.exists(file_name):
+                generators[kind](file_name, size)
+            print("Benchmarking %s ..." % file_name, file=sys.stderr)
+            result = benchmark_graph(file_name, **options)
+            result["kind"] = kind
+            result["size"] = size
+            results.append(result)
+    return results
+
+
+def environment():
+    """Return a description of the machine and Python version."""
+    return {"python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(), "system": platform.system(),
+            "cpu_count": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def _flatten(results):
+    """Map "file/step/measure" keys to the times of a results list."""
+    values = {}
+    for result in results:
+        for step in ("load", "lcc", "matrix"):
+            values["%s/%s" % (result["file"], step)] = result[step]["seconds"]
+        values["%s/single_source" % result["file"]] = \
+            result["single_source"]["mean_seconds"]
+        for (name, query) in result["point_to_point"].items():
+            values["%s/%s" % (result["file"], name)] = query["mean_seconds"]
+    return values
+
+
+def compare_results(old_results, new_results):
+    """Return lines comparing the times of two benchmark runs.
+
+    >>> old = [{"file": "g", "load": {"seconds": 2.0}, "lcc": {"seconds": 1},
+    ...         "matrix": {"seconds": 1}, "single_source": {"mean_seconds": 1},
+    ...         "point_to_point": {"astar": {"mean_seconds": 0.5}}}]
+    >>> new = json.loads(json.dumps(old))
+    >>> new[0]["load"]["seconds"] = 1.0
+    >>> print("\\n".join(compare_results(old, new)))
+    g/astar             0.500000s     0.500000s   1.00x
+    g/lcc               1.000000s     1.000000s   1.00x
+    g/load              2.000000s     1.000000s   0.50x
+    g/matrix            1.000000s     1.000000s   1.00x
+    g/single_source     1.000000s     1.000000s   1.00x
+    """
+    old_values = _flatten(old_results)
+    new_values = _flatten(new_results)
+    keys = sorted(set(old_values) & set(new_values))
+    width = max([len(key) for key in keys] or [0])
+    lines = []
+    for key in keys:
+        (old, new) = (old_values[key], new_values[key])
+        ratio = new / old if old > 0 else float("Inf")
+        lines.append("%-*s %12.6fs %12.6fs %6.2fx"
+                     % (width, key, old, new, ratio))
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the routing code in graph.py.")
+    parser.add_argument("graphs", nargs="*",
+                        help=".graph files to benchmark (instead of "
+                             "generated graphs)")
+    parser.add_argument("--kinds", nargs="+", default=["grid", "geometric"],
+                        choices=["grid", "geometric"])
+    parser.add_argument("--sizes", nargs="+", type=int,
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--dir", default=tempfile.gettempdir(),
+                        help="directory for the generated graphs")
+    parser.add_argument("--graph-class", default="CSRGraph",
+                        choices=["Graph", "CSRGraph"])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--matrix", nargs=2, type=int, default=[10, 100],
+                        metavar=("SOURCES", "TARGETS"))
+    parser.add_argument("--preprocessing", action="store_true",
+                        help="also benchmark ALT and contraction "
+                             "hierarchies")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="measure peak Python memory per step "
+                             "(slower)")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", metavar="OLD_RESULTS",
+                        help="compare with the results in this file")
+    args = parser.parse_args()
+    options = {"graph_class": {"Graph": Graph,
+                               "CSRGraph": CSRGraph}[args.graph_class],
+               "num_queries": args.queries,
+               "matrix_size": tuple(args.matrix),
+               "preprocessing": args.preprocessing,
+               "trace_memory": args.trace_memory}
+    if args.graphs:
+        results = [benchmark_graph(file_name, **options)
+                   for file_name in args.graphs]
+    else:
+        results = run_benchmarks(args.kinds, args.sizes, args.dir, **options)
+    report = {"environment": environment(), "options": vars(args),
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            old_report = json.load(f)
+        print("\n".join(compare_results(old_report["results"], results)))
@@ -0,0 +1,439 @@
+#!/usr/bin/python3
+
+import os
+import bisect
+import heapq
+import mmap
+import struct
+from array import array
+
+from graph import Dijkstra
+
+"""
+Contraction hierarchies (CH) for fast point-to-point queries.
+
+Preprocessing contracts the nodes one by one in the order of their
+importance. Contracting node v removes it from the remaining graph and
+adds a shortcut arc (u, w) for every pair of arcs (u, v), (v, w) whose
+path u -> v -> w is the only shortest path from u to w (no "witness"
+path is found). The rank of a node is its position in this order.
+
+A query runs a forward search from the source and a backward search
+from the target, both only along arcs leading to higher ranked nodes.
+These searches settle very few nodes. Shortcuts on the resulting path
+are unpacked into the original arcs they replace.
+
+"""
+
+# CH file format: header, then the arrays up_offsets, down_offsets
+# (int64), ranks, up_heads, up_costs, up_arc_ids, down_heads,
+# down_costs, down_arc_ids, shortcut_first, shortcut_second (int32).
+CH_MAGIC = b"CHGRAPH\0"
+CH_VERSION = 1
+CH_HEADER = struct.Struct("=8sIIqqqqqI")
+
+
+def ch_file_path(graph_file_name):
+    """Return the path of the CH file of a .graph file."""
+    return graph_file_name + ".ch"
+
+
+def read_or_compute_ch(graph, graph_file_name):
+    """Return a ContractionHierarchy for the given graph.
+
+    The hierarchy is read from the CH file next to the .graph file if it
+    exists and matches the graph and its current arc costs. Otherwise it
+    is computed and the file is (re)written.
+
+    >>> import os, shutil, tempfile
+    >>> from graph import CSRGraph
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> file_name = os.path.join(tmp_dir, "test2.graph")
+    >>> _ = shutil.copy("test2.graph", file_name)
+    >>> graph = CSRGraph()
+    >>> graph.read_graph_from_file(file_name)
+    >>> ch = read_or_compute_ch(graph, file_name)
+    >>> ch = read_or_compute_ch(graph, file_name)
+    >>> type(ch.ranks) is memoryview
+    True
+    >>> ch.shortest_path(5, 1)
+    (90.0, [5, 4, 3, 1])
+    >>> del ch
+    >>> shutil.rmtree(tmp_dir)
+    """
+    file_name = ch_file_path(graph_file_name)
+    ch = ContractionHierarchy(graph)
+    if os.path.exists(file_name) and ch.read_from_file(file_name):
+        return ch
+    ch.contract()
+    ch.write_to_file(file_name)
+    return ch
+
+
+class ContractionHierarchy:
+    """Contraction hierarchy of a Graph or CSRGraph.
+
+    Arc ids below graph.get_num_arcs() are positions in the graph's
+    search arrays (see Graph._get_arc()). Arc id num_arcs + i is the
+    i-th shortcut, which replaces the arcs shortcut_first[i] and
+    shortcut_second[i] (each an arc or again a shortcut).
+
+    >>> from graph import Graph
+    >>> graph = Graph()
+    >>> graph.read_graph_from_file("test2.graph")
+    >>> ch = ContractionHierarchy(graph)
+    >>> ch.contract()
+    >>> all(ch.shortest_path(s, t) == graph.shortest_path(s, t)
+    ...     for s in range(7) for t in range(7))
+    True
+    >>> ch.shortest_path_arcs(4, 2)
+    (50.0, [4->5(30), 5->2(20)])
+    >>> graph.set_arc_costs_to_travel_time(100)
+    >>> ch.contract()
+    >>> all(ch.shortest_path(s, t)[0] == graph.shortest_path(s, t)[0]
+    ...     for s in range(7) for t in range(7))
+    True
+    """
+
+    def __init__(self, graph):
+        self._graph = graph
+        self.ranks = array("i")
+        # Arcs to higher ranked nodes, stored at their tail node.
+        self._up = None
+        # Arcs from higher ranked nodes, stored at their head node and
+        # pointing to their tail node (for the backward search).
+        self._down = None
+        self.shortcut_first = array("i")
+        self.shortcut_second = array("i")
+        self._mmap = None
+        self._searches = None
+
+    def contract(self, witness_settle_limit=100):
+        """Contract all nodes and build the upward and downward graphs.
+
+        The next node to contract is the one with the smallest priority
+        edge difference (shortcuts added minus arcs removed) plus number
+        of already contracted neighbours. Priorities are updated lazily:
+        the popped node's priority is computed again, and if it is no
+        longer the smallest, the node is pushed back.
+        Witness searches stop after witness_settle_limit settled nodes,
+        in which case the shortcut is added to be safe.
+        """
+        graph = self._graph
+        num_nodes = graph.get_num_nodes()
+        (offsets, heads, costs) = graph._search_arrays()
+        num_arcs = len(heads)
+        # Remaining graph: out_arcs[u][w] = in_arcs[w][u] = (costs, arc id)
+        # of the cheapest arc from u to w.
+        out_arcs = [{} for node_id in range(num_nodes)]
+        in_arcs = [{} for node_id in range(num_nodes)]
+        for u in range(num_nodes):
+            for i in range(offsets[u], offsets[u + 1]):
+                w = heads[i]
+                if w != u and (w not in out_arcs[u] or
+                               costs[i] < out_arcs[u][w][0]):
+                    out_arcs[u][w] = (costs[i], i)
+                    in_arcs[w][u] = (costs[i], i)
+        shortcut_first = array("i")
+        shortcut_second = array("i")
+        up_lists = [None] * num_nodes
+        down_lists = [None] * num_nodes
+        ranks = array("i", [0]) * num_nodes
+        deleted_neighbours = array("i", [0]) * num_nodes
+
+        def priority(v, shortcuts):
+            return len(shortcuts) - len(in_arcs[v]) - len(out_arcs[v]) + \
+                deleted_neighbours[v]
+
+        heap = []
+        for v in range(num_nodes):
+            shortcuts = _find_shortcuts(v, out_arcs, in_arcs,
+                                        witness_settle_limit)
+            heap.append((priority(v, shortcuts), v))
+        heapq.heapify(heap)
+        rank = 0
+        while heap:
+            v = heapq.heappop(heap)[1]
+            shortcuts = _find_shortcuts(v, out_arcs, in_arcs,
+                                        witness_settle_limit)
+            v_priority = priority(v, shortcuts)
+            if heap and v_priority > heap[0][0]:
+                heapq.heappush(heap, (v_priority, v))
+                continue
+            for (u, w, shortcut_costs) in shortcuts:
+                arc_id = num_arcs + len(shortcut_first)
+                shortcut_first.append(in_arcs[v][u][1])
+                shortcut_second.append(out_arcs[v][w][1])
+                if w not in out_arcs[u] or shortcut_costs < out_arcs[u][w][0]:
+                    out_arcs[u][w] = (shortcut_costs, arc_id)
+                    in_arcs[w][u] = (shortcut_costs, arc_id)
+            # All remaining neighbours of v get a higher rank than v.
+            up_lists[v] = [(w, c, arc_id)
+                           for w, (c, arc_id) in out_arcs[v].items()]
+            down_lists[v] = [(u, c, arc_id)
+                             for u, (c, arc_id) in in_arcs[v].items()]
+            for u in in_arcs[v]:
+                del out_arcs[u][v]
+                deleted_neighbours[u] += 1
+            for w in out_arcs[v]:
+                del in_arcs[w][v]
+                deleted_neighbours[w] += 1
+            out_arcs[v] = None
+            in_arcs[v] = None
+            ranks[v] = rank
+            rank += 1
+        self.ranks = ranks
+        self._up = _build_search_arrays(up_lists)
+        self._down = _build_search_arrays(down_lists)
+        self.shortcut_first = shortcut_first
+        self.shortcut_second = shortcut_second
+        self._searches = None
+
+    def get_num_shortcuts(self):
+        """Return the number of shortcuts added by the contraction."""
+        return len(self.shortcut_first)
+
+    def _get_searches(self):
+        """Return this process's (forward, backward) Dijkstra objects."""
+        if self._searches is None:
+            num_nodes = self._graph.get_num_nodes()
+            self._searches = (
+                Dijkstra(_SearchArrays(num_nodes, self._up[:3])),
+                Dijkstra(_SearchArrays(num_nodes, self._down[:3])))
+        return self._searches
+
+    def query(self, source, target):
+        """Return (distance, arc ids of the path in the hierarchy).
+
+        Both searches only follow arcs to higher ranked nodes. The side
+        with the smaller next distance goes next; a side is done once its
+        next distance is no smaller than the best path found so far.
+        """
+        (forward, backward) = self._get_searches()
+        searches = (forward, backward)
+        all_arrays = (forward.start(source), backward.start(target))
+        inf = float("Inf")
+        best_distance = 0 if source == target else inf
+        meeting_node = source if source == target else -1
+        while True:
+            # Drop outdated heap entries to see the next distances.
+            for search in searches:
+                heap = search._heap
+                while heap and search.settled[heap[0][1]]:
+                    heapq.heappop(heap)
+            forward_min = forward._heap[0][0] if forward._heap else inf
+            backward_min = backward._heap[0][0] if backward._heap else inf
+            if min(forward_min, backward_min) >= best_distance:
+                break
+            side = 0 if forward_min <= backward_min else 1
+            search = searches[side]
+            (offsets, heads, costs) = all_arrays[side]
+            distances = search.distances
+            heap = search._heap
+            (distance, node_id) = heapq.heappop(heap)
+            search.settled[node_id] = 1
+            total = distance + searches[1 - side].distances[node_id]
+            if total < best_distance:
+                best_distance = total
+                meeting_node = node_id
+            for i in range(offsets[node_id], offsets[node_id + 1]):
+                head_node_id = heads[i]
+                new_distance = distance + costs[i]
+                old_distance = distances[head_node_id]
+                if new_distance < old_distance:
+                    if old_distance == inf:
+                        search._touched.append(head_node_id)
+                    distances[head_node_id] = new_distance
+                    search.traceback_arcs[head_node_id] = i
+                    heapq.heappush(heap, (new_distance, head_node_id))
+        if meeting_node < 0:
+            return (inf, [])
+        # Arcs from the source up to the meeting node.
+        arc_ids = []
+        node_id = meeting_node
+        while forward.traceback_arcs[node_id] >= 0:
+            i = forward.traceback_arcs[node_id]
+            arc_ids.append(self._up[3][i])
+            node_id = bisect.bisect_right(self._up[0], i) - 1
+        arc_ids.reverse()
+        # Arcs from the meeting node down to the target.
+        node_id = meeting_node
+        while backward.traceback_arcs[node_id] >= 0:
+            i = backward.traceback_arcs[node_id]
+            arc_ids.append(self._down[3][i])
+            node_id = bisect.bisect_right(self._down[0], i) - 1
+        return (float(best_distance), arc_ids)
+
+    def unpack(self, arc_ids):
+        """Replace all shortcuts by the original arc ids they stand for."""
+        num_arcs = self._graph.get_num_arcs()
+        result = []
+        stack = list(reversed(arc_ids))
+        while stack:
+            arc_id = stack.pop()
+            if arc_id < num_arcs:
+                result.append(arc_id)
+            else:
+                stack.append(self.shortcut_second[arc_id - num_arcs])
+                stack.append(self.shortcut_first[arc_id - num_arcs])
+        return result
+
+    def shortest_path_arcs(self, source, target):
+        """Return (distance, Arc objects of the shortest path)."""
+        (distance, arc_ids) = self.query(source, target)
+        return (distance, [self._graph._get_arc(arc_id)
+                           for arc_id in self.unpack(arc_ids)])
+
+    def shortest_path(self, source, target):
+        """Return (distance, node ids of the path), (inf, []) if none."""
+        (distance, arcs) = self.shortest_path_arcs(source, target)
+        if distance == float("Inf"):
+            return (distance, [])
+        return (distance, [source] + [arc.head_node_id for arc in arcs])
+
+    def write_to_file(self, file_name):
+        """Write the hierarchy to a CH file."""
+        graph = self._graph
+        tmp_file_name = "%s.tmp%d" % (file_name, os.getpid())
+        with open(tmp_file_name, "wb") as f:
+            f.write(CH_HEADER.pack(
+                CH_MAGIC, CH_VERSION, 0, graph.get_num_nodes(),
+                graph.get_num_arcs(), len(self._up[1]), len(self._down[1]),
+                len(self.shortcut_first), graph._search_fingerprint()))
+            for values in self._arrays():
+                f.write(values)
+        os.replace(tmp_file_name, file_name)
+
+    def read_from_file(self, file_name):
+        """Memory-map the hierarchy from a CH file.
+
+        Returns False (and reads nothing) if the file was computed for a
+        different graph or for different arc costs.
+        """
+        graph = self._graph
+        with open(file_name, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, num_nodes, num_arcs, num_up, num_down,
+         num_shortcuts, fingerprint) = CH_HEADER.unpack_from(mapping)
+        if magic != CH_MAGIC or version != CH_VERSION:
+            mapping.close()
+            raise Exception("%s is not a CH file" % file_name)
+        if num_nodes != graph.get_num_nodes() or \
+                num_arcs != graph.get_num_arcs() or \
+                fingerprint != graph._search_fingerprint():
+            mapping.close()
+            return False
+        lengths = [num_nodes + 1, num_nodes + 1, num_nodes, num_up, num_up,
+                   num_up, num_down, num_down, num_down, num_shortcuts,
+                   num_shortcuts]
+        buf = memoryview(mapping)
+        pos = CH_HEADER.size
+        arrays = []
+        for length, typecode in zip(lengths, "qqiiiiiiiii"):
+            num_bytes = length * struct.calcsize(typecode)
+            arrays.append(buf[pos:pos + num_bytes].cast(typecode))
+            pos += num_bytes
+        (up_offsets, down_offsets, self.ranks, up_heads, up_costs,
+         up_arc_ids, down_heads, down_costs, down_arc_ids,
+         self.shortcut_first, self.shortcut_second) = arrays
+        self._up = (up_offsets, up_heads, up_costs, up_arc_ids)
+        self._down = (down_offsets, down_heads, down_costs, down_arc_ids)
+        self._mmap = mapping
+        self._searches = None
+        return True
+
+    def _arrays(self):
+        """Return all arrays in the order of the CH file format."""
+        return [self._up[0], self._down[0], self.ranks, self._up[1],
+                self._up[2], self._up[3], self._down[1], self._down[2],
+                self._down[3], self.shortcut_first, self.shortcut_second]
+
+
+class _SearchArrays:
+    """Minimal graph interface for running Dijkstra on given arrays."""
+
+    def __init__(self, num_nodes, search_arrays):
+        self._num_nodes = num_nodes
+        self._arrays = search_arrays
+
+    def get_num_nodes(self):
+        return self._num_nodes
+
+    def _search_arrays(self):
+        return self._arrays
+
+
+def _find_shortcuts(v, out_arcs, in_arcs, settle_limit):
+    """Return the shortcuts (u, w, costs) needed to contract node v.
+
+    For every remaining arc (u, v), a Dijkstra search from u that avoids
+    v looks for witness paths to the heads w of the arcs (v, w). A
+    shortcut is needed where no path at most as short as u -> v -> w is
+    found.
+    """
+    shortcuts = []
+    for u, (costs_uv, arc_uv) in in_arcs[v].items():
+        targets = {}
+        for w, (costs_vw, arc_vw) in out_arcs[v].items():
+            if w != u:
+                targets[w] = costs_uv + costs_vw
+        if not targets:
+            continue
+        witness_distances = _witness_search(u, v, out_arcs, targets,
+                                            max(targets.values()),
+                                            settle_limit)
+        for w, path_costs in targets.items():
+            if witness_distances.get(w, float("Inf")) > path_costs:
+                shortcuts.append((u, w, path_costs))
+    return shortcuts
+
+
+def _witness_search(source, avoid_node, out_arcs, targets, max_costs,
+                    settle_limit):
+    """Bounded Dijkstra in the remaining graph, ignoring avoid_node.
+
+    Stops when all targets are settled, the next distance exceeds
+    max_costs, or settle_limit nodes are settled. Returns the distances
+    found (a dict, so nothing has to be reset).
+    """
+    distances = {source: 0}
+    settled = set()
+    heap = [(0, source)]
+    num_targets_left = len(targets)
+    while heap and len(settled) < settle_limit:
+        (distance, node_id) = heapq.heappop(heap)
+        if node_id in settled:
+            continue
+        if distance > max_costs:
+            break
+        settled.add(node_id)
+        if node_id in targets:
+            num_targets_left -= 1
+            if num_targets_left == 0:
+                break
+        for head_node_id, (costs, arc_id) in out_arcs[node_id].items():
+            if head_node_id == avoid_node:
+                continue
+            new_distance = distance + costs
+            if new_distance < distances.get(head_node_id, float("Inf")):
+                distances[head_node_id] = new_distance
+                heapq.heappush(heap, (new_distance, head_node_id))
+    return distances
+
+
+def _build_search_arrays(adjacency_lists):
+    """Turn lists of (head, costs, arc id) into CSR search arrays.
+
+    Returns (offsets, heads, costs, arc ids).
+    """
+    offsets = array("q", [0])
+    heads = array("i")
+    costs = array("i")
+    arc_ids = array("i")
+    for adjacency_list in adjacency_lists:
+        for (head_node_id, arc_costs, arc_id) in adjacency_list or []:
+            heads.append(head_node_id)
+            costs.append(arc_costs)
+            arc_ids.append(arc_id)
+        offsets.append(len(heads))
+    return (offsets, heads, costs, arc_ids)
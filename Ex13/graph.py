@@ -1,7 +1,573 @@
 #!/usr/bin/python3
 
-import re
-import queue
+import os
+import bisect
+import heapq
+import math
+import mmap
+import struct
+import time
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+# Binary graph format: header, then the arrays offsets (int64),
+# latitudes, longitudes (double), heads, distances, max_speeds (int32).
+# Every array starts at a multiple of BINARY_ALIGNMENT bytes.
+BINARY_MAGIC = b"GRAPHBIN"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("=8sIIqqqq")
+BINARY_ALIGNMENT = 64
+BINARY_LAYOUT = [("offsets", "q"), ("latitudes", "d"), ("longitudes", "d"),
+                 ("heads", "i"), ("distances", "i"), ("max_speeds", "i")]
+# Mean earth radius in meter.
+EARTH_RADIUS = 6371000.0
+
+
+def great_circle_distance(latitude1, longitude1, latitude2, longitude2):
+    """Return the great-circle distance in meter (haversine formula).
+
+    >>> "%.0f" % great_circle_distance(49.3418, 7.30089, 49.3406, 7.29997)
+    '149'
+    >>> great_circle_distance(48.0, 7.0, 48.0, 7.0)
+    0.0
+    """
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    sin_dphi = math.sin((phi2 - phi1) / 2)
+    sin_dlambda = math.sin(math.radians(longitude2 - longitude1) / 2)
+    a = sin_dphi * sin_dphi + \
+        math.cos(phi1) * math.cos(phi2) * sin_dlambda * sin_dlambda
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def hilbert_index(x, y, order=16):
+    """Return the position of point (x, y) on a Hilbert curve.
+
+    x and y are integers in [0, 2^order). Points close on the curve are
+    close in the plane, so sorting by this index groups nearby points.
+
+    >>> [hilbert_index(x, y, 1) for (x, y) in [(0, 0), (0, 1), (1, 1),
+    ...                                         (1, 0)]]
+    [0, 1, 2, 3]
+    """
+    index = 0
+    s = 1 << (order - 1)
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        index += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant.
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            (x, y) = (y, x)
+        s >>= 1
+    return index
+
+
+def read_graph_chunks(file_name, chunk_size=1 << 22):
+    """Parse a .graph file chunk by chunk, reading it in large chunks.
+
+    Instead of splitting every line on its own, all node (or arc) lines
+    of a chunk are joined and split at once, and each column is
+    converted in one go. Yields ("counts", num_nodes, num_arcs) first,
+    then ("nodes", latitudes, longitudes) and ("arcs", tails, heads,
+    distances, max_speeds) tuples of arrays, in file order. Only one
+    chunk is in memory at a time.
+
+    >>> [chunk[0] for chunk in read_graph_chunks("test.graph")]
+    ['counts', 'nodes', 'arcs']
+
+    Comment lines may be indented:
+    >>> import os, shutil, tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> file_name = os.path.join(tmp_dir, "comments.graph")
+    >>> with open(file_name, "w") as f:
+    ...     _ = f.write("2\\n  # arcs\\n1\\n0 49.3 7.3\\n1 49.2 7.2\\n"
+    ...                 "\\t# arc information\\n0 1 30 30\\n")
+    >>> [list(column) for column in list(read_graph_chunks(file_name))[2][1:]]
+    [[0], [1], [30], [30]]
+    >>> shutil.rmtree(tmp_dir)
+    """
+    num_nodes = None
+    num_arcs = None
+    num_node_lines = 0
+    with open(file_name, "rb") as f:
+        while True:
+            lines = f.readlines(chunk_size)
+            if not lines:
+                break
+            # Skip comment lines, also indented ones.
+            lines = [line for line in lines
+                     if not line.lstrip().startswith(b"#")]
+            pos = 0
+            while pos < len(lines):
+                if num_nodes is None:
+                    num_nodes = int(lines[pos])
+                    pos += 1
+                elif num_arcs is None:
+                    num_arcs = int(lines[pos])
+                    pos += 1
+                    yield ("counts", num_nodes, num_arcs)
+                elif num_node_lines < num_nodes:  # node info lines.
+                    k = min(num_nodes - num_node_lines, len(lines) - pos)
+                    cols = b" ".join(lines[pos:pos + k]).split()
+                    if not len(cols) == 3 * k:
+                        raise Exception("Node info line with != 3 cols")
+                    yield ("nodes", array("d", map(float, cols[1::3])),
+                           array("d", map(float, cols[2::3])))
+                    num_node_lines += k
+                    pos += k
+                else:  # arc info lines.
+                    k = len(lines) - pos
+                    cols = b" ".join(lines[pos:]).split()
+                    if not len(cols) == 4 * k:
+                        raise Exception("Arc info line with != 4 cols")
+                    yield ("arcs", array("i", map(int, cols[0::4])),
+                           array("i", map(int, cols[1::4])),
+                           array("i", map(int, cols[2::4])),
+                           array("i", map(int, cols[3::4])))
+                    pos += k
+
+
+def read_graph_arrays(file_name, chunk_size=1 << 22):
+    """Parse a .graph file into arrays, see read_graph_chunks().
+
+    Returns (latitudes, longitudes, tails, heads, distances, max_speeds).
+
+    >>> arrays = read_graph_arrays("test.graph")
+    >>> [list(a) for a in arrays[2:4]]
+    [[0, 0, 1, 2, 3, 4], [1, 2, 2, 3, 1, 3]]
+    >>> arrays[0][4], arrays[1][4]
+    (49.2581, 7.32786)
+    """
+    arrays = (array("d"), array("d"), array("i"), array("i"), array("i"),
+              array("i"))
+    for chunk in read_graph_chunks(file_name, chunk_size):
+        if chunk[0] == "nodes":
+            arrays[0].extend(chunk[1])
+            arrays[1].extend(chunk[2])
+        elif chunk[0] == "arcs":
+            for (values, new_values) in zip(arrays[2:], chunk[1:]):
+                values.extend(new_values)
+    return arrays
+
+
+def write_graph_file(file_name, arrays, chunk_size=1 << 16):
+    """Write CSR arrays (in BINARY_LAYOUT order) to a .graph file.
+
+    The lines are formatted and written chunk_size lines at a time, so
+    the text of the whole graph is never in memory. Coordinates are
+    written with repr(), so reading the file again gives the same
+    values.
+
+    >>> import os, shutil, tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> file_name = os.path.join(tmp_dir, "test.graph")
+    >>> arrays = read_graph_arrays("test.graph")
+    >>> write_graph_file(file_name, (array("q", [0, 2, 3, 4, 5, 6]),) +
+    ...                  arrays[:2] + arrays[3:])
+    >>> read_graph_arrays(file_name) == arrays
+    True
+    >>> shutil.rmtree(tmp_dir)
+    """
+    (offsets, latitudes, longitudes, heads, distances, max_speeds) = arrays
+    num_nodes = len(offsets) - 1
+    tmp_file_name = "%s.tmp%d" % (file_name, os.getpid())
+    with open(tmp_file_name, "w") as f:
+        f.write("# Number of nodes.\n%d\n# Number of arcs.\n%d\n"
+                "# Node information.\n" % (num_nodes, len(heads)))
+        for start in range(0, num_nodes, chunk_size):
+            f.write("".join([
+                "%d %r %r\n" % (node_id, latitudes[node_id],
+                                longitudes[node_id])
+                for node_id in range(start, min(start + chunk_size,
+                                                num_nodes))]))
+        f.write("# Arc information.\n")
+        lines = []
+        for node_id in range(num_nodes):
+            for i in range(offsets[node_id], offsets[node_id + 1]):
+                lines.append("%d %d %d %d\n" % (
+                    node_id, heads[i], distances[i], max_speeds[i]))
+            if len(lines) >= chunk_size:
+                f.write("".join(lines))
+                lines = []
+        f.write("".join(lines))
+    os.replace(tmp_file_name, file_name)
+
+
+def convert_graph_file(input_file_name, output_file_name,
+                       chunk_size=1 << 18):
+    """Convert a .graph file to a binary graph file or the other way round.
+
+    The direction is chosen by the type of the input file. A binary file
+    is memory-mapped and written out in chunks. A .graph file is parsed
+    chunk by chunk and each chunk is written to its place in the binary
+    file right away, so only the offsets are kept for the whole graph
+    (chunk_size is the number of bytes of text parsed at a time).
+    This needs the arcs grouped by tail node, as usual in .graph files;
+    otherwise the graph is read completely and sorted first.
+
+    >>> import os, tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> binary_file_name = os.path.join(tmp_dir, "test2.bin")
+    >>> text_file_name = os.path.join(tmp_dir, "test2.graph")
+    >>> convert_graph_file("test2.graph", binary_file_name)
+    >>> convert_graph_file(binary_file_name, text_file_name)
+    >>> read_graph_arrays(text_file_name) == read_graph_arrays("test2.graph")
+    True
+    >>> os.remove(binary_file_name)
+
+    The numbers of nodes and arcs must match the counts in the file:
+    >>> with open(text_file_name, "a") as f:
+    ...     _ = f.write("6 5 10 15\\n")
+    >>> convert_graph_file(text_file_name, binary_file_name)
+    Traceback (most recent call last):
+        ...
+    ValueError: 11 arcs in file, expected 10
+    >>> os.listdir(tmp_dir)
+    ['test2.graph']
+    >>> os.remove(text_file_name)
+    >>> os.rmdir(tmp_dir)
+    """
+    with open(input_file_name, "rb") as f:
+        is_binary = f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+    if is_binary:
+        (mapping, arrays) = open_binary_graph(input_file_name)
+        try:
+            write_graph_file(output_file_name, arrays)
+        finally:
+            del arrays
+            mapping.close()
+    elif not _stream_text_to_binary(input_file_name, output_file_name,
+                                    chunk_size):
+        (latitudes, longitudes, tails, heads, distances, max_speeds) \
+            = read_graph_arrays(input_file_name)
+        (offsets, heads, distances, max_speeds) = build_csr_arrays(
+            len(latitudes), tails, heads, distances, max_speeds)
+        write_binary_graph(output_file_name, (offsets, latitudes, longitudes,
+                                              heads, distances, max_speeds),
+                           os.stat(input_file_name))
+
+
+def _stream_text_to_binary(text_file_name, binary_file_name, chunk_size):
+    """Convert a .graph file with arcs grouped by tail node to a binary
+    graph file chunk by chunk. Returns False (and writes nothing) if the
+    arcs turn out not to be grouped. Raises ValueError (and writes
+    nothing) if the numbers of nodes or arcs do not match the counts at
+    the beginning of the file."""
+    source_stat = os.stat(text_file_name)
+    tmp_file_name = "%s.tmp%d" % (binary_file_name, os.getpid())
+    try:
+        grouped = _write_text_as_binary(text_file_name, tmp_file_name,
+                                        source_stat, chunk_size)
+    except BaseException:
+        os.remove(tmp_file_name)
+        raise
+    if not grouped:
+        os.remove(tmp_file_name)
+        return False
+    os.replace(tmp_file_name, binary_file_name)
+    return True
+
+
+def _write_text_as_binary(text_file_name, binary_file_name, source_stat,
+                          chunk_size):
+    """Do the work of _stream_text_to_binary(), writing to the given file
+    (which is left incomplete on failure). Returns False if the arcs are
+    not grouped by tail node."""
+    grouped = True
+    num_nodes = None
+    num_nodes_read = 0
+    num_arcs_read = 0
+    with open(binary_file_name, "wb") as f:
+        num_bytes_written = {}
+        for chunk in read_graph_chunks(text_file_name, chunk_size):
+            if chunk[0] == "counts":
+                (_, num_nodes, num_arcs) = chunk
+                f.write(BINARY_HEADER.pack(
+                    BINARY_MAGIC, BINARY_VERSION, 0, num_nodes, num_arcs,
+                    source_stat.st_size, source_stat.st_mtime_ns))
+                positions = _binary_positions(num_nodes, num_arcs)
+                # Number of arcs of node v at position v + 1.
+                counts = array("q", [0]) * (num_nodes + 1)
+                last_tail = 0
+                continue
+            if chunk[0] == "nodes":
+                num_nodes_read += len(chunk[1])
+                columns = zip(("latitudes", "longitudes"), chunk[1:])
+            else:
+                num_arcs_read += len(chunk[1])
+                if num_arcs_read > num_arcs:
+                    # Only count the surplus arcs, for the error below.
+                    continue
+                for tail in chunk[1]:
+                    if not 0 <= tail < num_nodes:
+                        raise ValueError("arc with tail %d, expected less "
+                                         "than %d nodes" % (tail, num_nodes))
+                    if tail < last_tail:
+                        grouped = False
+                        break
+                    last_tail = tail
+                    counts[tail + 1] += 1
+                if not grouped:
+                    break
+                columns = zip(("heads", "distances", "max_speeds"),
+                              chunk[2:])
+            for (name, values) in columns:
+                num_bytes = num_bytes_written.get(name, 0)
+                f.seek(positions[name][0] + num_bytes)
+                f.write(values)
+                num_bytes_written[name] = num_bytes + \
+                    len(values) * values.itemsize
+        if not grouped:
+            return False
+        if num_nodes is None:
+            raise ValueError("no node and arc counts in file")
+        if num_nodes_read != num_nodes:
+            raise ValueError("%d nodes in file, expected %d"
+                             % (num_nodes_read, num_nodes))
+        if num_arcs_read != num_arcs:
+            raise ValueError("%d arcs in file, expected %d"
+                             % (num_arcs_read, num_arcs))
+        # The offsets are the prefix sums of the counts.
+        for node_id in range(num_nodes):
+            counts[node_id + 1] += counts[node_id]
+        f.seek(positions["offsets"][0])
+        f.write(counts)
+        f.truncate(positions["end"])
+    return True
+
+
+def _binary_positions(num_nodes, num_arcs):
+    """Return {array name: (file position, typecode)} and the file size
+    ("end") of a binary graph file, see BINARY_LAYOUT."""
+    positions = {}
+    pos = BINARY_HEADER.size
+    for name, typecode in BINARY_LAYOUT:
+        pos += -pos % BINARY_ALIGNMENT
+        positions[name] = (pos, typecode)
+        length = num_nodes + 1 if name == "offsets" else \
+            num_nodes if name in ("latitudes", "longitudes") else num_arcs
+        pos += length * struct.calcsize(typecode)
+    positions["end"] = pos
+    return positions
+
+
+def counting_sort_order(num_nodes, keys):
+    """Return (offsets, order) of a stable counting sort by node id.
+
+    keys[order[j]] is the j-th smallest key, and the entries with key u
+    are at positions offsets[u] to offsets[u + 1] - 1 of order. If keys
+    is already sorted, order is None.
+
+    >>> offsets, order = counting_sort_order(3, array("i", [2, 0, 2, 0]))
+    >>> list(offsets), list(order)
+    ([0, 2, 2, 4], [1, 3, 0, 2])
+    """
+    num_keys = len(keys)
+    # Count keys per node and compute prefix sums.
+    offsets = array("q", [0]) * (num_nodes + 1)
+    for key in keys:
+        offsets[key + 1] += 1
+    for i in range(num_nodes):
+        offsets[i + 1] += offsets[i]
+    if all(keys[i] <= keys[i + 1] for i in range(num_keys - 1)):
+        return (offsets, None)
+    positions = array("q", offsets[:-1])
+    order = array("q", [0]) * num_keys
+    for i in range(num_keys):
+        order[positions[keys[i]]] = i
+        positions[keys[i]] += 1
+    return (offsets, order)
+
+
+def build_csr_arrays(num_nodes, tails, heads, distances, max_speeds):
+    """Group arcs by tail node (stable counting sort) and compute offsets.
+
+    Returns (offsets, heads, distances, max_speeds).
+
+    >>> csr = build_csr_arrays(3, array("i", [2, 0, 2, 0]),
+    ...                        array("i", [0, 1, 1, 2]),
+    ...                        array("i", [5, 6, 7, 8]),
+    ...                        array("i", [30, 30, 50, 50]))
+    >>> [list(a) for a in csr]
+    [[0, 2, 2, 4], [1, 2, 0, 1], [6, 8, 5, 7], [30, 50, 30, 50]]
+    """
+    (offsets, order) = counting_sort_order(num_nodes, tails)
+    # Arcs are usually already grouped by tail node in .graph files.
+    if order is None:
+        return (offsets, heads, distances, max_speeds)
+    return (offsets, array("i", [heads[i] for i in order]),
+            array("i", [distances[i] for i in order]),
+            array("i", [max_speeds[i] for i in order]))
+
+
+def travel_time_costs(distances, max_speeds, max_vehicle_speed,
+                      rounded=True):
+    """Return the travel times of arcs in whole seconds as array("i").
+
+    The speed on an arc is the smaller of its max_speed and the
+    max_vehicle_speed (both in km/h). The meters per second are computed
+    once per distinct max_speed, not once per arc. With rounded=False,
+    the exact travel times are returned as array("d").
+
+    >>> list(travel_time_costs([30, 70, 20], [30, 30, 15], 20))
+    [5, 13, 5]
+    >>> ["%.2f" % t for t in travel_time_costs([30], [30], 20, False)]
+    ['5.40']
+    """
+    meters_per_second = {}
+    for max_speed in set(max_speeds):
+        meters_per_second[max_speed] = min(max_speed, max_vehicle_speed) / 3.6
+    if not rounded:
+        return array("d", [distance / meters_per_second[max_speed]
+                           for distance, max_speed
+                           in zip(distances, max_speeds)])
+    return array("i", [round(distance / meters_per_second[max_speed])
+                       for distance, max_speed in zip(distances, max_speeds)])
+
+
+def binary_cache_path(file_name):
+    """Return the path of the binary sidecar of a .graph file."""
+    return file_name + ".bin"
+
+
+def write_binary_graph(file_name, arrays, source_stat=None):
+    """Write CSR arrays (in BINARY_LAYOUT order) to a binary graph file.
+
+    If source_stat is given, the size and modification time of the .graph
+    file the arrays were read from are stored, so that a stale sidecar
+    can be detected. The file is written to a temporary name first and
+    then renamed, so readers never see a half written file.
+    """
+    num_nodes = len(arrays[0]) - 1
+    num_arcs = len(arrays[3])
+    source_size, source_mtime = -1, -1
+    if source_stat is not None:
+        source_size = source_stat.st_size
+        source_mtime = source_stat.st_mtime_ns
+    tmp_file_name = "%s.tmp%d" % (file_name, os.getpid())
+    with open(tmp_file_name, "wb") as f:
+        f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0,
+                                   num_nodes, num_arcs, source_size,
+                                   source_mtime))
+        for values, (name, typecode) in zip(arrays, BINARY_LAYOUT):
+            f.write(bytes(-f.tell() % BINARY_ALIGNMENT))
+            if not isinstance(values, array) or values.typecode != typecode:
+                values = array(typecode, values)
+            f.write(values)
+    os.replace(tmp_file_name, file_name)
+
+
+def open_binary_graph(file_name, source_stat=None):
+    """Memory-map a binary graph file written by write_binary_graph().
+
+    Returns (mmap object, arrays) where the arrays are read-only
+    zero-copy memoryviews into the mapping, in BINARY_LAYOUT order.
+    If source_stat is given and does not match the stored size and
+    modification time, None is returned.
+    """
+    with open(file_name, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (magic, version, _, num_nodes, num_arcs, source_size,
+     source_mtime) = BINARY_HEADER.unpack_from(mapping)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        mapping.close()
+        raise Exception("%s is not a binary graph file" % file_name)
+    if source_stat is not None and (
+            source_size != source_stat.st_size or
+            source_mtime != source_stat.st_mtime_ns):
+        mapping.close()
+        return None
+    buf = memoryview(mapping)
+    positions = _binary_positions(num_nodes, num_arcs)
+    arrays = []
+    for name, typecode in BINARY_LAYOUT:
+        pos = positions[name][0]
+        length = num_nodes + 1 if name == "offsets" else \
+            num_nodes if name in ("latitudes", "longitudes") else num_arcs
+        num_bytes = length * struct.calcsize(typecode)
+        arrays.append(buf[pos:pos + num_bytes].cast(typecode))
+    return (mapping, arrays)
+
+
+# The graph of a worker process of a pool, see run_in_worker_processes().
+_worker_graph = None
+
+
+def _init_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _call_on_worker_graph(function, args):
+    return function(_worker_graph, *args)
+
+
+def run_in_worker_processes(graph, function, chunks, num_processes):
+    """Return [function(graph, *args) for args in chunks], in parallel.
+
+    The chunks are spread over a pool of num_processes worker processes.
+    Every worker receives the graph once when it starts: with the "fork"
+    start method (the default on Linux) the worker shares the parent's
+    memory copy-on-write, otherwise the graph is pickled (a CSRGraph read
+    from a binary file just maps the same file again). The function must
+    be defined at module level so that it can be sent to the workers, and
+    should return compact results like arrays.
+
+    >>> g = CSRGraph()
+    >>> g.read_graph_from_file("test.graph")
+    >>> run_in_worker_processes(g, Graph.get_num_arcs, [(), ()], 2)
+    [6, 6]
+    """
+    if num_processes <= 1 or len(chunks) <= 1:
+        return [function(graph, *args) for args in chunks]
+    with ProcessPoolExecutor(num_processes, initializer=_init_worker,
+                             initargs=(graph,)) as executor:
+        return list(executor.map(_call_on_worker_graph,
+                                 [function] * len(chunks), chunks))
+
+
+def _split_into_chunks(items, num_processes):
+    """Split a list into chunks, a few per process to even out their
+    running times."""
+    chunk_size = max(1, len(items) // (4 * num_processes))
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def _shortest_path_trees(graph, sources, reverse, tracebacks):
+    if reverse:
+        dijkstra = Dijkstra(graph, reverse=True)
+    else:
+        dijkstra = graph._get_search(Dijkstra)
+    trees = []
+    for source in sources:
+        dijkstra.run(source)
+        trees.append((array("d", dijkstra.distances),
+                      array("q", dijkstra.traceback_arcs)
+                      if tracebacks else None))
+    return trees
+
+
+def _isochrones(graph, sources, max_costs, bitset):
+    return [graph.compute_isochrone(source, max_costs, bitset)
+            for source in sources]
+
+
+def _distance_matrix_rows(graph, sources, targets):
+    dijkstra = graph._get_search(Dijkstra)
+    rows = []
+    for source in sources:
+        if not targets:
+            rows.append(array("d"))
+            continue
+        dijkstra.run(source, targets=targets)
+        distances = dijkstra.distances
+        rows.append(array("d", [distances[target] for target in targets]))
+    return rows
 
 
 class Graph:
@@ -13,8 +579,37 @@ class Graph:
         self._nodes = []
         # List of lists for storing edge objects for each node.
         self._adjacency_lists = []
+        # Memory mapping of a binary graph file, if read from one.
+        self._mmap = None
+        self._binary_file_name = None
+        # Arrays for the search code, see _search_arrays().
+        self._search_cache = None
+        self._search_costs = None
+        # Reverse search arrays, see _reverse_search_arrays().
+        self._reverse_cache = None
+        self._reverse_costs = None
+        # Search objects of this process, see _get_search().
+        self._searches = {}
+        # Node ids in the graph this one was cut out of, see
+        # compute_subgraph().
+        self._original_node_ids = None
+        # Current cost mode, None for costs = distance.
+        self._max_vehicle_speed = None
+        # Travel time costs by max vehicle speed, see _cost_profile().
+        self._cost_profiles = {}
+        # Whether the search costs were copied for update_arc_costs().
+        self._private_costs = False
+        # Node coordinates as arrays, see _coordinates().
+        self._coordinate_cache = None
+        # Arc distances and max speeds as arrays, see _arc_arrays().
+        self._arc_cache = None
+        # (search costs, A* costs, factor) of the A* heuristic by
+        # exact_travel_times, see _astar_costs().
+        self._heuristic_cache = {}
+        # Nearest node index, see get_grid_index().
+        self._grid_index = None
 
-    def read_graph_from_file(self, file_name):
+    def read_graph_from_file(self, file_name, use_binary_cache=False):
         """ Read in graph from .graph file.
 
         Specification of .graph file format:
@@ -26,42 +621,311 @@ class Graph:
                 tail_node_id head_node_id distance(m) max_speed(km/h)
         Comment lines (^#) are ignored
 
+        With use_binary_cache=True, the parsed graph is also written to a
+        binary sidecar file (see binary_cache_path()), which later calls
+        memory-map instead of parsing the text file again. The sidecar is
+        rewritten when the size or modification time of the .graph file
+        changes.
+
         >>> graph = Graph()
         >>> graph.read_graph_from_file("test.graph")
         >>> graph
         [0->1(30), 0->2(70), 1->2(20), 2->3(50), 3->1(40), 4->3(20)]
+        >>> import os, shutil, tempfile
+        >>> tmp_dir = tempfile.mkdtemp()
+        >>> file_name = os.path.join(tmp_dir, "test.graph")
+        >>> _ = shutil.copy("test.graph", file_name)
+        >>> graph = Graph()
+        >>> graph.read_graph_from_file(file_name, use_binary_cache=True)
+        >>> os.path.exists(binary_cache_path(file_name))
+        True
+        >>> graph = Graph()
+        >>> graph.read_graph_from_file(file_name, use_binary_cache=True)
+        >>> graph
+        [0->1(30), 0->2(70), 1->2(20), 2->3(50), 3->1(40), 4->3(20)]
+        >>> shutil.rmtree(tmp_dir)
         """
-        c_lines = 0
-        with open(file_name) as f:
-            for line in f:
-                cols = line.strip().split(" ")
-                # Skip comment lines.
-                if re.search("^#", cols[0]):
-                    continue
-                c_lines += 1
-                if c_lines == 1:
-                    if self._num_nodes != 0:
-                        raise Exception("Graph already read in")
-                    self._num_nodes = int(cols[0])
-                elif c_lines == 2:
-                    self._num_arcs = int(cols[0])
-                elif c_lines <= self._num_nodes + 2:  # all node info lines.
-                    if not len(cols) == 3:
-                        raise Exception("Node info line with != 3 cols")
-                    node = Node(int(cols[0]), float(cols[1]), float(cols[2]))
-                    # Append node to list.
-                    self._nodes.append(node)
-                    # Append empty adjacency list for node.
-                    self._adjacency_lists.append([])
-                else:  # all arc info lines.
-                    if not len(cols) == 4:
-                        raise Exception("Arc info line with != 4 cols")
-                    tail_node_id = int(cols[0])
-                    arc = Arc(tail_node_id, int(cols[1]), int(cols[2]),
-                              int(cols[3]))
-                    # Append arc to tail node's adjacency list.
-                    self._adjacency_lists[tail_node_id].append(arc)
-        f.closed
+        if self._num_nodes != 0:
+            raise Exception("Graph already read in")
+        if use_binary_cache:
+            cache_file_name = binary_cache_path(file_name)
+            source_stat = os.stat(file_name)
+            if os.path.exists(cache_file_name):
+                opened = open_binary_graph(cache_file_name, source_stat)
+                if opened is not None:
+                    self._load_arrays(*opened[1])
+                    self._mmap = opened[0]
+                    self._binary_file_name = os.path.abspath(
+                        cache_file_name)
+                    return
+        (latitudes, longitudes, tails, heads, distances, max_speeds) \
+            = read_graph_arrays(file_name)
+        (offsets, heads, distances, max_speeds) = build_csr_arrays(
+            len(latitudes), tails, heads, distances, max_speeds)
+        arrays = (offsets, latitudes, longitudes, heads, distances,
+                  max_speeds)
+        if use_binary_cache:
+            write_binary_graph(cache_file_name, arrays, source_stat)
+        self._load_arrays(*arrays)
+
+    def read_graph_from_binary_file(self, file_name):
+        """Read in graph from a binary graph file.
+
+        Binary graph files are written by write_graph_to_binary_file().
+        The file is memory-mapped read-only. A CSRGraph uses the mapped
+        arrays directly without copying them, so any number of processes
+        opening the same file share one physical copy of the node and
+        arc arrays in the page cache.
+
+        >>> import os, tempfile
+        >>> graph = Graph()
+        >>> graph.read_graph_from_file("test.graph")
+        >>> tmp_dir = tempfile.mkdtemp()
+        >>> file_name = os.path.join(tmp_dir, "test.bin")
+        >>> graph.write_graph_to_binary_file(file_name)
+        >>> graph = Graph()
+        >>> graph.read_graph_from_binary_file(file_name)
+        >>> graph
+        [0->1(30), 0->2(70), 1->2(20), 2->3(50), 3->1(40), 4->3(20)]
+        >>> os.remove(file_name)
+        >>> os.rmdir(tmp_dir)
+        """
+        if self._num_nodes != 0:
+            raise Exception("Graph already read in")
+        (mapping, arrays) = open_binary_graph(file_name)
+        self._load_arrays(*arrays)
+        self._mmap = mapping
+        self._binary_file_name = os.path.abspath(file_name)
+
+    def write_graph_to_binary_file(self, file_name):
+        """Write graph to a binary graph file (see write_binary_graph)."""
+        write_binary_graph(file_name, self._csr_arrays())
+
+    def write_graph_to_file(self, file_name):
+        """Write graph to a .graph file (see write_graph_file()).
+
+        >>> import os, shutil, tempfile
+        >>> graph = CSRGraph()
+        >>> graph.read_graph_from_file("test2.graph")
+        >>> tmp_dir = tempfile.mkdtemp()
+        >>> file_name = os.path.join(tmp_dir, "copy.graph")
+        >>> graph.write_graph_to_file(file_name)
+        >>> copy = Graph()
+        >>> copy.read_graph_from_file(file_name)
+        >>> repr(copy) == repr(graph)
+        True
+        >>> shutil.rmtree(tmp_dir)
+        """
+        write_graph_file(file_name, self._csr_arrays())
+
+    def _csr_arrays(self):
+        """Return the graph as CSR arrays (in BINARY_LAYOUT order)."""
+        offsets = array("q", [0])
+        heads = array("i")
+        distances = array("i")
+        max_speeds = array("i")
+        for adjacency_list in self._adjacency_lists:
+            for arc in adjacency_list:
+                heads.append(arc.head_node_id)
+                distances.append(arc.distance)
+                max_speeds.append(arc.max_speed)
+            offsets.append(len(heads))
+        latitudes = array("d", [node._latitude for node in self._nodes])
+        longitudes = array("d", [node._longitude for node in self._nodes])
+        return (offsets, latitudes, longitudes, heads, distances, max_speeds)
+
+    def _search_arrays(self):
+        """Return the (offsets, heads, costs) arrays the search code uses.
+
+        They are built from the adjacency lists on first use; the costs
+        are built again after the arc costs were changed.
+        """
+        if self._search_cache is None:
+            offsets = array("q", [0])
+            arcs = []
+            for adjacency_list in self._adjacency_lists:
+                arcs.extend(adjacency_list)
+                offsets.append(len(arcs))
+            heads = array("i", [arc.head_node_id for arc in arcs])
+            self._search_cache = (offsets, heads, arcs)
+        (offsets, heads, arcs) = self._search_cache
+        if self._search_costs is None:
+            self._search_costs = array("i", [arc.costs for arc in arcs])
+        return (offsets, heads, self._search_costs)
+
+    def _replace_search_costs(self, costs):
+        """Use the given array as the costs of the search arrays."""
+        self._search_costs = costs
+
+    def _get_arc(self, arc_index):
+        """Return the Arc at the given position of the search arrays."""
+        self._search_arrays()
+        return self._search_cache[2][arc_index]
+
+    def _reverse_search_arrays(self):
+        """Return (offsets, tails, costs, arc_ids) of the reversed graph.
+
+        The arcs entering node v are at positions offsets[v] to
+        offsets[v + 1] - 1; arc_ids maps them to their position in the
+        forward search arrays. The costs follow changes of the forward
+        costs.
+
+        >>> g = CSRGraph()
+        >>> g.read_graph_from_file("test.graph")
+        >>> [list(a) for a in g._reverse_search_arrays()]
+        [[0, 0, 2, 4, 6, 6], [0, 3, 0, 1, 2, 4], [30, 40, 70, 20, 50, 20], \
+[0, 4, 1, 2, 3, 5]]
+        """
+        (offsets, heads, costs) = self._search_arrays()
+        if self._reverse_cache is None:
+            tails = array("i")
+            for node_id in range(self._num_nodes):
+                tails.extend([node_id] * (offsets[node_id + 1] -
+                                          offsets[node_id]))
+            (reverse_offsets, order) = counting_sort_order(self._num_nodes,
+                                                           heads)
+            if order is None:
+                order = array("q", range(len(heads)))
+            reverse_tails = array("i", [tails[i] for i in order])
+            self._reverse_cache = (reverse_offsets, reverse_tails, order)
+        (reverse_offsets, reverse_tails, arc_ids) = self._reverse_cache
+        if self._reverse_costs is None or self._reverse_costs[0] is not costs:
+            self._reverse_costs = (costs, array("i", [costs[i]
+                                                      for i in arc_ids]))
+        return (reverse_offsets, reverse_tails, self._reverse_costs[1],
+                arc_ids)
+
+    def _coordinates(self):
+        """Return the (latitudes, longitudes) of all nodes as arrays."""
+        if self._coordinate_cache is None:
+            self._coordinate_cache = (
+                array("d", [node._latitude for node in self._nodes]),
+                array("d", [node._longitude for node in self._nodes]))
+        return self._coordinate_cache
+
+    def _arc_arrays(self):
+        """Return (distances, max_speeds) of the arcs as arrays, indexed
+        like the search arrays."""
+        if self._arc_cache is None:
+            arcs = [arc for adjacency_list in self._adjacency_lists
+                    for arc in adjacency_list]
+            self._arc_cache = (array("i", [arc.distance for arc in arcs]),
+                               array("i", [arc.max_speed for arc in arcs]))
+        return self._arc_cache
+
+    def _max_arc_speed(self):
+        """Return the largest max_speed of all arcs."""
+        return max([arc.max_speed for adjacency_list in self._adjacency_lists
+                    for arc in adjacency_list] or [1])
+
+    def _astar_costs(self, exact_travel_times=False):
+        """Return (costs, factor): the arc costs A* searches on and the
+        factor that turns great-circle distances into a lower bound of
+        them.
+
+        These are the search costs, with factor 1 for costs = distance
+        and 3.6 / v (seconds per meter) for costs = travel time, where v
+        is the largest speed possible on any arc. With exact_travel_times
+        and costs = travel time, the costs are the unrounded travel times
+        instead (arcs changed by update_arc_costs() keep their new
+        costs), see TravelTimeAStar. Then the factor is lowered, if
+        needed, so that factor * great-circle distance(u, v) <= costs of
+        every arc (u, v). This keeps the A* heuristic consistent where
+        arc lengths or rounded travel times are smaller than the straight
+        line distance; an arc with costs 0 between distinct coordinates
+        (e.g. a short arc whose travel time rounds to 0 s) makes the
+        factor 0.
+
+        >>> g = Graph()
+        >>> g.read_graph_from_file("test.graph")
+        >>> "%.3f" % g._astar_costs()[1]
+        '0.002'
+        >>> g.set_arc_costs_to_travel_time(100)
+        >>> list(g._astar_costs()[0])
+        [4, 8, 2, 6, 5, 2]
+        >>> ["%.2f" % c for c in g._astar_costs(True)[0]]
+        ['3.60', '8.40', '2.40', '6.00', '4.80', '2.40']
+        """
+        (offsets, heads, costs) = self._search_arrays()
+        if self._max_vehicle_speed is None:
+            exact_travel_times = False
+        cache = self._heuristic_cache.get(exact_travel_times)
+        if cache is not None and cache[0] is costs:
+            return cache[1:]
+        if self._max_vehicle_speed is None:
+            astar_costs = costs
+            factor = 1.0
+        else:
+            speed = min(self._max_arc_speed(), self._max_vehicle_speed)
+            astar_costs = costs
+            if exact_travel_times:
+                (distances, max_speeds) = self._arc_arrays()
+                astar_costs = travel_time_costs(distances, max_speeds,
+                                                speed, rounded=False)
+                if self._private_costs:
+                    # Arcs whose costs differ from the rounded travel
+                    # time were changed by update_arc_costs().
+                    astar_costs = array("d", [
+                        exact if round(exact) == rounded else rounded
+                        for exact, rounded in zip(astar_costs, costs)])
+            factor = 3.6 / speed
+        (latitudes, longitudes) = self._coordinates()
+        for node_id in range(self._num_nodes):
+            for i in range(offsets[node_id], offsets[node_id + 1]):
+                head_node_id = heads[i]
+                distance = great_circle_distance(
+                    latitudes[node_id], longitudes[node_id],
+                    latitudes[head_node_id], longitudes[head_node_id])
+                if astar_costs[i] < factor * distance:
+                    factor = astar_costs[i] / distance
+        self._heuristic_cache[exact_travel_times] = (costs, astar_costs,
+                                                     factor)
+        return (astar_costs, factor)
+
+    def _search_fingerprint(self):
+        """Return a checksum of the search arrays (structure and costs).
+
+        Files with preprocessed data (e.g. landmarks) store it to detect
+        that they belong to a different graph or cost profile.
+        """
+        (offsets, heads, costs) = self._search_arrays()
+        checksum = zlib.crc32(memoryview(offsets).cast("B"))
+        checksum = zlib.crc32(memoryview(heads).cast("B"), checksum)
+        return zlib.crc32(memoryview(costs).cast("B"), checksum)
+
+    def _get_search(self, search_class):
+        """Return the search object of the given class for this process.
+
+        It is created on first use and reused by later queries.
+        """
+        search = self._searches.get(search_class)
+        if search is None:
+            search = search_class(self)
+            self._searches[search_class] = search
+        return search
+
+    def __getstate__(self):
+        """Leave out the memory mapping and the search state."""
+        state = self.__dict__.copy()
+        state["_mmap"] = None
+        state["_reverse_costs"] = None
+        state["_heuristic_cache"] = {}
+        state["_cost_profiles"] = {}
+        state["_grid_index"] = None
+        state["_searches"] = {}
+        return state
+
+    def _load_arrays(self, offsets, latitudes, longitudes, heads, distances,
+                     max_speeds):
+        """Set up the graph from CSR arrays (in BINARY_LAYOUT order)."""
+        self._num_nodes = len(latitudes)
+        self._num_arcs = len(heads)
+        for node_id in range(self._num_nodes):
+            self._nodes.append(Node(node_id, latitudes[node_id],
+                                    longitudes[node_id]))
+            self._adjacency_lists.append([
+                Arc(node_id, heads[i], distances[i], max_speeds[i])
+                for i in range(offsets[node_id], offsets[node_id + 1])])
 
     def get_num_nodes(self):
         """Return number of nodes in graph."""
@@ -71,11 +935,13 @@ class Graph:
         """Return number of arcs in graph."""
         return self._num_arcs
 
-    def compute_reachable_nodes(self, node_id):
+    def compute_reachable_nodes(self, node_id, stats=None):
         """Mark all nodes reachable from given node.
 
         Implemented as breadth first search (BFS)
         Returns the number of reachable nodes (incl. start node)
+        If stats (a SearchStats object) is given, the search is counted
+        and timed in it.
         >>> graph = Graph()
         >>> graph.read_graph_from_file("test2.graph")
         >>> graph.compute_reachable_nodes(0)[1]
@@ -84,7 +950,15 @@ class Graph:
         6
         >>> graph.compute_reachable_nodes(6)[1]
         1
+        >>> levels = {}
+        >>> stats = SearchStats(on_settle=levels.__setitem__)
+        >>> graph.compute_reachable_nodes(4, stats)[1]
+        6
+        >>> stats.settled, stats.arcs_relaxed, levels[1]
+        (6, 8, 2)
         """
+        if stats is not None:
+            return self._compute_reachable_nodes_with_stats(node_id, stats)
         # List of nodes to visit currently.
         current_level = [node_id]
         # Create list of marked nodes, marking reachable nodes with 1.
@@ -108,6 +982,42 @@ class Graph:
             current_level = next_level
         return (marked_nodes, num_marked_nodes)
 
+    def _compute_reachable_nodes_with_stats(self, node_id, stats):
+        """compute_reachable_nodes() on the search arrays, counting every
+        step in stats."""
+        start_time = time.perf_counter()
+        (offsets, heads, _) = self._search_arrays()
+        on_settle = stats.on_settle
+        current_level = [node_id]
+        marked_nodes = [0] * self._num_nodes
+        marked_nodes[node_id] = 1
+        num_marked_nodes = 1
+        stats.heap_pushes += 1
+        search_start_time = time.perf_counter()
+        stats.add_phase_time("reset", search_start_time - start_time)
+        level = 0
+        while len(current_level) > 0:
+            next_level = []
+            for curr_node_id in current_level:
+                stats.heap_pops += 1
+                stats.settled += 1
+                if on_settle is not None:
+                    on_settle(curr_node_id, level)
+                for i in range(offsets[curr_node_id],
+                               offsets[curr_node_id + 1]):
+                    stats.arcs_relaxed += 1
+                    head_node_id = heads[i]
+                    if not marked_nodes[head_node_id]:
+                        stats.arcs_improved += 1
+                        marked_nodes[head_node_id] = 1
+                        num_marked_nodes += 1
+                        next_level.append(head_node_id)
+                        stats.heap_pushes += 1
+            current_level = next_level
+            level += 1
+        stats.add_phase_time("search", time.perf_counter() - search_start_time)
+        return (marked_nodes, num_marked_nodes)
+
     def set_arc_costs_to_travel_time(self, max_vehicle_speed):
         """Set arc costs to travel time in whole seconds.
 
@@ -119,14 +1029,13 @@ class Graph:
         >>> graph
         [0->1(4), 0->2(8), 1->2(2), 2->3(6), 3->1(5), 4->3(2)]
         """
-        for i in range(self._num_nodes):
-            for arc in self._adjacency_lists[i]:
-                # Compute max possible speed for this arc.
-                max_speed = min(arc.max_speed, int(max_vehicle_speed))
-                # Compute travel time in whole seconds.
-                travel_time_sec = "%.0f" % (arc.distance / (max_speed / 3.6))
-                # Set costs to travel time in whole seconds.
-                arc.costs = int(travel_time_sec)
+        costs = self._cost_profile(max_vehicle_speed)
+        arcs = self._search_cache[2]
+        for i in range(len(arcs)):
+            arcs[i].costs = costs[i]
+        self._search_costs = costs
+        self._private_costs = False
+        self._max_vehicle_speed = int(max_vehicle_speed)
 
     def set_arc_costs_to_distance(self):
         """Set arc costs to distance.
@@ -143,69 +1052,717 @@ class Graph:
         for i in range(self._num_nodes):
             for arc in self._adjacency_lists[i]:
                 arc.costs = arc.distance
+        self._search_costs = None
+        self._private_costs = False
+        self._max_vehicle_speed = None
+
+    def update_arc_costs(self, changes):
+        """Change the costs of some arcs, e.g. after a traffic update.
+
+        changes is a list of (tail_node_id, head_node_id, costs) triples;
+        all arcs from the tail to the head node get the new costs. The
+        changes last until the next set_arc_costs_to_*() call. The result
+        of the last compute_shortest_paths() is repaired instead of
+        computed again, see Dijkstra.update(). Returns the changed arcs as
+        (arc position, old costs) pairs, to repair other data with, see
+        Landmarks.update().
+        >>> g = CSRGraph()
+        >>> g.read_graph_from_file("test2.graph")
+        >>> g.compute_shortest_paths(4)
+        >>> g.update_arc_costs([(4, 5, 100), (3, 1, 5)])
+        [(6, 30), (4, 40)]
+        >>> [g.get_distance(v) for v in range(7)]
+        [inf, 25.0, 45.0, 20.0, 0.0, 100.0, 110.0]
+        >>> g.get_traceback_arc(2)
+        1->2(20)
+        >>> g.set_arc_costs_to_distance()
+        >>> g.get_traceback_arc(6)
+        5->6(10)
+
+        The A* heuristic is updated for the changed arcs only:
+        >>> g.set_arc_costs_to_travel_time(100)
+        >>> factor = g._astar_costs(True)[1]
+        >>> _ = g.update_arc_costs([(5, 2, 3)])
+        >>> (costs, new_factor) = g._astar_costs(True)
+        >>> costs[7], new_factor < factor
+        (3.0, True)
+        >>> g._heuristic_cache = {}
+        >>> g._astar_costs(True)[1] == new_factor
+        True
+
+        Costs 0 make the heuristic 0, so A* stays exact:
+        >>> g.set_arc_costs_to_distance()
+        >>> g.astar_shortest_path(5, 3)
+        (50.0, [5, 4, 3])
+        >>> _ = g.update_arc_costs([(4, 3, 0), (5, 4, 0)])
+        >>> g._astar_costs()[1]
+        0.0
+        >>> g.astar_shortest_path(5, 3)
+        (0.0, [5, 4, 3])
+        """
+        (offsets, heads, old_costs) = self._search_arrays()
+        costs = old_costs
+        if not self._private_costs:
+            # The costs may be shared, e.g. with a cost profile.
+            costs = array("i", old_costs)
+            self._replace_search_costs(costs)
+            self._private_costs = True
+        arcs = self._search_cache[2] if self._search_cache else None
+        changed_arcs = []
+        changed_tails = []
+        for (tail_node_id, head_node_id, new_costs) in changes:
+            found = False
+            for i in range(offsets[tail_node_id], offsets[tail_node_id + 1]):
+                if heads[i] == head_node_id:
+                    changed_arcs.append((i, costs[i]))
+                    changed_tails.append(tail_node_id)
+                    costs[i] = new_costs
+                    if arcs is not None:
+                        arcs[i].costs = new_costs
+                    found = True
+            if not found:
+                raise ValueError("no arc from %d to %d"
+                                 % (tail_node_id, head_node_id))
+        # Keep the reverse costs in sync instead of building them again.
+        if self._reverse_costs is not None and \
+                self._reverse_costs[0] is old_costs:
+            (reverse_offsets, _, arc_ids) = self._reverse_cache
+            reverse_costs = self._reverse_costs[1]
+            for (i, _) in changed_arcs:
+                head_node_id = heads[i]
+                for j in range(reverse_offsets[head_node_id],
+                               reverse_offsets[head_node_id + 1]):
+                    if arc_ids[j] == i:
+                        reverse_costs[j] = costs[i]
+            self._reverse_costs = (costs, reverse_costs)
+        # Keep the A* costs in sync, too. Only arcs that got cheaper than
+        # factor * great-circle distance lower the heuristic factor (to 0
+        # for costs 0 between distinct coordinates).
+        (latitudes, longitudes) = self._coordinates()
+        for (exact_travel_times, cache) in list(
+                self._heuristic_cache.items()):
+            del self._heuristic_cache[exact_travel_times]
+            if cache[0] is not old_costs:
+                continue
+            (_, astar_costs, factor) = cache
+            if astar_costs is old_costs:
+                astar_costs = costs
+            for ((i, _), tail_node_id) in zip(changed_arcs, changed_tails):
+                astar_costs[i] = costs[i]
+                distance = great_circle_distance(
+                    latitudes[tail_node_id], longitudes[tail_node_id],
+                    latitudes[heads[i]], longitudes[heads[i]])
+                if costs[i] < factor * distance:
+                    factor = costs[i] / distance
+            self._heuristic_cache[exact_travel_times] = (costs, astar_costs,
+                                                         factor)
+        dijkstra = self._searches.get(Dijkstra)
+        if dijkstra is not None:
+            dijkstra.update(changed_arcs)
+        return changed_arcs
+
+    def _cost_profile(self, max_vehicle_speed):
+        """Return the travel time costs for the given max vehicle speed.
+
+        The costs are computed once per speed (see travel_time_costs())
+        and kept, so that switching between vehicle profiles, e.g. car,
+        truck and bike, only computes each profile once. Speeds above the
+        largest max_speed of all arcs share one profile. The returned
+        array must not be modified.
+        >>> graph = CSRGraph()
+        >>> graph.read_graph_from_file("test.graph")
+        >>> graph._cost_profile(100) is graph._cost_profile(130)
+        True
+        """
+        max_vehicle_speed = int(max_vehicle_speed)
+        costs = self._cost_profiles.get(max_vehicle_speed)
+        if costs is not None:
+            return costs
+        speed = min(max_vehicle_speed, self._max_arc_speed())
+        costs = self._cost_profiles.get(speed)
+        if costs is None:
+            # Build the search arrays first, their arc order is the same.
+            self._search_arrays()
+            (_, _, _, _, distances, max_speeds) = self._csr_arrays()
+            costs = travel_time_costs(distances, max_speeds, speed)
+            self._cost_profiles[speed] = costs
+        self._cost_profiles[max_vehicle_speed] = costs
+        return costs
 
-    def compute_lcc(self, marked_nodes):
+    def compute_lcc(self, marked_nodes, strongly=False):
         """Mark all nodes in the largest connected component.
+
+        Sets marked_nodes to the sorted ids of the nodes in the largest
+        weakly connected component, or the largest strongly connected
+        component if strongly=True. Takes O(n + m) time, see
+        compute_weakly_connected_components() and
+        compute_strongly_connected_components().
         >>> graph = Graph()
         >>> graph.read_graph_from_file("test2.graph")
         >>> marked_nodes = []
         >>> graph.compute_lcc(marked_nodes)
         >>> print(marked_nodes)
-        [1, 2, 3, 4, 5, 6]
-        """
-        max_node_count = 0
-        max_node_list = []
-        uncheckedNodes = self._nodes
-        while len(uncheckedNodes):
-            currentNode = uncheckedNodes.pop()
-            (current_marked_nodes, current_node_count) \
-                = self.compute_reachable_nodes(currentNode._id)
-            # print(currentNode._id, current_marked_nodes)
-            marked_Indizes = []
-            for i in range(len(current_marked_nodes)):
-                # print(i, len(uncheckedNodes))
-                if current_marked_nodes[i] == 1:
-                    # and self._nodes[i+1] in uncheckedNodes:
-                    marked_Indizes.append(i)
-                    # uncheckedNodes.remove(self._nodes[i])
-            # print(marked_Indizes)
-            if current_node_count > max_node_count:
-                max_node_count = current_node_count
-                max_node_list = marked_Indizes
-        marked_nodes[:] = max_node_list[:]
-        # print("End: ", max_node_count, max_node_list)
-
-    def compute_shortest_paths(self, start_node_id):
+        [0, 1, 2, 3, 4, 5, 6]
+        >>> graph.compute_lcc(marked_nodes, strongly=True)
+        >>> print(marked_nodes)
+        [1, 2, 3]
+        >>> graph.get_num_nodes(), len(graph._nodes)
+        (7, 7)
+        """
+        if strongly:
+            (labels, sizes) = self.compute_strongly_connected_components()
+        else:
+            (labels, sizes) = self.compute_weakly_connected_components()
+        if not sizes:
+            marked_nodes[:] = []
+            return
+        largest = max(range(len(sizes)), key=lambda label: sizes[label])
+        marked_nodes[:] = [node_id for node_id in range(self._num_nodes)
+                           if labels[node_id] == largest]
+
+    def compute_weakly_connected_components(self):
+        """Label the weakly connected components (arc directions ignored).
+
+        Uses union-find with union by size and path halving over all arcs.
+        Returns (labels, sizes): labels[v] is the component of node v,
+        numbered in the order of their smallest node id, and sizes[c] is
+        the number of nodes in component c.
+        >>> graph = Graph()
+        >>> graph.read_graph_from_file("test.graph")
+        >>> (labels, sizes) = graph.compute_weakly_connected_components()
+        >>> list(labels), list(sizes)
+        ([0, 0, 0, 0, 0], [5])
+        """
+        (offsets, heads, costs) = self._search_arrays()
+        parents = array("i", range(self._num_nodes))
+        set_sizes = array("i", [1]) * self._num_nodes
+        for node_id in range(self._num_nodes):
+            for i in range(offsets[node_id], offsets[node_id + 1]):
+                # Find both roots (with path halving).
+                u = node_id
+                while parents[u] != u:
+                    parents[u] = parents[parents[u]]
+                    u = parents[u]
+                v = heads[i]
+                while parents[v] != v:
+                    parents[v] = parents[parents[v]]
+                    v = parents[v]
+                if u == v:
+                    continue
+                # Union by size.
+                if set_sizes[u] < set_sizes[v]:
+                    (u, v) = (v, u)
+                parents[v] = u
+                set_sizes[u] += set_sizes[v]
+        labels = array("i", [-1]) * self._num_nodes
+        sizes = array("i")
+        for node_id in range(self._num_nodes):
+            root = node_id
+            while parents[root] != root:
+                root = parents[root]
+            if labels[root] < 0:
+                labels[root] = len(sizes)
+                sizes.append(set_sizes[root])
+            labels[node_id] = labels[root]
+        return (labels, sizes)
+
+    def compute_strongly_connected_components(self):
+        """Label the strongly connected components.
+
+        Tarjan's algorithm with an explicit stack instead of recursion, so
+        it also works for long paths in road graphs. Returns (labels,
+        sizes) like compute_weakly_connected_components(); components are
+        numbered in the order Tarjan's algorithm finds them.
+        >>> graph = Graph()
+        >>> graph.read_graph_from_file("test2.graph")
+        >>> (labels, sizes) = graph.compute_strongly_connected_components()
+        >>> list(labels), list(sizes)
+        ([1, 0, 0, 0, 3, 3, 2], [3, 1, 1, 2])
+        """
+        (offsets, heads, costs) = self._search_arrays()
+        num_nodes = self._num_nodes
+        # DFS numbers and lowest DFS number reachable, -1 if not visited.
+        index = array("i", [-1]) * num_nodes
+        low = array("i", [0]) * num_nodes
+        on_stack = bytearray(num_nodes)
+        stack = []
+        labels = array("i", [-1]) * num_nodes
+        sizes = array("i")
+        counter = 0
+        for root in range(num_nodes):
+            if index[root] >= 0:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            # DFS call stack of (node, next arc position to look at).
+            call_stack = [(root, offsets[root])]
+            while call_stack:
+                (v, i) = call_stack[-1]
+                if i < offsets[v + 1]:
+                    call_stack[-1] = (v, i + 1)
+                    w = heads[i]
+                    if index[w] < 0:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = 1
+                        call_stack.append((w, offsets[w]))
+                    elif on_stack[w] and index[w] < low[v]:
+                        low[v] = index[w]
+                    continue
+                call_stack.pop()
+                if call_stack:
+                    u = call_stack[-1][0]
+                    if low[v] < low[u]:
+                        low[u] = low[v]
+                if low[v] == index[v]:
+                    # v is the root of a component, pop it off the stack.
+                    label = len(sizes)
+                    size = 0
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = 0
+                        labels[w] = label
+                        size += 1
+                        if w == v:
+                            break
+                    sizes.append(size)
+        return (labels, sizes)
+
+    def restrict_to_lcc(self, strongly=True, order="hilbert"):
+        """Return the largest connected component as a new graph.
+
+        See compute_lcc() and compute_subgraph(). By default the largest
+        strongly connected component is kept, in which every node can
+        reach every other node.
+        >>> graph = Graph()
+        >>> graph.read_graph_from_file("test2.graph")
+        >>> (lcc, old_to_new) = graph.restrict_to_lcc()
+        >>> lcc
+        [0->2(50), 1->0(20), 2->1(40)]
+        >>> list(old_to_new)
+        [-1, 1, 0, 2, -1, -1, -1]
+        """
+        marked_nodes = []
+        self.compute_lcc(marked_nodes, strongly)
+        return self.compute_subgraph(marked_nodes, order)
+
+    def compute_subgraph(self, node_ids, order="hilbert"):
+        """Return the subgraph induced by the given nodes as a new graph.
+
+        The new graph (of the same class) has the dense node ids
+        0, ..., len(node_ids) - 1 and keeps all arcs between the given
+        nodes. The new ids are assigned in the given order, to make
+        searches read the arrays mostly sequentially:
+            "hilbert": along a Hilbert curve over latitude / longitude,
+                so nearby nodes get nearby ids
+            "bfs": in breadth first search order
+            None: in the order of the old ids
+        Returns (subgraph, old_to_new) where old_to_new[v] is the new id of
+        old node v, or -1 if v is not in the subgraph. The subgraph's
+        _original_node_ids maps new ids back to old ones. The current cost
+        mode is kept.
+        >>> graph = CSRGraph()
+        >>> graph.read_graph_from_file("test2.graph")
+        >>> (subgraph, old_to_new) = graph.compute_subgraph([0, 1, 2, 6],
+        ...                                                 order="bfs")
+        >>> subgraph
+        [0->1(30), 0->2(70), 1->2(20)]
+        >>> list(subgraph._original_node_ids)
+        [0, 1, 2, 6]
+        """
+        (offsets, latitudes, longitudes, heads, distances,
+         max_speeds) = self._csr_arrays()
+        in_subgraph = bytearray(self._num_nodes)
+        for node_id in node_ids:
+            in_subgraph[node_id] = 1
+        node_ids = [v for v in range(self._num_nodes) if in_subgraph[v]]
+        if order == "hilbert" and node_ids:
+            min_latitude = min(latitudes[v] for v in node_ids)
+            min_longitude = min(longitudes[v] for v in node_ids)
+            scale = (1 << 16) - 1
+            extent = max(max(latitudes[v] for v in node_ids) - min_latitude,
+                         max(longitudes[v] for v in node_ids) -
+                         min_longitude) or 1.0
+            node_ids.sort(key=lambda v: hilbert_index(
+                int((longitudes[v] - min_longitude) / extent * scale),
+                int((latitudes[v] - min_latitude) / extent * scale)))
+        elif order == "bfs":
+            visited = bytearray(self._num_nodes)
+            bfs_order = []
+            for root in node_ids:
+                if visited[root]:
+                    continue
+                visited[root] = 1
+                bfs_order.append(root)
+                pos = len(bfs_order) - 1
+                while pos < len(bfs_order):
+                    node_id = bfs_order[pos]
+                    pos += 1
+                    for i in range(offsets[node_id], offsets[node_id + 1]):
+                        head_node_id = heads[i]
+                        if in_subgraph[head_node_id] and \
+                                not visited[head_node_id]:
+                            visited[head_node_id] = 1
+                            bfs_order.append(head_node_id)
+            node_ids = bfs_order
+        elif order is not None:
+            raise ValueError("unknown node order: %s" % order)
+        old_to_new = array("i", [-1]) * self._num_nodes
+        for new_id, old_id in enumerate(node_ids):
+            old_to_new[old_id] = new_id
+        new_offsets = array("q", [0])
+        new_heads = array("i")
+        new_distances = array("i")
+        new_max_speeds = array("i")
+        for old_id in node_ids:
+            for i in range(offsets[old_id], offsets[old_id + 1]):
+                head_node_id = old_to_new[heads[i]]
+                if head_node_id >= 0:
+                    new_heads.append(head_node_id)
+                    new_distances.append(distances[i])
+                    new_max_speeds.append(max_speeds[i])
+            new_offsets.append(len(new_heads))
+        subgraph = self.__class__()
+        subgraph._load_arrays(
+            new_offsets, array("d", [latitudes[v] for v in node_ids]),
+            array("d", [longitudes[v] for v in node_ids]), new_heads,
+            new_distances, new_max_speeds)
+        subgraph._original_node_ids = array("i", node_ids)
+        if self._max_vehicle_speed is not None:
+            subgraph.set_arc_costs_to_travel_time(self._max_vehicle_speed)
+        return (subgraph, old_to_new)
+
+    def get_grid_index(self):
+        """Return the GridIndex over the node coordinates.
+
+        It is built on first use and kept for later queries.
+        """
+        if self._grid_index is None:
+            self._grid_index = GridIndex(*self._coordinates())
+        return self._grid_index
+
+    def nearest_node(self, latitude, longitude, max_distance=float("Inf")):
+        """Return the id of the node nearest to the given coordinates.
+
+        Returns -1 if there is no node within max_distance meters.
+        >>> g = CSRGraph()
+        >>> g.read_graph_from_file("test2.graph")
+        >>> g.nearest_node(49.30, 7.20)
+        2
+        >>> g.nearest_node(49.30, 7.20, max_distance=100)
+        -1
+        """
+        return self.get_grid_index().nearest(latitude, longitude,
+                                             max_distance)
+
+    def k_nearest_nodes(self, latitude, longitude, k):
+        """Return the k nodes nearest to the given coordinates.
+
+        Returns (node id, distance in meters) pairs, nearest first.
+        >>> g = Graph()
+        >>> g.read_graph_from_file("test2.graph")
+        >>> [v for (v, _) in g.k_nearest_nodes(49.27, 7.31, 3)]
+        [6, 3, 4]
+        """
+        return self.get_grid_index().k_nearest(latitude, longitude, k)
+
+    def snap_to_nodes(self, coordinates, max_distance=float("Inf")):
+        """Return the nearest node ids of many (latitude, longitude) pairs.
+
+        Returns an array("i"), with -1 where there is no node within
+        max_distance meters.
+        """
+        return self.get_grid_index().snap(coordinates, max_distance)
+
+    def compute_shortest_paths(self, start_node_id, stats=None):
         """Compute the shortest paths for a given start node.
 
         Compute the shortest paths from the given start node
-        using Dijkstra's algorithm.
+        using Dijkstra's algorithm. The results are kept in arrays of this
+        process (see Dijkstra), not in the Node objects, and can be read
+        with get_distance() and get_traceback_arc(). Every call only
+        resets the entries the previous call touched. If stats (a
+        SearchStats object) is given, the search is counted and timed in
+        it.
         >>> g = Graph()
         >>> g.read_graph_from_file("test.graph")
         >>> g.compute_shortest_paths(1)
-        >>> ['%d(%.f)' % (node._id, node._distance) for node in g._nodes]
+        >>> ['%d(%.f)' % (i, g.get_distance(i)) for i in range(5)]
         ['0(inf)', '1(0)', '2(20)', '3(70)', '4(inf)']
+        >>> g.get_traceback_arc(3)
+        2->3(50)
+        >>> g.compute_shortest_paths(4)
+        >>> ['%d(%.f)' % (i, g.get_distance(i)) for i in range(5)]
+        ['0(inf)', '1(60)', '2(80)', '3(20)', '4(0)']
+        >>> g.set_arc_costs_to_travel_time(100)
+        >>> g.compute_shortest_paths(4)
+        >>> ['%d(%.f)' % (i, g.get_distance(i)) for i in range(5)]
+        ['0(inf)', '1(7)', '2(9)', '3(2)', '4(0)']
+        >>> stats = SearchStats()
+        >>> g.compute_shortest_paths(0, stats)
+        >>> stats.settled, stats.heap_pushes, stats.stale_pops
+        (4, 5, 1)
+        >>> stats.arcs_relaxed, stats.arcs_improved
+        (5, 4)
         """
-        ActiveNodes = queue.PriorityQueue()
-        self._nodes[start_node_id]._distance = 0
-        ActiveNodes.put((self._nodes[start_node_id]._distance,
-                         self._nodes[start_node_id]))
-        # ActiveNodes.put((3, self._nodes[start_node_id-1]))
-        # print(self._adjacency_lists[start_node_id])
-        while not ActiveNodes.empty():
-            (pri, node) = ActiveNodes.get()
-            # print(node._id)
-            if node._settled:
-                continue
-            node._settled = True
-            for arc in self._adjacency_lists[node._id]:
-                newNode = arc.head_node_id
-                newCosts = node._distance + arc.costs
-                if newCosts < self._nodes[newNode]._distance:
-                    # print(newCosts, newNode)
-                    self._nodes[newNode]._traceback_arc = arc
-                    self._nodes[newNode]._distance = newCosts
-                    ActiveNodes.put((newCosts, self._nodes[newNode]))
+        self._get_search(Dijkstra).run(start_node_id, stats=stats)
+
+    def get_distance(self, node_id):
+        """Return the distance computed by compute_shortest_paths()."""
+        return self._get_search(Dijkstra).distances[node_id]
+
+    def get_traceback_arc(self, node_id):
+        """Return the last arc on the shortest path to the given node.
+
+        Returns None for the start node and for unreachable nodes.
+        """
+        arc_index = self._get_search(Dijkstra).traceback_arcs[node_id]
+        if arc_index < 0:
+            return None
+        return self._get_arc(arc_index)
+
+    def get_path(self, target):
+        """Return the Path to the target found by the last search.
+
+        The last search is that of compute_shortest_paths() (or
+        shortest_path()). Returns None if the target was not reached.
+        >>> g = CSRGraph()
+        >>> g.read_graph_from_file("test2.graph")
+        >>> g.compute_shortest_paths(4)
+        >>> g.get_path(2)
+        Path([4, 5, 2], costs=50, distance=50, travel_time=12.0)
+        >>> g.get_path(2).get_arcs()
+        [4->5(30), 5->2(20)]
+        >>> g.get_path(0) is None
+        True
+        """
+        return self.get_paths([target])[0]
+
+    def get_paths(self, targets):
+        """Return the Paths to many targets found by the last search.
+
+        Parts of the paths that the targets share are walked only once,
+        see Dijkstra.traceback_paths().
+        """
+        return self._get_search(Dijkstra).traceback_paths(targets)
+
+    def compute_paths(self, source, targets):
+        """Compute the shortest paths from the source to all targets.
+
+        Runs one Dijkstra search from the source, which stops as soon as
+        all targets are settled. Returns a list with a Path (or None, if
+        not reachable) for every target.
+        >>> g = Graph()
+        >>> g.read_graph_from_file("test2.graph")
+        >>> g.set_arc_costs_to_travel_time(30)
+        >>> [list(path.node_ids) for path in g.compute_paths(4, [1, 6])]
+        [[4, 3, 1], [4, 5, 6]]
+        >>> g.compute_paths(4, [1, 6])[0]
+        Path([4, 3, 1], costs=10, distance=60, travel_time=9.6)
+        """
+        targets = list(targets)
+        dijkstra = self._get_search(Dijkstra)
+        dijkstra.run(source, targets=targets)
+        return dijkstra.traceback_paths(targets)
+
+    def shortest_path(self, source, target):
+        """Compute the shortest path from source to target.
+
+        Runs Dijkstra's algorithm from source, but stops as soon as the
+        target is settled. Returns (distance, list of node ids on the
+        path), or (inf, []) if target is not reachable. Afterwards,
+        get_distance() and get_traceback_arc() return the results of
+        this (partial) search.
+        >>> g = Graph()
+        >>> g.read_graph_from_file("test2.graph")
+        >>> g.shortest_path(4, 2)
+        (50.0, [4, 5, 2])
+        >>> g.shortest_path(4, 4)
+        (0.0, [4])
+        >>> g.shortest_path(0, 4)
+        (inf, [])
+        """
+        dijkstra = self._get_search(Dijkstra)
+        dijkstra.run(source, target)
+        return (dijkstra.distances[target], dijkstra.traceback_path(target))
+
+    def compute_isochrone(self, source, max_costs, bitset=False):
+        """Compute all nodes within a cost budget from the source node.
+
+        Runs Dijkstra's algorithm from the source and stops at the first
+        node farther than max_costs, in the current arc costs (e.g.
+        seconds after set_arc_costs_to_travel_time()). Returns the ids of
+        the nodes within the budget in ascending order as array("i"), or
+        with bitset=True as a bytearray of num_nodes bits, where node v
+        is bit v % 8 of byte v // 8.
+        >>> g = CSRGraph()
+        >>> g.read_graph_from_file("test2.graph")
+        >>> list(g.compute_isochrone(4, 40))
+        [3, 4, 5, 6]
+        >>> g.compute_isochrone(4, 40, bitset=True)
+        bytearray(b'x')
+        >>> g.set_arc_costs_to_travel_time(50)
+        >>> list(g.compute_isochrone(4, 5))
+        [3, 4]
+        """
+        dijkstra = self._get_search(Dijkstra)
+        dijkstra.run(source, max_costs=max_costs)
+        settled = dijkstra.settled
+        node_ids = sorted([v for v in dijkstra._touched if settled[v]])
+        if not bitset:
+            return array("i", node_ids)
+        bits = bytearray((self._num_nodes + 7) // 8)
+        for v in node_ids:
+            bits[v >> 3] |= 1 << (v & 7)
+        return bits
+
+    def compute_isochrones(self, sources, max_costs, bitset=False,
+                           num_processes=1):
+        """Compute compute_isochrone() for many source nodes.
+
+        Returns one result per source. With num_processes > 1, the
+        sources are searched by a pool of worker processes (see
+        run_in_worker_processes()).
+        >>> g = CSRGraph()
+        >>> g.read_graph_from_file("test2.graph")
+        >>> [list(nodes) for nodes in g.compute_isochrones([0, 4], 30,
+        ...                                                num_processes=2)]
+        [[0, 1], [3, 4, 5]]
+        """
+        chunks = [(chunk, max_costs, bitset)
+                  for chunk in _split_into_chunks(list(sources),
+                                                  num_processes)]
+        results = []
+        for chunk_results in run_in_worker_processes(
+                self, _isochrones, chunks, num_processes):
+            results.extend(chunk_results)
+        return results
+
+    def compute_shortest_path_trees(self, sources, num_processes=1,
+                                    reverse=False, tracebacks=True):
+        """Compute the full shortest path tree of every source node.
+
+        Runs one independent Dijkstra search per source, with
+        num_processes > 1 on a pool of worker processes (see
+        run_in_worker_processes()), e.g. for all landmarks or for all
+        sources of a batch job. Returns a list with one pair
+        (distances, traceback_arcs) per source, an array("d") and an
+        array("q") indexed by node id like in Dijkstra. traceback_arcs is
+        None if tracebacks is False, which halves the data sent back from
+        the workers. With reverse=True, the searches run on the reversed
+        graph and give the distances to the sources instead.
+        >>> g = CSRGraph()
+        >>> g.read_graph_from_file("test2.graph")
+        >>> trees = g.compute_shortest_path_trees([4, 0], num_processes=2)
+        >>> list(trees[0][0])
+        [inf, 60.0, 50.0, 20.0, 0.0, 30.0, 40.0]
+        >>> list(trees[0][1])
+        [-1, 4, 7, 5, -1, 6, 9]
+        >>> trees = g.compute_shortest_path_trees([4], reverse=True,
+        ...                                       tracebacks=False)
+        >>> list(trees[0][0]), trees[0][1]
+        ([inf, inf, inf, inf, 0.0, 30.0, inf], None)
+        """
+        chunks = [(chunk, reverse, tracebacks)
+                  for chunk in _split_into_chunks(list(sources),
+                                                  num_processes)]
+        trees = []
+        for chunk_trees in run_in_worker_processes(
+                self, _shortest_path_trees, chunks, num_processes):
+            trees.extend(chunk_trees)
+        return trees
+
+    def distance_matrix(self, sources, targets, num_processes=1):
+        """Compute the distances from every source to every target.
+
+        Runs one Dijkstra search per source, which stops as soon as all
+        targets are settled. Returns a list with one row per source, where
+        row[j] is the distance to targets[j] (inf if it is not reachable),
+        as array("d") rows. With num_processes > 1, the sources are split
+        into chunks that are searched by a pool of worker processes (see
+        run_in_worker_processes()).
+        >>> g = CSRGraph()
+        >>> g.read_graph_from_file("test2.graph")
+        >>> [list(row) for row in g.distance_matrix([4, 0], [1, 2, 4])]
+        [[60.0, 50.0, 0.0], [30.0, 50.0, inf]]
+        >>> matrix = g.distance_matrix(range(7), range(7), num_processes=2)
+        >>> matrix == g.distance_matrix(range(7), range(7))
+        True
+        """
+        sources = list(sources)
+        targets = list(targets)
+        if num_processes <= 1:
+            return _distance_matrix_rows(self, sources, targets)
+        chunks = [(chunk, targets)
+                  for chunk in _split_into_chunks(sources, num_processes)]
+        rows = []
+        for chunk_rows in run_in_worker_processes(
+                self, _distance_matrix_rows, chunks, num_processes):
+            rows.extend(chunk_rows)
+        return rows
+
+    def astar_shortest_path(self, source, target, exact_travel_times=False):
+        """Compute the shortest path from source to target with A*.
+
+        Like shortest_path(), but the search is guided towards the target
+        by the great-circle distance to it, computed from the node
+        coordinates (see AStar). Returns (distance, node ids of the path).
+        With exact_travel_times and travel time costs, the search runs on
+        the unrounded travel times instead (see TravelTimeAStar), which
+        is faster where short arcs take 0 s when rounded, and the
+        distance is in fractional seconds.
+        >>> g = Graph()
+        >>> g.read_graph_from_file("test2.graph")
+        >>> g.astar_shortest_path(4, 2)
+        (50.0, [4, 5, 2])
+        >>> g.set_arc_costs_to_travel_time(100)
+        >>> g.astar_shortest_path(4, 1) == g.shortest_path(4, 1)
+        True
+        >>> (distance, path) = g.astar_shortest_path(4, 1, True)
+        >>> "%.2f" % distance, path
+        ('9.60', [4, 3, 1])
+        >>> g.astar_shortest_path(0, 4)
+        (inf, [])
+
+        Arcs of 0 m between distinct coordinates give a heuristic of 0:
+        >>> import os, tempfile
+        >>> with tempfile.TemporaryDirectory() as tmp_dir:
+        ...     file_name = os.path.join(tmp_dir, "zero.graph")
+        ...     with open(file_name, "w") as f:
+        ...         _ = f.write("3\\n3\\n0 49.0 7.0\\n1 49.0 6.863\\n"
+        ...                     "2 49.0 7.0685\\n0 2 5000 30\\n0 1 0 30\\n"
+        ...                     "1 2 0 30\\n")
+        ...     g = Graph()
+        ...     g.read_graph_from_file(file_name)
+        >>> g.astar_shortest_path(0, 2)
+        (0.0, [0, 1, 2])
+        """
+        astar = self._get_search(TravelTimeAStar if exact_travel_times
+                                 else AStar)
+        astar.run(source, target)
+        return (astar.distances[target], astar.traceback_path(target))
+
+    def bidirectional_shortest_path(self, source, target):
+        """Compute the shortest path from source to target.
+
+        Like shortest_path(), but searches forward from source and
+        backward from target (on the reversed graph) at the same time,
+        see BidirectionalDijkstra.
+        >>> g = CSRGraph()
+        >>> g.read_graph_from_file("test2.graph")
+        >>> g.bidirectional_shortest_path(4, 2)
+        (50.0, [4, 5, 2])
+        >>> g.bidirectional_shortest_path(4, 1)
+        (60.0, [4, 3, 1])
+        >>> g.bidirectional_shortest_path(2, 2)
+        (0.0, [2])
+        >>> g.bidirectional_shortest_path(0, 4)
+        (inf, [])
+        """
+        return self._get_search(BidirectionalDijkstra).run(source, target)
 
     def __repr__(self):
         """ Define object's string representation.
@@ -215,14 +1772,1044 @@ class Graph:
         >>> graph
         [0->1(30), 0->2(70), 1->2(20), 2->3(50), 3->1(40), 4->3(20)]
         """
-        obj_str_repr = ""
+        return "[" + ", ".join([repr(arc)
+                                for adjacency_list in self._adjacency_lists
+                                for arc in adjacency_list]) + "]"
+
+
+class CSRGraph(Graph):
+    """Graph stored in compressed sparse row (CSR) format.
+
+    Instead of one Node object per node and one Arc object per arc, all
+    information is kept in contiguous arrays. The arcs of node u are
+    stored at positions _offsets[u] to _offsets[u + 1] - 1 of the arc
+    arrays _heads, _distances, _max_speeds and _costs. Arcs of the same
+    tail node keep the order in which they appear in the .graph file.
+
+    When read from a binary graph file, the arrays are read-only views
+    into the memory-mapped file. Everything a computation writes (costs
+    set by the cost setters, shortest path results) lives in separate
+    arrays owned by the process, so the mapping itself is never modified.
+
+    >>> graph = CSRGraph()
+    >>> graph.read_graph_from_file("test.graph")
+    >>> graph
+    [0->1(30), 0->2(70), 1->2(20), 2->3(50), 3->1(40), 4->3(20)]
+    >>> list(graph._offsets)
+    [0, 2, 3, 4, 5, 6]
+    >>> list(graph._heads)
+    [1, 2, 2, 3, 1, 3]
+    """
+
+    def __init__(self):
+        Graph.__init__(self)
+        # Node arrays.
+        self._latitudes = array("d")
+        self._longitudes = array("d")
+        # Arc arrays, indexed via _offsets.
+        self._offsets = array("q", [0])
+        self._heads = array("i")
+        self._distances = array("i")
+        self._max_speeds = array("i")
+        self._costs = self._distances
+        # Read-only list-like view of the nodes.
+        self._nodes = _CSRNodeList(self)
+
+    def _load_arrays(self, offsets, latitudes, longitudes, heads, distances,
+                     max_speeds):
+        """Set up the graph from CSR arrays (in BINARY_LAYOUT order).
+
+        The arrays are used as they are, so memoryviews into a
+        memory-mapped binary graph file are not copied.
+        """
+        self._num_nodes = len(latitudes)
+        self._num_arcs = len(heads)
+        self._offsets = offsets
+        self._latitudes = latitudes
+        self._longitudes = longitudes
+        self._heads = heads
+        self._distances = distances
+        self._max_speeds = max_speeds
+        self._costs = distances
+        self._private_costs = False
+
+    def _csr_arrays(self):
+        """Return the graph as CSR arrays (in BINARY_LAYOUT order)."""
+        return (self._offsets, self._latitudes, self._longitudes,
+                self._heads, self._distances, self._max_speeds)
+
+    def _search_arrays(self):
+        """Return the (offsets, heads, costs) arrays the search code uses."""
+        return (self._offsets, self._heads, self._costs)
+
+    def _replace_search_costs(self, costs):
+        """Use the given array as the costs of the search arrays."""
+        self._costs = costs
+
+    def _coordinates(self):
+        """Return the (latitudes, longitudes) of all nodes as arrays."""
+        return (self._latitudes, self._longitudes)
+
+    def _arc_arrays(self):
+        """Return (distances, max_speeds) of the arcs as arrays."""
+        return (self._distances, self._max_speeds)
+
+    def _max_arc_speed(self):
+        """Return the largest max_speed of all arcs."""
+        return max(self._max_speeds) if self._num_arcs else 1
+
+    def __getstate__(self):
+        """Pickle a memory-mapped graph by its file name only.
+
+        Sending such a graph to a worker process (e.g. with
+        multiprocessing) makes the worker map the same file again instead
+        of receiving a copy of the arrays. Results of shortest path
+        computations are private to each process and are not sent along.
+
+        >>> import os, pickle, tempfile
+        >>> graph = CSRGraph()
+        >>> graph.read_graph_from_file("test.graph")
+        >>> tmp_dir = tempfile.mkdtemp()
+        >>> file_name = os.path.join(tmp_dir, "test.bin")
+        >>> graph.write_graph_to_binary_file(file_name)
+        >>> graph = CSRGraph()
+        >>> graph.read_graph_from_binary_file(file_name)
+        >>> type(graph._heads) is memoryview
+        True
+        >>> graph.set_arc_costs_to_travel_time(100)
+        >>> graph.compute_shortest_paths(1)
+        >>> copy = pickle.loads(pickle.dumps(graph))
+        >>> copy
+        [0->1(4), 0->2(8), 1->2(2), 2->3(6), 3->1(5), 4->3(2)]
+        >>> type(copy._heads) is memoryview, copy._searches == {}
+        (True, True)
+        >>> del graph, copy
+        >>> os.remove(file_name)
+        >>> os.rmdir(tmp_dir)
+        """
+        state = Graph.__getstate__(self)
+        del state["_nodes"]
+        if self._binary_file_name is not None:
+            for name, typecode in BINARY_LAYOUT:
+                del state["_" + name]
+            # Modified costs are private to this process, so copy them.
+            if self._costs is self._distances:
+                state["_costs"] = None
+            else:
+                state["_costs"] = array("i", self._costs)
+        return state
+
+    def __setstate__(self, state):
+        """Restore a pickled graph, mapping its binary file again."""
+        self.__dict__.update(state)
+        self._nodes = _CSRNodeList(self)
+        if self._binary_file_name is not None:
+            (self._mmap, arrays) = open_binary_graph(self._binary_file_name)
+            costs = self._costs
+            self._load_arrays(*arrays)
+            if costs is not None:
+                self._costs = costs
+
+    def _get_arc(self, arc_index):
+        """Return a new Arc object for the arc at the given CSR position."""
+        tail_node_id = bisect.bisect_right(self._offsets, arc_index) - 1
+        arc = Arc(tail_node_id, self._heads[arc_index],
+                  self._distances[arc_index], self._max_speeds[arc_index])
+        arc.costs = self._costs[arc_index]
+        return arc
+
+    def compute_reachable_nodes(self, node_id, stats=None):
+        """Mark all nodes reachable from given node.
+
+        >>> graph = CSRGraph()
+        >>> graph.read_graph_from_file("test2.graph")
+        >>> graph.compute_reachable_nodes(0)[1]
+        4
+        >>> graph.compute_reachable_nodes(4)[1]
+        6
+        >>> graph.compute_reachable_nodes(6)[1]
+        1
+        """
+        if stats is not None:
+            return self._compute_reachable_nodes_with_stats(node_id, stats)
+        offsets = self._offsets
+        heads = self._heads
+        current_level = [node_id]
+        marked_nodes = [0] * self._num_nodes
+        marked_nodes[node_id] = 1
+        num_marked_nodes = 1
+        while len(current_level) > 0:
+            next_level = []
+            for curr_node_id in current_level:
+                for i in range(offsets[curr_node_id],
+                               offsets[curr_node_id + 1]):
+                    head_node_id = heads[i]
+                    if not marked_nodes[head_node_id]:
+                        marked_nodes[head_node_id] = 1
+                        num_marked_nodes += 1
+                        next_level.append(head_node_id)
+            current_level = next_level
+        return (marked_nodes, num_marked_nodes)
+
+    def set_arc_costs_to_travel_time(self, max_vehicle_speed):
+        """Set arc costs to travel time in whole seconds.
+
+        Only switches to the cost array of this speed, which is computed
+        on first use (see Graph._cost_profile()).
+        >>> graph = CSRGraph()
+        >>> graph.read_graph_from_file("test.graph")
+        >>> graph.set_arc_costs_to_travel_time(100)
+        >>> graph
+        [0->1(4), 0->2(8), 1->2(2), 2->3(6), 3->1(5), 4->3(2)]
+        >>> costs = graph._costs
+        >>> graph.set_arc_costs_to_travel_time(10)
+        >>> graph.set_arc_costs_to_travel_time(100)
+        >>> graph._costs is costs
+        True
+        """
+        self._costs = self._cost_profile(max_vehicle_speed)
+        self._private_costs = False
+        self._max_vehicle_speed = int(max_vehicle_speed)
+
+    def set_arc_costs_to_distance(self):
+        """Set arc costs to distance.
+
+        >>> graph = CSRGraph()
+        >>> graph.read_graph_from_file("test.graph")
+        >>> graph.set_arc_costs_to_travel_time(100)
+        >>> graph.set_arc_costs_to_distance()
+        >>> graph
+        [0->1(30), 0->2(70), 1->2(20), 2->3(50), 3->1(40), 4->3(20)]
+        """
+        self._costs = self._distances
+        self._private_costs = False
+        self._max_vehicle_speed = None
+
+    def __repr__(self):
+        """ Define object's string representation.
+
+        >>> graph = CSRGraph()
+        >>> graph.read_graph_from_file("test.graph")
+        >>> graph
+        [0->1(30), 0->2(70), 1->2(20), 2->3(50), 3->1(40), 4->3(20)]
+        """
+        offsets = self._offsets
+        arc_strs = []
         for i in range(self._num_nodes):
-            for arc in self._adjacency_lists[i]:
-                obj_str_repr += repr(arc) + ", "
-        if obj_str_repr:
-            return "[" + obj_str_repr[:-2] + "]"
+            for j in range(offsets[i], offsets[i + 1]):
+                arc_strs.append("%i->%i(%i)" % (i, self._heads[j],
+                                                self._costs[j]))
+        return "[" + ", ".join(arc_strs) + "]"
+
+
+class _CSRNodeList:
+    """Read-only list of Node objects, created on access from a CSRGraph."""
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __len__(self):
+        return self._graph._num_nodes
+
+    def __getitem__(self, node_id):
+        graph = self._graph
+        if node_id < 0:
+            node_id += len(self)
+        if not 0 <= node_id < len(self):
+            raise IndexError("node id out of range")
+        return Node(node_id, graph._latitudes[node_id],
+                    graph._longitudes[node_id])
+
+    def __iter__(self):
+        for node_id in range(len(self)):
+            yield self[node_id]
+
+
+class GridIndex:
+    """Grid of buckets over the node coordinates for nearest node queries.
+
+    The bounding box of the nodes is divided into cells of equal size in
+    degrees, about two nodes per cell on average, and the node ids are
+    stored cell by cell (like arcs in CSR arrays). A query looks at the
+    cells in rings of growing size around the query point and stops as
+    soon as no node outside the rings can be closer than the k-th nearest
+    node found. Distances are great-circle distances in meters. Longitudes
+    do not wrap around at +-180 degrees.
+
+    >>> index = GridIndex(array("d", [49.0, 49.0, 49.1, 49.2]),
+    ...                   array("d", [7.0, 7.1, 7.0, 7.2]))
+    >>> index.nearest(49.01, 7.09)
+    1
+    >>> [node_id for (node_id, _) in index.k_nearest(49.01, 7.09, 3)]
+    [1, 0, 2]
+    >>> list(index.snap([(49.19, 7.21), (50.0, 8.0)], max_distance=5000))
+    [3, -1]
+    """
+
+    def __init__(self, latitudes, longitudes, nodes_per_cell=2):
+        self._latitudes = latitudes
+        self._longitudes = longitudes
+        num_nodes = len(latitudes)
+        if num_nodes == 0:
+            (self._min_latitude, self._min_longitude) = (0.0, 0.0)
+            (self._cell_height, self._cell_width) = (1.0, 1.0)
+            (self._num_rows, self._num_columns) = (1, 1)
+            self._max_abs_latitude = 0.0
+            self._cell_offsets = array("q", [0, 0])
+            self._cell_nodes = array("i")
+            return
+        self._min_latitude = min(latitudes)
+        self._min_longitude = min(longitudes)
+        height = max(max(latitudes) - self._min_latitude, 1e-9)
+        width = max(max(longitudes) - self._min_longitude, 1e-9)
+        self._max_abs_latitude = max(abs(self._min_latitude),
+                                     abs(self._min_latitude + height))
+        # Make the cells roughly square in meters.
+        scale = math.cos(math.radians(self._min_latitude + height / 2))
+        num_cells = max(1, num_nodes // nodes_per_cell)
+        self._num_rows = max(1, min(num_cells, int(round(
+            math.sqrt(num_cells * height / max(width * scale, 1e-9))))))
+        self._num_columns = max(1, num_cells // self._num_rows)
+        # Slightly larger cells, so that the maximum falls into the grid.
+        self._cell_height = height * (1 + 1e-9) / self._num_rows
+        self._cell_width = width * (1 + 1e-9) / self._num_columns
+        cells = array("i", [self._cell(latitudes[v], longitudes[v])
+                            for v in range(num_nodes)])
+        (self._cell_offsets, order) = counting_sort_order(
+            self._num_rows * self._num_columns, cells)
+        self._cell_nodes = array("i", range(num_nodes) if order is None
+                                 else order)
+
+    def _row_and_column(self, latitude, longitude):
+        """Return the cell of a point, clamped to the grid."""
+        row = int((latitude - self._min_latitude) / self._cell_height)
+        column = int((longitude - self._min_longitude) / self._cell_width)
+        return (min(max(row, 0), self._num_rows - 1),
+                min(max(column, 0), self._num_columns - 1))
+
+    def _cell(self, latitude, longitude):
+        (row, column) = self._row_and_column(latitude, longitude)
+        return row * self._num_columns + column
+
+    def k_nearest(self, latitude, longitude, k, max_distance=float("Inf")):
+        """Return the k nodes nearest to a point as (node_id, distance)
+        pairs, nearest first. Only nodes within max_distance meters are
+        returned."""
+        latitudes = self._latitudes
+        longitudes = self._longitudes
+        cell_offsets = self._cell_offsets
+        cell_nodes = self._cell_nodes
+        num_rows = self._num_rows
+        num_columns = self._num_columns
+        (row, column) = self._row_and_column(latitude, longitude)
+        # Max heap (by negated distance) of the k nearest nodes so far.
+        nearest = []
+        ring = 0
+        while k > 0:
+            # Cells with Chebyshev distance ring from the (row, column).
+            for r in range(max(row - ring, 0), min(row + ring, num_rows - 1)
+                           + 1):
+                if r == row - ring or r == row + ring:
+                    columns = range(max(column - ring, 0),
+                                    min(column + ring, num_columns - 1) + 1)
+                else:
+                    columns = [c for c in (column - ring, column + ring)
+                               if 0 <= c < num_columns]
+                for c in columns:
+                    cell = r * num_columns + c
+                    for i in range(cell_offsets[cell], cell_offsets[cell + 1]):
+                        node_id = cell_nodes[i]
+                        distance = great_circle_distance(
+                            latitude, longitude, latitudes[node_id],
+                            longitudes[node_id])
+                        if distance > max_distance:
+                            continue
+                        if len(nearest) < k:
+                            heapq.heappush(nearest, (-distance, -node_id))
+                        elif distance < -nearest[0][0]:
+                            heapq.heapreplace(nearest, (-distance, -node_id))
+            bound = self._outside_distance(latitude, longitude, row, column,
+                                           ring)
+            if bound is None or bound > max_distance or \
+                    (len(nearest) == k and bound >= -nearest[0][0]):
+                break
+            ring += 1
+        return [(-node_id, -distance)
+                for (distance, node_id) in sorted(nearest, reverse=True)]
+
+    def _outside_distance(self, latitude, longitude, row, column, ring):
+        """Return a lower bound of the distance from the point to any cell
+        outside the given ring, or None if there are no such cells."""
+        degrees = []
+        if row - ring > 0:
+            degrees.append((latitude - self._min_latitude -
+                            (row - ring) * self._cell_height, 0))
+        if row + ring < self._num_rows - 1:
+            degrees.append((self._min_latitude + (row + ring + 1) *
+                            self._cell_height - latitude, 0))
+        if column - ring > 0:
+            degrees.append((longitude - self._min_longitude -
+                            (column - ring) * self._cell_width, 1))
+        if column + ring < self._num_columns - 1:
+            degrees.append((self._min_longitude + (column + ring + 1) *
+                            self._cell_width - longitude, 1))
+        if not degrees:
+            return None
+        # Other nodes differ by at least these degrees in latitude or
+        # longitude. A longitude difference is shortest at the largest
+        # absolute latitude (see the haversine formula).
+        max_abs_latitude = math.radians(max(self._max_abs_latitude,
+                                            abs(latitude)))
+        bound = float("Inf")
+        for (difference, is_longitude) in degrees:
+            difference = math.radians(max(difference, 0.0))
+            if is_longitude:
+                distance = 2 * EARTH_RADIUS * math.asin(min(1.0, math.cos(
+                    max_abs_latitude) * math.sin(min(difference, math.pi)
+                                                 / 2)))
+            else:
+                distance = EARTH_RADIUS * difference
+            bound = min(bound, distance)
+        return bound
+
+    def nearest(self, latitude, longitude, max_distance=float("Inf")):
+        """Return the node nearest to a point, or -1 if there is no node
+        within max_distance meters."""
+        nearest = self.k_nearest(latitude, longitude, 1, max_distance)
+        return nearest[0][0] if nearest else -1
+
+    def snap(self, coordinates, max_distance=float("Inf")):
+        """Return the nearest node of every (latitude, longitude) pair as
+        array("i"), see nearest()."""
+        return array("i", [self.nearest(latitude, longitude, max_distance)
+                           for (latitude, longitude) in coordinates])
+
+
+class SearchStats:
+    """Counters and timings of one search, for finding slow queries.
+
+    Pass an object of this class as stats to compute_shortest_paths() or
+    compute_reachable_nodes() (or Dijkstra.run()) to have it filled in.
+    Without stats, the searches run their usual code and pay nothing for
+    this. If on_settle is given, it is called as on_settle(node_id,
+    distance) for every settled node (for a BFS, the distance is the
+    number of arcs from the start node).
+
+    The counters are:
+        settled: nodes settled (taken from the heap or BFS queue for the
+            first time)
+        heap_pushes, heap_pops: operations on the heap (the BFS queue)
+        stale_pops: outdated heap entries skipped (see Dijkstra)
+        arcs_relaxed: arcs looked at from settled nodes
+        arcs_improved: arcs that lowered the distance of their head
+    and phase_seconds maps the phases of the search (e.g. "reset",
+    "search") to the time spent in them.
+
+    >>> stats = SearchStats()
+    >>> stats.settled += 2
+    >>> stats.as_dict()["settled"]
+    2
+    """
+
+    COUNTERS = ("settled", "heap_pushes", "heap_pops", "stale_pops",
+                "arcs_relaxed", "arcs_improved")
+
+    def __init__(self, on_settle=None):
+        self.on_settle = on_settle
+        for name in SearchStats.COUNTERS:
+            setattr(self, name, 0)
+        self.phase_seconds = {}
+
+    def add_phase_time(self, phase, seconds):
+        """Add the time spent in a phase of the search."""
+        self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + \
+            seconds
+
+    def as_dict(self):
+        """Return the counters and phase times as a dict (e.g. for JSON).
+        """
+        result = dict((name, getattr(self, name))
+                      for name in SearchStats.COUNTERS)
+        for (phase, seconds) in self.phase_seconds.items():
+            result[phase + "_seconds"] = seconds
+        return result
+
+    def __repr__(self):
+        return "SearchStats(%s)" % ", ".join(
+            "%s=%s" % item for item in sorted(self.as_dict().items()))
+
+
+class Dijkstra:
+    """Dijkstra's algorithm on the search arrays of a Graph or CSRGraph.
+
+    All per-query state (distances, traceback arcs, settled flags, heap)
+    is kept in arrays of this object instead of in the Node objects.
+    The nodes touched by a search are remembered, and only those are
+    reset before the next search, so many searches can run one after
+    the other at a cost proportional to the size of each search.
+
+    The priority queue is a heapq list without locking. Instead of a
+    decrease key operation, an improved node is pushed again and the
+    outdated entry is skipped when it is popped (its node is settled
+    by then). In CPython this is about twice as fast as a decrease key
+    heap written in Python, like PriorityQueueMinHeap from Ex6.
+
+    >>> g = CSRGraph()
+    >>> g.read_graph_from_file("test2.graph")
+    >>> dijkstra = Dijkstra(g)
+    >>> dijkstra.run(4)
+    >>> list(dijkstra.distances)
+    [inf, 60.0, 50.0, 20.0, 0.0, 30.0, 40.0]
+    >>> list(dijkstra.traceback_arcs)
+    [-1, 4, 7, 5, -1, 6, 9]
+    >>> dijkstra.run(0)
+    >>> list(dijkstra.distances)
+    [0.0, 30.0, 50.0, 100.0, inf, inf, inf]
+    """
+
+    def __init__(self, graph, reverse=False):
+        num_nodes = graph.get_num_nodes()
+        self._graph = graph
+        # Search on the reversed graph, e.g. backward from a target.
+        self._reverse = reverse
+        self.distances = array("d", [float("Inf")]) * num_nodes
+        # Position of the last arc on the shortest path in the search
+        # arrays, -1 if none.
+        self.traceback_arcs = array("q", [-1]) * num_nodes
+        self.settled = bytearray(num_nodes)
+        # Nodes whose entries were changed by the last search.
+        self._touched = []
+        self._heap = []
+        self._arrays = None
+        # Source node of the last search, and whether it settled all
+        # reachable nodes (see update()).
+        self._source = None
+        self._complete = False
+
+    def reset(self):
+        """Reset the entries touched by the last search."""
+        distances = self.distances
+        traceback_arcs = self.traceback_arcs
+        settled = self.settled
+        for node_id in self._touched:
+            distances[node_id] = float("Inf")
+            traceback_arcs[node_id] = -1
+            settled[node_id] = 0
+        del self._touched[:]
+        del self._heap[:]
+
+    def start(self, source):
+        """Reset and begin a new search from the source node.
+
+        Returns the (offsets, heads, costs) arrays to search on.
+        """
+        self.reset()
+        if self._reverse:
+            self._arrays = self._graph._reverse_search_arrays()[:3]
+        else:
+            self._arrays = self._graph._search_arrays()
+        self.distances[source] = 0
+        self._touched.append(source)
+        self._heap.append((0, source))
+        self._source = source
+        self._complete = False
+        return self._arrays
+
+    def run(self, source, target=None, targets=None,
+            max_costs=float("Inf"), stats=None):
+        """Settle all nodes reachable from the source node.
+
+        If a target is given, stop as soon as the target is settled. If a
+        collection of targets is given, stop as soon as all of them are.
+        Nodes farther than max_costs from the source are not settled.
+        If stats (a SearchStats object) is given, the search is counted
+        and timed in it.
+        """
+        if stats is not None:
+            return self._run_with_stats(source, target, targets, max_costs,
+                                        stats)
+        (offsets, heads, costs) = self.start(source)
+        if targets is not None:
+            pending_targets = set(targets)
+            if target is not None:
+                pending_targets.add(target)
+            target = None
+        else:
+            pending_targets = None
+        distances = self.distances
+        traceback_arcs = self.traceback_arcs
+        settled = self.settled
+        touched = self._touched
+        heap = self._heap
+        inf = float("Inf")
+        while heap:
+            (distance, node_id) = heapq.heappop(heap)
+            if settled[node_id]:
+                continue
+            if distance > max_costs:
+                break
+            settled[node_id] = 1
+            if node_id == target:
+                break
+            if pending_targets is not None:
+                pending_targets.discard(node_id)
+                if not pending_targets:
+                    break
+            for i in range(offsets[node_id], offsets[node_id + 1]):
+                head_node_id = heads[i]
+                new_distance = distance + costs[i]
+                old_distance = distances[head_node_id]
+                if new_distance < old_distance:
+                    if old_distance == inf:
+                        touched.append(head_node_id)
+                    distances[head_node_id] = new_distance
+                    traceback_arcs[head_node_id] = i
+                    heapq.heappush(heap, (new_distance, head_node_id))
         else:
-            return "[]"
+            self._complete = True
+
+    def _run_with_stats(self, source, target, targets, max_costs, stats):
+        """Like run(), but count every step in stats (which is slower)."""
+        start_time = time.perf_counter()
+        (offsets, heads, costs) = self.start(source)
+        if targets is not None:
+            pending_targets = set(targets)
+            if target is not None:
+                pending_targets.add(target)
+            target = None
+        else:
+            pending_targets = None
+        distances = self.distances
+        traceback_arcs = self.traceback_arcs
+        settled = self.settled
+        touched = self._touched
+        heap = self._heap
+        on_settle = stats.on_settle
+        inf = float("Inf")
+        search_start_time = time.perf_counter()
+        stats.add_phase_time("reset", search_start_time - start_time)
+        stats.heap_pushes += 1
+        while heap:
+            (distance, node_id) = heapq.heappop(heap)
+            stats.heap_pops += 1
+            if settled[node_id]:
+                stats.stale_pops += 1
+                continue
+            if distance > max_costs:
+                break
+            settled[node_id] = 1
+            stats.settled += 1
+            if on_settle is not None:
+                on_settle(node_id, distance)
+            if node_id == target:
+                break
+            if pending_targets is not None:
+                pending_targets.discard(node_id)
+                if not pending_targets:
+                    break
+            for i in range(offsets[node_id], offsets[node_id + 1]):
+                stats.arcs_relaxed += 1
+                head_node_id = heads[i]
+                new_distance = distance + costs[i]
+                old_distance = distances[head_node_id]
+                if new_distance < old_distance:
+                    stats.arcs_improved += 1
+                    if old_distance == inf:
+                        touched.append(head_node_id)
+                    distances[head_node_id] = new_distance
+                    traceback_arcs[head_node_id] = i
+                    heapq.heappush(heap, (new_distance, head_node_id))
+                    stats.heap_pushes += 1
+        else:
+            self._complete = True
+        stats.add_phase_time("search", time.perf_counter() - search_start_time)
+
+    def update(self, changed_arcs):
+        """Repair the last search after the costs of some arcs changed.
+
+        changed_arcs is a list of (arc position, old costs) pairs, see
+        Graph.update_arc_costs(). For every tree arc whose costs increased,
+        the distances in the subtree below it are dropped and each node of
+        the subtree starts from its best arc from outside the subtree. For
+        every arc whose costs decreased, its head node may get closer.
+        From these nodes, the search then continues as usual, so only the
+        nodes whose distances change are settled again. The results of
+        searches that stopped early (at a target or cost budget) or ran
+        on the reversed graph are dropped instead.
+
+        >>> g = CSRGraph()
+        >>> g.read_graph_from_file("test2.graph")
+        >>> dijkstra = Dijkstra(g)
+        >>> dijkstra.run(4)
+        >>> changed = g.update_arc_costs([(5, 6, 100), (4, 5, 5)])
+        >>> dijkstra.update(changed)
+        >>> list(dijkstra.distances)
+        [inf, 60.0, 25.0, 20.0, 0.0, 5.0, 105.0]
+        >>> dijkstra.run(4)
+        >>> list(dijkstra.distances)
+        [inf, 60.0, 25.0, 20.0, 0.0, 5.0, 105.0]
+        """
+        if self._source is None:
+            return
+        if self._reverse or not self._complete:
+            self.reset()
+            self._source = None
+            return
+        (offsets, heads, costs) = self._arrays = self._graph._search_arrays()
+        distances = self.distances
+        traceback_arcs = self.traceback_arcs
+        settled = self.settled
+        touched = self._touched
+        heap = self._heap
+        inf = float("Inf")
+        # Collect the subtrees below the tree arcs whose costs increased.
+        affected = []
+        for (i, old_costs) in changed_arcs:
+            node_id = heads[i]
+            if costs[i] <= old_costs or traceback_arcs[node_id] != i or \
+                    not settled[node_id]:
+                continue
+            settled[node_id] = 0
+            stack = [node_id]
+            while stack:
+                node_id = stack.pop()
+                affected.append(node_id)
+                for j in range(offsets[node_id], offsets[node_id + 1]):
+                    head_node_id = heads[j]
+                    if traceback_arcs[head_node_id] == j and \
+                            settled[head_node_id]:
+                        settled[head_node_id] = 0
+                        stack.append(head_node_id)
+        for node_id in affected:
+            distances[node_id] = inf
+            traceback_arcs[node_id] = -1
+        if affected:
+            (reverse_offsets, tails, reverse_costs,
+             arc_ids) = self._graph._reverse_search_arrays()
+            for node_id in affected:
+                for j in range(reverse_offsets[node_id],
+                               reverse_offsets[node_id + 1]):
+                    new_distance = distances[tails[j]] + reverse_costs[j]
+                    if new_distance < distances[node_id]:
+                        distances[node_id] = new_distance
+                        traceback_arcs[node_id] = arc_ids[j]
+                if distances[node_id] < inf:
+                    heapq.heappush(heap, (distances[node_id], node_id))
+        for (i, old_costs) in changed_arcs:
+            if costs[i] >= old_costs:
+                continue
+            tail_node_id = bisect.bisect_right(offsets, i) - 1
+            head_node_id = heads[i]
+            new_distance = distances[tail_node_id] + costs[i]
+            old_distance = distances[head_node_id]
+            if new_distance < old_distance:
+                if old_distance == inf:
+                    touched.append(head_node_id)
+                distances[head_node_id] = new_distance
+                traceback_arcs[head_node_id] = i
+                heapq.heappush(heap, (new_distance, head_node_id))
+        # Settle the nodes whose distances changed. A node can be taken
+        # from the heap again if its distance drops, so outdated entries
+        # are recognized by their distance instead of the settled flag.
+        while heap:
+            (distance, node_id) = heapq.heappop(heap)
+            if distance > distances[node_id]:
+                continue
+            settled[node_id] = 1
+            for i in range(offsets[node_id], offsets[node_id + 1]):
+                head_node_id = heads[i]
+                new_distance = distance + costs[i]
+                old_distance = distances[head_node_id]
+                if new_distance < old_distance:
+                    if old_distance == inf:
+                        touched.append(head_node_id)
+                    distances[head_node_id] = new_distance
+                    traceback_arcs[head_node_id] = i
+                    heapq.heappush(heap, (new_distance, head_node_id))
+        # Nodes that lost and regained their distance are in the list of
+        # touched nodes more than once.
+        if len(touched) > 2 * len(distances):
+            touched[:] = [v for v in range(len(distances))
+                          if distances[v] < inf]
+
+    def traceback_path(self, node_id):
+        """Return the node ids on the path from the source to a node.
+
+        The path is rebuilt from the traceback arcs of the last search
+        (for a reverse search, it leads from the target backwards).
+        Returns [] if the node was not reached.
+        """
+        if self.distances[node_id] == float("Inf"):
+            return []
+        offsets = self._arrays[0]
+        path = [node_id]
+        arc_index = self.traceback_arcs[node_id]
+        while arc_index >= 0:
+            # The tail of the arc is the node whose range contains it.
+            node_id = bisect.bisect_right(offsets, arc_index) - 1
+            path.append(node_id)
+            arc_index = self.traceback_arcs[node_id]
+        path.reverse()
+        return path
+
+    def traceback_paths(self, targets):
+        """Return the Path from the source to every target (None if not
+        reached), for a search on the forward graph.
+
+        The tail node, distance and travel time up to every node on the
+        paths are remembered, so the part of a path shared with an
+        earlier one is not walked (or summed up) again.
+        """
+        graph = self._graph
+        offsets = self._arrays[0]
+        (arc_distances, max_speeds) = graph._arc_arrays()
+        max_vehicle_speed = graph._max_vehicle_speed
+        traceback_arcs = self.traceback_arcs
+        # Node -> (distance, travel time) from the source, and node ->
+        # tail node of its traceback arc.
+        sums = {self._source: (0, 0.0)}
+        tails = {}
+        paths = []
+        for target in targets:
+            if self.distances[target] == float("Inf"):
+                paths.append(None)
+                continue
+            # Walk back to the first node whose sums are known.
+            new_nodes = []
+            node_id = target
+            while node_id not in sums:
+                new_nodes.append(node_id)
+                node_id = bisect.bisect_right(
+                    offsets, traceback_arcs[node_id]) - 1
+                tails[new_nodes[-1]] = node_id
+            (distance, travel_time) = sums[node_id]
+            for node_id in reversed(new_nodes):
+                i = traceback_arcs[node_id]
+                speed = max_speeds[i]
+                if max_vehicle_speed is not None:
+                    speed = min(speed, max_vehicle_speed)
+                distance += arc_distances[i]
+                travel_time += arc_distances[i] / (speed / 3.6)
+                sums[node_id] = (distance, travel_time)
+            node_ids = array("i", [target])
+            node_id = target
+            while node_id in tails:
+                node_id = tails[node_id]
+                node_ids.append(node_id)
+            node_ids.reverse()
+            arc_positions = array("q", [traceback_arcs[v]
+                                        for v in node_ids[1:]])
+            paths.append(Path(graph, node_ids, arc_positions,
+                              self.distances[target], distance, travel_time))
+        return paths
+
+
+class AStar(Dijkstra):
+    """A* search for point-to-point queries.
+
+    Dijkstra's algorithm where a node v is taken from the heap by
+    distance(v) + h(v), with h(v) = factor * great-circle distance from
+    v to the target (see Graph._astar_costs()). The heuristic is
+    computed once per node when the node is first reached. Since it is
+    a consistent lower bound, every node is still settled at most once,
+    but nodes leading away from the target are mostly never settled.
+
+    >>> g = CSRGraph()
+    >>> g.read_graph_from_file("test2.graph")
+    >>> astar = AStar(g)
+    >>> astar.run(4, 6)
+    >>> astar.distances[6], astar.traceback_path(6)
+    (40.0, [4, 5, 6])
+    """
+
+    # Search on the unrounded travel times, see TravelTimeAStar.
+    _exact_travel_times = False
+
+    def __init__(self, graph):
+        Dijkstra.__init__(self, graph)
+        self._potentials = array("d", [0]) * graph.get_num_nodes()
+
+    def run(self, source, target):
+        """Settle nodes from the source node until target is settled."""
+        (offsets, heads, costs) = self.start(source)
+        potential = self._potential_function(source, target)
+        distances = self.distances
+        traceback_arcs = self.traceback_arcs
+        settled = self.settled
+        touched = self._touched
+        potentials = self._potentials
+        heap = self._heap
+        inf = float("Inf")
+        while heap:
+            node_id = heapq.heappop(heap)[1]
+            if settled[node_id]:
+                continue
+            settled[node_id] = 1
+            if node_id == target:
+                break
+            distance = distances[node_id]
+            for i in range(offsets[node_id], offsets[node_id + 1]):
+                head_node_id = heads[i]
+                new_distance = distance + costs[i]
+                old_distance = distances[head_node_id]
+                if new_distance < old_distance:
+                    if old_distance == inf:
+                        touched.append(head_node_id)
+                        potentials[head_node_id] = potential(head_node_id)
+                    distances[head_node_id] = new_distance
+                    traceback_arcs[head_node_id] = i
+                    heapq.heappush(heap, (new_distance +
+                                          potentials[head_node_id],
+                                          head_node_id))
+
+    def _potential_function(self, source, target):
+        """Return a function giving a lower bound of the node's distance
+        to the target (subclasses can use other lower bounds)."""
+        factor = self._graph._astar_costs(self._exact_travel_times)[1]
+        (latitudes, longitudes) = self._graph._coordinates()
+        target_latitude = latitudes[target]
+        target_longitude = longitudes[target]
+
+        def potential(node_id):
+            return factor * great_circle_distance(
+                latitudes[node_id], longitudes[node_id],
+                target_latitude, target_longitude)
+        return potential
+
+
+class TravelTimeAStar(AStar):
+    """A* search on the unrounded travel times of the arcs.
+
+    With travel time costs in whole seconds, a short arc can take 0 s,
+    which makes the heuristic of AStar 0. This variant searches on the
+    travel times in fractional seconds (arcs changed by
+    Graph.update_arc_costs() keep their new costs) instead, for which
+    3.6 / v stays a consistent factor. Its distances and paths can
+    differ from those of the other searches, which use the rounded costs.
+
+    >>> g = CSRGraph()
+    >>> g.read_graph_from_file("test2.graph")
+    >>> g.set_arc_costs_to_travel_time(100)
+    >>> astar = TravelTimeAStar(g)
+    >>> astar.run(4, 6)
+    >>> "%.2f" % astar.distances[6], astar.traceback_path(6)
+    ('9.60', [4, 5, 6])
+    """
+
+    _exact_travel_times = True
+
+    def start(self, source):
+        """Like Dijkstra.start(), but returns the unrounded costs."""
+        (offsets, heads, _) = Dijkstra.start(self, source)
+        self._arrays = (offsets, heads, self._graph._astar_costs(True)[0])
+        return self._arrays
+
+
+class BidirectionalDijkstra:
+    """Bidirectional Dijkstra for point-to-point queries.
+
+    A forward search from the source and a backward search from the
+    target on the reversed graph take turns, always continuing the one
+    with the smaller next distance. Whenever either search improves the
+    distance of a node the other one has reached, the sum of both
+    distances is a candidate for the shortest path. The searches stop
+    when the sum of their next distances is no smaller than the best
+    candidate, which usually settles far fewer nodes than a
+    unidirectional search.
+
+    >>> g = Graph()
+    >>> g.read_graph_from_file("test2.graph")
+    >>> search = BidirectionalDijkstra(g)
+    >>> search.run(4, 6)
+    (40.0, [4, 5, 6])
+    >>> search.run(5, 1)
+    (90.0, [5, 4, 3, 1])
+    """
+
+    def __init__(self, graph):
+        self.forward = Dijkstra(graph)
+        self.backward = Dijkstra(graph, reverse=True)
+        self.meeting_node = -1
+
+    def run(self, source, target):
+        """Return (distance, node ids of the path), (inf, []) if none."""
+        searches = (self.forward, self.backward)
+        all_arrays = (self.forward.start(source), self.backward.start(target))
+        inf = float("Inf")
+        best_distance = inf
+        self.meeting_node = -1
+        if source == target:
+            best_distance = 0
+            self.meeting_node = source
+        while True:
+            # Drop outdated heap entries to see the next distances.
+            for search in searches:
+                heap = search._heap
+                while heap and search.settled[heap[0][1]]:
+                    heapq.heappop(heap)
+            forward_min = searches[0]._heap[0][0] \
+                if searches[0]._heap else inf
+            backward_min = searches[1]._heap[0][0] \
+                if searches[1]._heap else inf
+            if forward_min + backward_min >= best_distance:
+                break
+            side = 0 if forward_min <= backward_min else 1
+            search = searches[side]
+            other_distances = searches[1 - side].distances
+            (offsets, heads, costs) = all_arrays[side]
+            distances = search.distances
+            heap = search._heap
+            (distance, node_id) = heapq.heappop(heap)
+            search.settled[node_id] = 1
+            for i in range(offsets[node_id], offsets[node_id + 1]):
+                head_node_id = heads[i]
+                new_distance = distance + costs[i]
+                old_distance = distances[head_node_id]
+                if new_distance < old_distance:
+                    if old_distance == inf:
+                        search._touched.append(head_node_id)
+                    distances[head_node_id] = new_distance
+                    search.traceback_arcs[head_node_id] = i
+                    heapq.heappush(heap, (new_distance, head_node_id))
+                    total = new_distance + other_distances[head_node_id]
+                    if total < best_distance:
+                        best_distance = total
+                        self.meeting_node = head_node_id
+        if self.meeting_node < 0:
+            return (inf, [])
+        path = self.forward.traceback_path(self.meeting_node)
+        backward_path = self.backward.traceback_path(self.meeting_node)
+        backward_path.reverse()
+        return (float(best_distance), path + backward_path[1:])
+
+
+class Path:
+    """A path found by a search, see Graph.get_path().
+
+    node_ids and arc_positions are arrays with the nodes and arcs (as
+    positions in the search arrays) from the source to the target. costs
+    is the sum of the arc costs the search used, distance the length in
+    meters and travel_time the time in seconds at the max speed of every
+    arc (limited by the max vehicle speed in travel time mode), without
+    rounding.
+    """
+
+    def __init__(self, graph, node_ids, arc_positions, costs, distance,
+                 travel_time):
+        self._graph = graph
+        self.node_ids = node_ids
+        self.arc_positions = arc_positions
+        self.costs = costs
+        self.distance = distance
+        self.travel_time = travel_time
+
+    def get_arcs(self):
+        """Return the Arc objects of the path."""
+        return [self._graph._get_arc(i) for i in self.arc_positions]
+
+    def __repr__(self):
+        return "Path(%s, costs=%.0f, distance=%d, travel_time=%.1f)" % (
+            list(self.node_ids), self.costs, self.distance, self.travel_time)
 
 
 class Node:
@@ -231,17 +2818,11 @@ class Node:
         self._id = node_id
         self._latitude = latitude
         self._longitude = longitude
-        self._traceback_arc = None
-        self._distance = float("Inf")
-        self._settled = False
 
     def __repr__(self):
         """ Define object's string representation."""
         return "%i" % (self._id)
 
-    def __lt__(self, other):
-        return (self._distance < other._distance)
-
 
 class Arc:
 
@@ -261,5 +2842,4 @@ class Arc:
 if __name__ == "__main__":
     g = Graph()
     g.read_graph_from_file("bawue_bayern.graph")
-    g.compute_shortest_paths(5508637)
-    print(g._nodes._distance[4435496])
+    print(g.bidirectional_shortest_path(5508637, 4435496)[0])
@@ -0,0 +1,468 @@
+#!/usr/bin/python3
+
+import os
+import bisect
+import heapq
+import mmap
+import random
+import struct
+from array import array
+
+from graph import AStar, Dijkstra
+
+"""
+ALT (A*, landmarks, triangle inequality) preprocessing and queries.
+
+For a few landmark nodes l, the distances d(l, v) and d(v, l) to and
+from every node v are computed once. By the triangle inequality,
+d(v, t) >= d(l, t) - d(l, v) and d(v, t) >= d(v, l) - d(t, l), which
+gives A* a much better lower bound than the great-circle distance.
+
+"""
+
+# Table entry for nodes that cannot reach / be reached from a landmark.
+UNREACHABLE = 2 ** 31 - 1
+# Landmarks file format: header, landmark ids, then the from and to
+# tables, all int32. The tables are stored node by node: the entries of
+# node v for all k landmarks are at positions v * k to v * k + k - 1.
+LANDMARKS_MAGIC = b"LANDMARK"
+LANDMARKS_VERSION = 1
+LANDMARKS_HEADER = struct.Struct("=8sIIqqqII")
+
+
+def landmarks_file_path(graph_file_name):
+    """Return the path of the landmarks file of a .graph file."""
+    return graph_file_name + ".landmarks"
+
+
+def read_or_compute_landmarks(graph, graph_file_name, num_landmarks=16,
+                              selection="avoid"):
+    """Return Landmarks for the graph read from the given .graph file.
+
+    The landmarks are read from the landmarks file next to the .graph
+    file if it exists and matches the graph and its current arc costs.
+    Otherwise they are computed and the file is (re)written.
+
+    >>> import os, shutil, tempfile
+    >>> from graph import Graph
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> file_name = os.path.join(tmp_dir, "test2.graph")
+    >>> _ = shutil.copy("test2.graph", file_name)
+    >>> graph = Graph()
+    >>> graph.read_graph_from_file(file_name)
+    >>> landmarks = read_or_compute_landmarks(graph, file_name, 2)
+    >>> list(landmarks.landmarks)
+    [3, 4]
+    >>> landmarks = read_or_compute_landmarks(graph, file_name, 2)
+    >>> landmarks.shortest_path(5, 1)
+    (90.0, [5, 4, 3, 1])
+    >>> graph.set_arc_costs_to_travel_time(100)
+    >>> landmarks = read_or_compute_landmarks(graph, file_name, 2)
+    >>> landmarks.shortest_path(5, 1) == graph.shortest_path(5, 1)
+    True
+    >>> del landmarks
+    >>> shutil.rmtree(tmp_dir)
+    """
+    file_name = landmarks_file_path(graph_file_name)
+    landmarks = Landmarks(graph)
+    if os.path.exists(file_name) and landmarks.read_from_file(file_name):
+        return landmarks
+    landmarks.select_landmarks(num_landmarks, selection)
+    landmarks.write_to_file(file_name)
+    return landmarks
+
+
+class Landmarks:
+    """Landmarks and their distance tables for a Graph or CSRGraph.
+
+    >>> from graph import CSRGraph
+    >>> graph = CSRGraph()
+    >>> graph.read_graph_from_file("test2.graph")
+    >>> landmarks = Landmarks(graph)
+    >>> landmarks.select_landmarks(2, "farthest")
+    >>> list(landmarks.landmarks)
+    [6, 0]
+    >>> landmarks.lower_bound(4, 1) <= 60
+    True
+    >>> all(landmarks.shortest_path(s, t) == graph.shortest_path(s, t)
+    ...     for s in range(7) for t in range(7))
+    True
+    """
+
+    def __init__(self, graph):
+        self._graph = graph
+        self.landmarks = array("i")
+        # from_table[v * k + j] = d(landmarks[j], v),
+        # to_table[v * k + j] = d(v, landmarks[j]).
+        self.from_table = array("i")
+        self.to_table = array("i")
+        self._mmap = None
+        self._alt = None
+
+    def select_landmarks(self, num_landmarks, selection="avoid", seed=0):
+        """Select landmarks and compute their distance tables.
+
+        selection is "farthest" (each new landmark is the node farthest
+        from the landmarks so far) or "avoid" (see _select_avoid()).
+        """
+        if selection not in ("farthest", "avoid"):
+            raise ValueError("unknown landmark selection: %s" % selection)
+        num_nodes = self._graph.get_num_nodes()
+        num_landmarks = min(num_landmarks, num_nodes)
+        rows = []
+        forward = Dijkstra(self._graph)
+        backward = Dijkstra(self._graph, reverse=True)
+        rand = random.Random(seed)
+        landmarks = []
+        # Smallest distance from any landmark so far (farthest selection).
+        min_distances = array("d", [float("Inf")]) * num_nodes
+        while len(landmarks) < num_landmarks:
+            if selection == "farthest":
+                landmark = self._select_farthest(landmarks, min_distances,
+                                                 forward, rand)
+            else:
+                landmark = self._select_avoid(landmarks, rows, forward, rand)
+            if landmark is None:
+                break
+            forward.run(landmark)
+            backward.run(landmark)
+            from_row = _table_row(forward.distances)
+            to_row = _table_row(backward.distances)
+            rows.append((from_row, to_row))
+            landmarks.append(landmark)
+            for node_id in range(num_nodes):
+                if forward.distances[node_id] < min_distances[node_id]:
+                    min_distances[node_id] = forward.distances[node_id]
+        self._set_tables(array("i", landmarks), rows)
+
+    def set_landmarks(self, landmarks, num_processes=1):
+        """Use the given landmarks and compute their distance tables.
+
+        The searches from and to the landmarks are independent of each
+        other and run on num_processes worker processes, see
+        Graph.compute_shortest_path_trees().
+
+        >>> from graph import CSRGraph
+        >>> graph = CSRGraph()
+        >>> graph.read_graph_from_file("test2.graph")
+        >>> landmarks = Landmarks(graph)
+        >>> landmarks.set_landmarks([6, 0], num_processes=2)
+        >>> other = Landmarks(graph)
+        >>> other.select_landmarks(2, "farthest")
+        >>> landmarks.from_table == other.from_table
+        True
+        >>> landmarks.to_table == other.to_table
+        True
+        """
+        landmarks = list(landmarks)
+        rows = []
+        from_trees = self._graph.compute_shortest_path_trees(
+            landmarks, num_processes, tracebacks=False)
+        to_trees = self._graph.compute_shortest_path_trees(
+            landmarks, num_processes, reverse=True, tracebacks=False)
+        for ((from_distances, _), (to_distances, _)) in \
+                zip(from_trees, to_trees):
+            rows.append((_table_row(from_distances), _table_row(to_distances)))
+        self._set_tables(array("i", landmarks), rows)
+
+    def _select_farthest(self, landmarks, min_distances, forward, rand):
+        """Return the node farthest from all landmarks selected so far.
+
+        The first landmark is the node farthest from a random node. Nodes
+        that are not reachable from any landmark are treated as farthest,
+        so that every part of the graph gets a landmark.
+        """
+        num_nodes = self._graph.get_num_nodes()
+        if not landmarks:
+            forward.run(rand.randrange(num_nodes))
+            distances = forward.distances
+        else:
+            distances = min_distances
+        best_node = None
+        best_distance = -1
+        for node_id in range(num_nodes):
+            if node_id in landmarks:
+                continue
+            distance = distances[node_id]
+            if distance == float("Inf") and not landmarks:
+                continue
+            if distance > best_distance:
+                best_node = node_id
+                best_distance = distance
+        return best_node
+
+    def _select_avoid(self, landmarks, rows, forward, rand):
+        """Select a landmark with the "avoid" method (Goldberg, Werneck).
+
+        Compute a shortest path tree from a random root r. The weight of
+        a node v is d(r, v) minus the lower bound of the landmarks so far,
+        i.e. how badly they estimate d(r, v). The size of v is the sum of
+        the weights in its subtree, or 0 if the subtree contains a
+        landmark. Starting at the node of maximum size, go to the child
+        of maximum size until reaching a leaf, which is the new landmark.
+        """
+        num_nodes = self._graph.get_num_nodes()
+        root = rand.randrange(num_nodes)
+        forward.run(root)
+        distances = forward.distances
+        offsets = forward._arrays[0]
+        # Parent in the shortest path tree, -1 for root and unreached.
+        parents = array("i", [-1]) * num_nodes
+        tree_nodes = [v for v in range(num_nodes)
+                      if distances[v] != float("Inf")]
+        for v in tree_nodes:
+            arc_index = forward.traceback_arcs[v]
+            if arc_index >= 0:
+                parents[v] = bisect.bisect_right(offsets, arc_index) - 1
+        # Order the tree top-down (parents before children).
+        children = {}
+        for v in tree_nodes:
+            if parents[v] >= 0:
+                children.setdefault(parents[v], []).append(v)
+        order = [root]
+        for v in order:
+            order.extend(children.get(v, []))
+        sizes = array("d", [0]) * num_nodes
+        has_landmark = bytearray(num_nodes)
+        for v in landmarks:
+            has_landmark[v] = 1
+        for v in reversed(order):
+            if has_landmark[v]:
+                sizes[v] = 0
+            else:
+                bound = _lower_bound_from_rows(rows, root, v)
+                sizes[v] += distances[v] - bound
+            parent = parents[v]
+            if parent >= 0:
+                if has_landmark[v]:
+                    has_landmark[parent] = 1
+                sizes[parent] += sizes[v]
+        node_id = max(order, key=lambda v: sizes[v])
+        if sizes[node_id] <= 0:
+            # Everything reachable from root is covered already.
+            candidates = [v for v in range(num_nodes) if v not in landmarks]
+            return rand.choice(candidates) if candidates else None
+        while children.get(node_id):
+            node_id = max(children[node_id], key=lambda v: sizes[v])
+        return node_id
+
+    def _set_tables(self, landmarks, rows):
+        """Interleave the per landmark rows into node by node tables."""
+        num_landmarks = len(landmarks)
+        num_nodes = self._graph.get_num_nodes()
+        from_table = array("i", [0]) * (num_nodes * num_landmarks)
+        to_table = array("i", [0]) * (num_nodes * num_landmarks)
+        for j, (from_row, to_row) in enumerate(rows):
+            from_table[j::num_landmarks] = from_row
+            to_table[j::num_landmarks] = to_row
+        self.landmarks = landmarks
+        self.from_table = from_table
+        self.to_table = to_table
+        self._alt = None
+
+    def update(self, changed_arcs):
+        """Patch the distance tables after the costs of some arcs changed.
+
+        changed_arcs are the (arc position, old costs) pairs returned by
+        Graph.update_arc_costs(). The A* potentials need table entries
+        with from_table[w] <= from_table[v] + costs(v, w) for every arc
+        (v, w), and likewise for the to_table. Increased costs keep this
+        true (the bounds just get weaker), so only the entries that
+        decreased costs make too large are lowered, by a Dijkstra search
+        from the heads (tails for the to_table) of these arcs per
+        landmark.
+
+        >>> from graph import CSRGraph
+        >>> graph = CSRGraph()
+        >>> graph.read_graph_from_file("test2.graph")
+        >>> landmarks = Landmarks(graph)
+        >>> landmarks.select_landmarks(2, "farthest")
+        >>> changed = graph.update_arc_costs([(4, 3, 200), (5, 2, 1)])
+        >>> landmarks.update(changed)
+        >>> all(landmarks.shortest_path(s, t) == graph.shortest_path(s, t)
+        ...     for s in range(7) for t in range(7))
+        True
+        """
+        (offsets, heads, costs) = self._graph._search_arrays()
+        decreased = [i for (i, old_costs) in changed_arcs
+                     if costs[i] < old_costs]
+        if not decreased:
+            return
+        # The tables may be read-only memoryviews into a landmarks file.
+        self.from_table = array("i", self.from_table)
+        self.to_table = array("i", self.to_table)
+        self._alt = None
+        (reverse_offsets, tails, reverse_costs,
+         _) = self._graph._reverse_search_arrays()
+        k = len(self.landmarks)
+        for j in range(k):
+            _lower_entries(self.from_table, k, j, offsets, heads, costs, [
+                (heads[i], bisect.bisect_right(offsets, i) - 1, costs[i])
+                for i in decreased])
+            _lower_entries(self.to_table, k, j, reverse_offsets, tails,
+                           reverse_costs, [
+                               (bisect.bisect_right(offsets, i) - 1, heads[i],
+                                costs[i]) for i in decreased])
+
+    def lower_bound(self, source, target):
+        """Return a lower bound of the distance from source to target."""
+        k = len(self.landmarks)
+        bound = 0
+        for j in range(k):
+            bound = max(bound,
+                        _bound(self.from_table[target * k + j],
+                               self.from_table[source * k + j]),
+                        _bound(self.to_table[source * k + j],
+                               self.to_table[target * k + j]))
+        return bound
+
+    def shortest_path(self, source, target):
+        """Compute the shortest path from source to target with ALT.
+
+        Returns (distance, node ids of the path), (inf, []) if none.
+        """
+        if self._alt is None:
+            self._alt = ALT(self._graph, self)
+        self._alt.run(source, target)
+        return (self._alt.distances[target],
+                self._alt.traceback_path(target))
+
+    def write_to_file(self, file_name):
+        """Write landmarks and distance tables to a landmarks file."""
+        tmp_file_name = "%s.tmp%d" % (file_name, os.getpid())
+        with open(tmp_file_name, "wb") as f:
+            f.write(LANDMARKS_HEADER.pack(
+                LANDMARKS_MAGIC, LANDMARKS_VERSION, 0,
+                self._graph.get_num_nodes(), self._graph.get_num_arcs(),
+                len(self.landmarks), self._graph._search_fingerprint(), 0))
+            f.write(array("i", self.landmarks))
+            f.write(self.from_table)
+            f.write(self.to_table)
+        os.replace(tmp_file_name, file_name)
+
+    def read_from_file(self, file_name):
+        """Memory-map landmarks and distance tables from a landmarks file.
+
+        Returns False (and reads nothing) if the file was computed for a
+        different graph or for different arc costs.
+        """
+        with open(file_name, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, num_nodes, num_arcs, num_landmarks,
+         fingerprint, _) = LANDMARKS_HEADER.unpack_from(mapping)
+        if magic != LANDMARKS_MAGIC or version != LANDMARKS_VERSION:
+            mapping.close()
+            raise Exception("%s is not a landmarks file" % file_name)
+        if num_nodes != self._graph.get_num_nodes() or \
+                num_arcs != self._graph.get_num_arcs() or \
+                fingerprint != self._graph._search_fingerprint():
+            mapping.close()
+            return False
+        buf = memoryview(mapping)
+        pos = LANDMARKS_HEADER.size
+        table_size = num_nodes * num_landmarks * 4
+        self.landmarks = buf[pos:pos + num_landmarks * 4].cast("i")
+        pos += num_landmarks * 4
+        self.from_table = buf[pos:pos + table_size].cast("i")
+        self.to_table = buf[pos + table_size:pos + 2 * table_size].cast("i")
+        self._mmap = mapping
+        self._alt = None
+        return True
+
+
+class ALT(AStar):
+    """A* search with landmark lower bounds.
+
+    For every query, only the few landmarks giving the best lower bound
+    for d(source, target) are used, which makes the lower bound cheaper
+    to compute and is usually almost as good as using all of them.
+
+    >>> from graph import Graph
+    >>> graph = Graph()
+    >>> graph.read_graph_from_file("test2.graph")
+    >>> landmarks = Landmarks(graph)
+    >>> landmarks.select_landmarks(3)
+    >>> alt = ALT(graph, landmarks)
+    >>> alt.run(4, 1)
+    >>> alt.distances[1], alt.traceback_path(1)
+    (60.0, [4, 3, 1])
+    """
+
+    def __init__(self, graph, landmarks, num_active_landmarks=4):
+        AStar.__init__(self, graph)
+        self._landmarks = landmarks
+        self._num_active_landmarks = num_active_landmarks
+
+    def _potential_function(self, source, target):
+        """Return h(v) = max over the active landmarks l of
+        max(d(l, t) - d(l, v), d(v, l) - d(t, l))."""
+        landmarks = self._landmarks
+        k = len(landmarks.landmarks)
+        from_table = landmarks.from_table
+        to_table = landmarks.to_table
+        # Pick the landmarks with the best bound for (source, target).
+        active = sorted(range(k), key=lambda j: -max(
+            _bound(from_table[target * k + j], from_table[source * k + j]),
+            _bound(to_table[source * k + j], to_table[target * k + j])))
+        active = active[:self._num_active_landmarks]
+        from_target = [from_table[target * k + j] for j in active]
+        to_target = [to_table[target * k + j] for j in active]
+
+        def potential(node_id):
+            bound = 0
+            base = node_id * k
+            for j, d_lt, d_tl in zip(active, from_target, to_target):
+                d_lv = from_table[base + j]
+                if d_lt != UNREACHABLE and d_lv != UNREACHABLE and \
+                        d_lt - d_lv > bound:
+                    bound = d_lt - d_lv
+                d_vl = to_table[base + j]
+                if d_vl != UNREACHABLE and d_tl != UNREACHABLE and \
+                        d_vl - d_tl > bound:
+                    bound = d_vl - d_tl
+            return bound
+        return potential
+
+
+def _table_row(distances):
+    """Convert Dijkstra distances to an int32 table row."""
+    return array("i", [UNREACHABLE if d == float("Inf") else int(d)
+                       for d in distances])
+
+
+def _lower_entries(table, k, j, offsets, heads, costs, arcs):
+    """Lower the entries of landmark j in a node by node table until
+    table[w] <= table[v] + costs for every arc (v, w) of the search
+    arrays, starting at the given (w, v, costs) arcs."""
+    heap = []
+    for (node_id, tail_node_id, arc_costs) in arcs:
+        distance = table[tail_node_id * k + j]
+        if distance != UNREACHABLE and \
+                distance + arc_costs < table[node_id * k + j]:
+            table[node_id * k + j] = distance + arc_costs
+            heapq.heappush(heap, (distance + arc_costs, node_id))
+    while heap:
+        (distance, node_id) = heapq.heappop(heap)
+        if distance > table[node_id * k + j]:
+            continue
+        for i in range(offsets[node_id], offsets[node_id + 1]):
+            new_distance = distance + costs[i]
+            if new_distance < table[heads[i] * k + j]:
+                table[heads[i] * k + j] = new_distance
+                heapq.heappush(heap, (new_distance, heads[i]))
+
+
+def _lower_bound_from_rows(rows, source, target):
+    """Lower bound of d(source, target) from (from_row, to_row) pairs."""
+    bound = 0
+    for from_row, to_row in rows:
+        bound = max(bound, _bound(from_row[target], from_row[source]),
+                    _bound(to_row[source], to_row[target]))
+    return bound
+
+
+def _bound(minuend, subtrahend):
+    """Return max(0, minuend - subtrahend) for two table entries."""
+    if minuend == UNREACHABLE or subtrahend == UNREACHABLE:
+        return 0
+    return max(0, minuend - subtrahend)
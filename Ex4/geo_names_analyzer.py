@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
+import os
 import zipfile
 import operator
+import heapq
 import time
 import timeit
+import collections
+import multiprocessing
+import random
+import geo_names_cache
 
 
 def tst():
@@ -42,6 +48,33 @@ def read_info_from_file(filehandle):
     # print type(filehandle)
     if not type(filehandle) == zipfile.ZipExtFile:
         raise TypeError("filehandle musst be a handle to a file!")
+    for line in filehandle:
+        # Only columns 1, 6, 8 and 14 are needed, so split off at most 15
+        # columns and check them as bytes. Most lines are no P entry, only
+        # the name and countrycode of the others are decoded.
+        data = line.split(b"\t", 15)
+        if data[6] == b"P" and int(data[14]) > 0:
+            yield data[1].decode("utf8"), data[8].decode("utf8")
+
+
+def read_info_from_file_by_decoding(filehandle):
+    """ Like read_info_from_file, but decodes and splits every line
+        completely (the former implementation, for compare_read_runtime)
+        filehandle:     Handle to the file
+    >>> with zipfile.ZipFile("TEST.zip", 'r') as myzip:
+    ...     with myzip.open("TEST.txt") as f:
+    ...         for (name, countrycode) in read_info_from_file_by_decoding(f):
+    ...             print("%s %s" % (name, countrycode))
+    Hittisau AT
+    Wien DE
+    Wien AT
+    Insbruck DE
+    Hittisau AT
+    Hittisau AT
+    Linz AT
+    """
+    if type(filehandle) is not zipfile.ZipExtFile:
+        raise TypeError("filehandle musst be a handle to a file!")
     for line in filehandle:
         line = line.decode("utf8")
         # print line
@@ -53,15 +86,19 @@ def read_info_from_file(filehandle):
             continue
 
 
-def compute_most_frequent_city_names_by_sorting(filename):
+def compute_most_frequent_city_names_by_sorting(filename, top_x=None):
     """ Computes he most fequent citynames in file by sorting
         filename:   Name of th zipfile (withou .zip)
+        top_x:      Only return the top_x most fequent names (all for None)
     >>> compute_most_frequent_city_names_by_sorting(123)
     Traceback (most recent call last):
         ...
     TypeError: filename musst be a strig!
     >>> compute_most_frequent_city_names_by_sorting("TEST")
     [(u'Hittisau', 3), (u'Wien', 2), (u'Insbruck', 1), (u'Linz', 1)]
+    >>> [count for (name, count) in
+    ...  compute_most_frequent_city_names_by_sorting("TEST", 2)]
+    [3, 2]
     """
     if not type(filename) == str:
         raise TypeError("filename musst be a strig!")
@@ -93,21 +130,29 @@ def compute_most_frequent_city_names_by_sorting(filename):
                 nameAndCount.append((lst[i], j+1))
     nameAndCount.append((lst[i+1], j+1))
     # print(nameAndCount)
+    if top_x is not None:
+        # Heap of size top_x, same order as the sort below.
+        return heapq.nlargest(top_x, nameAndCount,
+                              key=operator.itemgetter(1))
     sorted_nameAndCount = sorted(nameAndCount, key=operator.itemgetter(1),
                                  reverse=True)  # O(n*log(n)) assumed
     # print sorted_nameAndCount
     return sorted_nameAndCount
 
 
-def compute_most_frequent_city_names_by_map(filename):
+def compute_most_frequent_city_names_by_map(filename, top_x=None):
     """ Computes he most fequent citynames in file by map
         filename:   Name of th zipfile (withou .zip)
+        top_x:      Only return the top_x most fequent names (all for None)
     >>> compute_most_frequent_city_names_by_map(123)
     Traceback (most recent call last):
         ...
     TypeError: filename musst be a string!
     >>> compute_most_frequent_city_names_by_map("TEST")
     [(u'Hittisau', 3), (u'Wien', 2), (u'Insbruck', 1), (u'Linz', 1)]
+    >>> [count for (name, count) in
+    ...  compute_most_frequent_city_names_by_map("TEST", 2)]
+    [3, 2]
     """
     if not type(filename) == str:
         raise TypeError("filename musst be a string!")
@@ -125,11 +170,282 @@ def compute_most_frequent_city_names_by_map(filename):
     # print(tst[0])
     # print(tst[len(tst)-1])
     # print(len(tst))
+    if top_x is not None:
+        # Heap of size top_x instead of sorting all names.
+        return heapq.nlargest(top_x, nameAndCount_dict.items(),
+                              key=operator.itemgetter(1))
     sorted_nameAndCount = sorted(nameAndCount_dict.items(),  # O(n) assumed
                                  key=operator.itemgetter(1), reverse=True)
     return sorted_nameAndCount
 
 
+def read_blocks(filehandle, block_size=1 << 24):
+    """ Reads a file in blocks of about block_size bytes that end at a line
+        break, so that no line is split between two blocks
+        filehandle:     Handle to the file (opened in binary mode)
+        block_size:     Number of bytes read at once
+    >>> import io
+    >>> data = b"ab\\ncd\\nef"
+    >>> blocks = list(read_blocks(io.BytesIO(data), 4))
+    >>> [len(block) for block in blocks], b"".join(blocks) == data
+    ([3, 3, 2], True)
+    """
+    rest = b""
+    while True:
+        data = filehandle.read(block_size)
+        if not data:
+            break
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            rest += data
+            continue
+        yield rest + data[:end]
+        rest = data[end:]
+    if rest:
+        yield rest
+
+
+def count_city_names_in_block(block):
+    """ Counts the names of the lines in a block with entry P and more then
+        0 inhabitants (like read_info_from_file), as a Counter of
+        (name, countrycode) pairs of byte strings
+        block:  Complete lines of the file
+    >>> counts = count_city_names_in_block(
+    ...     b"1\\tWien\\t\\t\\t\\t\\tP\\t\\tAT\\t\\t\\t\\t\\t\\t5\\n"
+    ...     b"2\\tWien\\t\\t\\t\\t\\tP\\t\\tAT\\t\\t\\t\\t\\t\\t0\\n")
+    >>> counts[(b"Wien", b"AT")]
+    1
+    """
+    counts = collections.Counter()
+    for line in block.split(b"\n"):
+        if not line:
+            continue
+        data = line.split(b"\t", 15)
+        if data[6] == b"P" and int(data[14]) > 0:
+            counts[(data[1], data[8])] += 1
+    return counts
+
+
+def scan_blocks(filename, block_function, num_processes=1,
+                block_size=1 << 24):
+    """ Applies a function to all blocks of a zipped file (see read_blocks)
+        and yields the results, in the order of the blocks
+        filename:       Name of the zipfile (without .zip)
+        block_function: Function taking a block, defined at module level
+        num_processes:  Number of worker processes (default: one per core,
+                        1 for none)
+        block_size:     Number of bytes sent to a worker at once
+    >>> sum(scan_blocks("TEST", len))
+    735
+    """
+    if num_processes is None:
+        num_processes = multiprocessing.cpu_count()
+    with zipfile.ZipFile(filename + ".zip", 'r') as myzip:
+        with myzip.open(filename + ".txt") as f:
+            if num_processes <= 1:
+                for block in read_blocks(f, block_size):
+                    yield block_function(block)
+                return
+            pool = multiprocessing.Pool(num_processes)
+            try:
+                # Keep only a few blocks in flight, so that the file is not
+                # read into memory faster than the workers can take it.
+                pending = collections.deque()
+                for block in read_blocks(f, block_size):
+                    pending.append(pool.apply_async(block_function,
+                                                    (block,)))
+                    if len(pending) >= 2 * num_processes:
+                        yield pending.popleft().get()
+                while pending:
+                    yield pending.popleft().get()
+            finally:
+                pool.terminate()
+
+
+def compute_most_frequent_city_names_in_parallel(filename,
+                                                 num_processes=None,
+                                                 block_size=1 << 24,
+                                                 top_x=None):
+    """ Computes the most fequent citynames in file by map, with the lines
+        split on several processes
+        filename:       Name of the zipfile (without .zip)
+        num_processes:  Number of worker processes (default: one per core)
+        block_size:     Number of bytes sent to a worker at once
+        top_x:          Only return the top_x most fequent names (all for
+                        None)
+        The decompressed file is read in line aligned blocks (see
+        read_blocks), every block is counted by a worker process (see
+        count_city_names_in_block) and the partial counts are merged.
+        Names with the same count are sorted by name.
+    >>> compute_most_frequent_city_names_in_parallel(123)
+    Traceback (most recent call last):
+        ...
+    TypeError: filename musst be a string!
+    >>> lst = compute_most_frequent_city_names_in_parallel("TEST", 2, 200)
+    >>> for (name, count) in lst:
+    ...     print("%s %d" % (name, count))
+    Hittisau 3
+    Wien 2
+    Insbruck 1
+    Linz 1
+    """
+    if not isinstance(filename, str):
+        raise TypeError("filename musst be a string!")
+    counts = collections.Counter()
+    for block_counts in scan_blocks(filename, count_city_names_in_block,
+                                    num_processes, block_size):
+        counts.update(block_counts)
+    name_counts = collections.Counter()
+    for ((name, countrycode), count) in counts.items():
+        name_counts[name] += count
+    return _top([(name.decode("utf8"), count)
+                 for (name, count) in name_counts.items()], top_x)
+
+
+def aggregate_block(block):
+    """ Aggregates the lines in a block with entry P and more then 0
+        inhabitants in one go: returns a Counter of (name, countrycode)
+        pairs and a Counter with the sum of the inhabitants per
+        countrycode (all as byte strings)
+        block:  Complete lines of the file
+    >>> (counts, populations) = aggregate_block(
+    ...     b"1\\tWien\\t\\t\\t\\t\\tP\\t\\tAT\\t\\t\\t\\t\\t\\t5\\n"
+    ...     b"2\\tLinz\\t\\t\\t\\t\\tP\\t\\tAT\\t\\t\\t\\t\\t\\t7\\n")
+    >>> counts[(b"Wien", b"AT")], populations[b"AT"]
+    (1, 12)
+    """
+    counts = collections.Counter()
+    populations = collections.Counter()
+    for line in block.split(b"\n"):
+        if not line:
+            continue
+        data = line.split(b"\t", 15)
+        if data[6] == b"P":
+            population = int(data[14])
+            if population > 0:
+                counts[(data[1], data[8])] += 1
+                populations[data[8]] += population
+    return counts, populations
+
+
+def answer_queries(filename, queries, num_processes=1,
+                   block_size=1 << 24, use_cache=False):
+    """ Answers several aggregation queries with one pass over the file
+        filename:       Name of the zipfile (without .zip)
+        queries:        List of queries, each a tuple of a kind and an
+                        argument:
+            ("top_names", top_x): the top_x most frequent city names (all
+                for None) as (name, count) pairs
+            ("top_names_per_country", top_x): dict of countrycode -> the
+                top_x most frequent city names in that country
+            ("names_in_country", countrycode): the city names that occur
+                in the country with their count in all countries, like
+                compute_most_frequent_city_names_by_map_DE
+            ("population_sums", None): dict of countrycode -> sum of the
+                inhabitants of its cities
+        num_processes:  Number of worker processes (see scan_blocks)
+        block_size:     Number of bytes read at once
+        use_cache:      Read the records from the columnar cache of the
+                        zip file (see geo_names_cache) instead, which is
+                        built on the first call
+        Only lines with entry P and more then 0 inhabitants are counted
+        (like read_info_from_file). The file is decompressed and parsed
+        once into counts per (name, countrycode) and inhabitants per
+        countrycode, and all queries are answered from these. Names with
+        the same count are sorted by name. Returns the list of answers.
+    >>> (top, per_country, in_de, populations) = answer_queries("TEST", [
+    ...     ("top_names", 2), ("top_names_per_country", 1),
+    ...     ("names_in_country", "DE"), ("population_sums", None)])
+    >>> for (name, count) in top + in_de:
+    ...     print("%s %d" % (name, count))
+    Hittisau 3
+    Wien 2
+    Wien 2
+    Insbruck 1
+    >>> for countrycode in sorted(per_country):
+    ...     print("%s %s %d" % ((countrycode,) + per_country[countrycode][0]))
+    AT Hittisau 3
+    DE Insbruck 1
+    >>> print("%d %d" % (populations["AT"], populations["DE"]))
+    9165 3666
+    >>> answer_queries("TEST", [("top_names", 1)], use_cache=True)[0]
+    [('Hittisau', 3)]
+    >>> import os
+    >>> os.remove(geo_names_cache.cache_path("TEST.zip"))
+    """
+    if not isinstance(filename, str):
+        raise TypeError("filename musst be a string!")
+    if use_cache:
+        (counts, populations) = _aggregate_cache(filename)
+    else:
+        counts = collections.Counter()
+        populations = collections.Counter()
+        for (block_counts, block_populations) in scan_blocks(
+                filename, aggregate_block, num_processes, block_size):
+            counts.update(block_counts)
+            populations.update(block_populations)
+        counts = dict(((name.decode("utf8"), countrycode.decode("utf8")),
+                       count)
+                      for ((name, countrycode), count) in counts.items())
+        populations = dict((countrycode.decode("utf8"), population)
+                           for (countrycode, population)
+                           in populations.items())
+    name_counts = collections.Counter()
+    for ((name, countrycode), count) in counts.items():
+        name_counts[name] += count
+    answers = []
+    for (kind, argument) in queries:
+        if kind == "top_names":
+            answers.append(_top(name_counts.items(), argument))
+        elif kind == "top_names_per_country":
+            by_country = {}
+            for ((name, countrycode), count) in counts.items():
+                by_country.setdefault(countrycode, []).append((name, count))
+            answers.append(dict((countrycode, _top(items, argument))
+                                for (countrycode, items)
+                                in by_country.items()))
+        elif kind == "names_in_country":
+            answers.append(_top([(name, name_counts[name])
+                                 for (name, countrycode) in counts
+                                 if countrycode == argument], None))
+        elif kind == "population_sums":
+            answers.append(dict(populations))
+        else:
+            raise ValueError("unknown query: %s" % kind)
+    return answers
+
+
+def _aggregate_cache(filename):
+    """ Returns the counts per (name, countrycode) and the inhabitants per
+        countrycode like answer_queries, from the columnar cache """
+    with geo_names_cache.load_records(filename + ".zip",
+                                      filename + ".txt") as records:
+        # Count the ids and only look up the strings of distinct pairs.
+        id_counts = collections.Counter(zip(records.name_ids,
+                                            records.country_ids))
+        id_populations = collections.Counter()
+        for (country_id, population) in zip(records.country_ids,
+                                            records.populations):
+            id_populations[country_id] += population
+        names = records.names
+        country_codes = records.country_codes
+    counts = dict(((names[name_id], country_codes[country_id]), count)
+                  for ((name_id, country_id), count) in id_counts.items())
+    populations = dict((country_codes[country_id], population)
+                       for (country_id, population)
+                       in id_populations.items())
+    return counts, populations
+
+
+def _top(items, top_x):
+    """ Returns the top_x (name, count) pairs with the largest counts (all
+        for None), names with the same count sorted by name """
+    if top_x is None:
+        return sorted(items, key=lambda item: (-item[1], item[0]))
+    # Heap of size top_x instead of sorting all items.
+    return heapq.nsmallest(top_x, items, key=lambda item: (-item[1], item[0]))
+
+
 def compare_runtime(filename):
     print("Compare runtime: %s" % filename)
     print("Most frequent city names by sorting:")
@@ -153,6 +469,16 @@ def compare_runtime(filename):
     print("%d Cities checked, runtime was %f s\n" % (len(lst), runtime))
     for i in range(3):
         print(lst[i][0] + "\t" + str(lst[i][1]))
+    print("\n")
+    print("Most frequent city names in parallel (%d processes):"
+          % multiprocessing.cpu_count())
+    tic = time.time()
+    lst = compute_most_frequent_city_names_in_parallel(filename)
+    toc = time.time()
+    runtime = toc - tic
+    print("%d Cities checked, runtime was %f s\n" % (len(lst), runtime))
+    for i in range(3):
+        print(lst[i][0] + "\t" + str(lst[i][1]))
 
 
 def compute_most_frequent_city_names_by_sorting_DE(filename):
@@ -270,6 +596,84 @@ def compare_runtimeDE(filename):
         print(lst[i][0] + "\t" + str(lst[i][1]))
 
 
+def write_test_file(filename, num_lines, seed=0):
+    """ Writes a zipfile filename.zip with a file filename.txt of num_lines
+        random lines in the geonames format (19 columns): a third with
+        entry P, a fourth of them with more then 0 inhabitants
+        filename:   Name of the zipfile (without .zip)
+        num_lines:  Number of lines
+        seed:       Seed of the random numbers
+    >>> import os, tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> filename = os.path.join(tmp_dir, "SYN")
+    >>> write_test_file(filename, 1000)
+    >>> with zipfile.ZipFile(filename + ".zip", 'r') as myzip:
+    ...     with myzip.open("SYN.txt") as f:
+    ...         lines = f.read().decode("utf8").splitlines()
+    >>> len(lines), set(len(line.split("\\t")) for line in lines)
+    (1000, {19})
+    >>> os.remove(filename + ".zip")
+    >>> os.rmdir(tmp_dir)
+    """
+    rnd = random.Random(seed)
+    names = [u"City%d" % i for i in range(num_lines // 20 + 1)]
+    names += [u"St\u00e4dt%d" % i for i in range(len(names) // 10 + 1)]
+    lines = []
+    for i in range(num_lines):
+        feature_class = "P" if rnd.random() < 1 / 3.0 else \
+            rnd.choice("AHLRSTUV")
+        population = rnd.randint(1, 100000) if rnd.random() < 0.25 else 0
+        lines.append(u"\t".join([
+            str(i), rnd.choice(names), u"", u"", "%.5f" % rnd.uniform(-90, 90),
+            "%.5f" % rnd.uniform(-180, 180), feature_class, "PPL",
+            rnd.choice(["AT", "DE", "FR", "IT", "CH"]), u"", u"", u"", u"",
+            u"", str(population), u"", u"100", u"Europe/Vienna",
+            u"2017-01-01"]) + u"\n")
+    with zipfile.ZipFile(filename + ".zip", "w",
+                         zipfile.ZIP_DEFLATED) as myzip:
+        myzip.writestr(os.path.basename(filename) + ".txt",
+                       u"".join(lines).encode("utf8"))
+
+
+def compare_read_runtime(filename, repeat=3):
+    """ Prints the runtime of read_info_from_file and of
+        read_info_from_file_by_decoding for a zipfile (the best of repeat
+        runs each, including the decompression) """
+    print("Compare read runtime: %s" % filename)
+    for read_info in (read_info_from_file_by_decoding, read_info_from_file):
+        runtimes = []
+        for _ in range(repeat):
+            tic = time.time()
+            with zipfile.ZipFile(filename + ".zip", 'r') as myzip:
+                with myzip.open(os.path.basename(filename) + ".txt") as f:
+                    num_cities = sum(1 for _ in read_info(f))
+            runtimes.append(time.time() - tic)
+        print("%s: %d Cities, runtime was %f s" % (read_info.__name__,
+                                                   num_cities, min(runtimes)))
+
+
+def report_single_pass(filename, use_cache=False):
+    """ Prints the results of compare_runtime and compare_runtimeDE (and
+        more) from a single pass over the file (see answer_queries) """
+    print("Single pass over %s%s:" % (filename,
+                                      " (cached)" if use_cache else ""))
+    tic = time.time()
+    (top, in_de, populations) = answer_queries(filename, [
+        ("top_names", 3), ("names_in_country", "DE"),
+        ("population_sums", None)], use_cache=use_cache)
+    toc = time.time()
+    print("Runtime was %f s\n" % (toc - tic))
+    print("Most frequent city names:")
+    for (name, count) in top:
+        print(name + "\t" + str(count))
+    print("Most frequent city names in DE:")
+    for (name, count) in in_de[:3]:
+        print(name + "\t" + str(count))
+    print("Countries with the most inhabitants:")
+    for (countrycode, population) in _top(populations.items(), 3):
+        print(countrycode + "\t" + str(population))
+
+
 if __name__ == "__main__":
     # How can I pipe the output in a file
     #    python geo_names_analyzer.py > output.txt
@@ -278,3 +682,8 @@ if __name__ == "__main__":
     # ordinal not in range(128)"
     compare_runtime("allCountries")
     compare_runtimeDE("allCountries")
+    report_single_pass("allCountries")
+    # The first cached run builds allCountries.zip.cols, later runs only
+    # map it.
+    report_single_pass("allCountries", use_cache=True)
+    compare_read_runtime("allCountries")
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+import os
+import mmap
+import struct
+import zipfile
+from array import array
+
+"""
+Columnar cache of the populated places (feature class P, more than 0
+inhabitants) of a geonames zip file, so that later runs do not have to
+decompress and parse the whole file again.
+
+The cache file holds a header, the name of the data file in the archive,
+the city names and country codes (each occurring once, utf8 encoded and
+concatenated), the offsets of the names and country codes in these
+concatenations and the columns name_ids, country_ids and populations with
+one entry per record. Every array starts at a multiple of CACHE_ALIGNMENT
+bytes and is memory-mapped when the cache is opened. The size and
+modification time of the zip file are stored in the header; if they or
+the name of the data file change, the cache is built again.
+"""
+
+CACHE_MAGIC = b"GEOCOLS1"
+CACHE_VERSION = 2
+# magic, version, reserved, source size, source mtime (ns), number of
+# records, names and country codes, length of the member name, the names
+# and the country codes in bytes.
+CACHE_HEADER = struct.Struct("=8sIIqqqqqqqq")
+CACHE_ALIGNMENT = 64
+# name, typecode and the count its length is derived from.
+CACHE_LAYOUT = [("name_offsets", "q", "num_names"),
+                ("country_code_offsets", "q", "num_country_codes"),
+                ("name_ids", "i", "num_records"),
+                ("country_ids", "H", "num_records"),
+                ("populations", "q", "num_records")]
+
+
+def cache_path(zip_file):
+    """ Returns the path of the cache of a zip file """
+    return zip_file + ".cols"
+
+
+def _member_name(z):
+    """ Returns the name of the data file in a geonames archive: the (last)
+        member that is not readme.txt """
+    txt_file = ""
+    for f in z.namelist():
+        if not f == "readme.txt":
+            txt_file = f
+    if not txt_file:
+        raise Exception("Archive only contains readme.txt")
+    return txt_file
+
+
+def _lengths(num_records, num_names, num_country_codes):
+    """ Returns {array name: number of entries} for a cache file. The
+        offset arrays have one more entry than there are strings. """
+    counts = {"num_records": num_records, "num_names": num_names + 1,
+              "num_country_codes": num_country_codes + 1}
+    return {name: counts[count] for name, _, count in CACHE_LAYOUT}
+
+
+def _positions(lengths, member_length, names_length, country_codes_length):
+    """ Returns {section name: file position} for a cache file, "end" is
+        the size of the file """
+    positions = {}
+    pos = CACHE_HEADER.size
+    for name, length in (("member", member_length), ("names", names_length),
+                         ("country_codes", country_codes_length)):
+        positions[name] = pos
+        pos += length
+    for name, typecode, _ in CACHE_LAYOUT:
+        pos += -pos % CACHE_ALIGNMENT
+        positions[name] = pos
+        pos += lengths[name] * struct.calcsize(typecode)
+    positions["end"] = pos
+    return positions
+
+
+def _join(strings):
+    """ Returns the concatenation of strings (bytes) and the offsets of
+        the strings in it, with its length as the last offset """
+    offsets = array("q", [0])
+    for string in strings:
+        offsets.append(offsets[-1] + len(string))
+    return b"".join(strings), offsets
+
+
+def build_cache(zip_file, member=None, cache_file=None):
+    """ Reads the populated places from a geonames zip file and writes them
+        to a cache file
+        zip_file:   Path of the zip file
+        member:     Name of the data file in the archive (default: the one
+                    that is not readme.txt)
+        cache_file: Path of the cache (default: cache_path(zip_file))
+    Returns the number of records written. The file is written to a
+    temporary name first and then renamed, so readers never see a half
+    written cache.
+    """
+    if cache_file is None:
+        cache_file = cache_path(zip_file)
+    source_stat = os.stat(zip_file)
+    name_ids = array("i")
+    country_ids = array("H")
+    populations = array("q")
+    names = {}
+    country_codes = {}
+    with zipfile.ZipFile(zip_file) as z:
+        if member is None:
+            member = _member_name(z)
+        with z.open(member) as f:
+            for line in f:
+                cols = line.split(b"\t", 15)
+                if not cols[6] == b"P":
+                    continue
+                population = int(cols[14])
+                if not population > 0:
+                    continue
+                name_ids.append(names.setdefault(cols[1], len(names)))
+                country_ids.append(
+                    country_codes.setdefault(cols[8], len(country_codes)))
+                populations.append(population)
+    # The ids are the positions in insertion order, which dicts keep.
+    names, name_offsets = _join(list(names))
+    country_codes, country_code_offsets = _join(list(country_codes))
+    member_bytes = member.encode("utf8")
+    tmp_file = "%s.tmp%d" % (cache_file, os.getpid())
+    with open(tmp_file, "wb") as f:
+        f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, 0,
+                                  source_stat.st_size,
+                                  source_stat.st_mtime_ns, len(populations),
+                                  len(name_offsets) - 1,
+                                  len(country_code_offsets) - 1,
+                                  len(member_bytes), len(names),
+                                  len(country_codes)))
+        f.write(member_bytes)
+        f.write(names)
+        f.write(country_codes)
+        for values in (name_offsets, country_code_offsets, name_ids,
+                       country_ids, populations):
+            f.write(bytes(-f.tell() % CACHE_ALIGNMENT))
+            f.write(values)
+    os.replace(tmp_file, cache_file)
+    return len(populations)
+
+
+class CityRecords:
+    """ The records of a cache file, memory-mapped. name_ids, country_ids
+        and populations are read-only memoryviews with one entry per
+        record; names and country_codes map the ids to strings and member
+        is the name of the data file the records were read from. """
+
+    def __init__(self, cache_file, source_stat=None, member=None):
+        """ Opens a cache file written by build_cache. Raises ValueError if
+            it is no cache file or (if source_stat or member are given) was
+            built from a different version of the zip file or a different
+            data file in it. """
+        with open(cache_file, "rb") as f:
+            self._mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, source_size, source_mtime, num_records,
+         num_names, num_country_codes, member_length, names_length,
+         country_codes_length) = CACHE_HEADER.unpack_from(self._mapping)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            self._mapping.close()
+            raise ValueError("%s is not a cache file" % cache_file)
+        lengths = _lengths(num_records, num_names, num_country_codes)
+        positions = _positions(lengths, member_length, names_length,
+                               country_codes_length)
+        pos = positions["member"]
+        self.member = self._mapping[pos:pos + member_length].decode("utf8")
+        if (source_stat is not None and (
+                source_size != source_stat.st_size or
+                source_mtime != source_stat.st_mtime_ns)) or (
+                member is not None and member != self.member):
+            self._mapping.close()
+            raise ValueError("%s is out of date" % cache_file)
+        buf = memoryview(self._mapping)
+        for name, typecode, _ in CACHE_LAYOUT:
+            pos = positions[name]
+            num_bytes = lengths[name] * struct.calcsize(typecode)
+            setattr(self, name, buf[pos:pos + num_bytes].cast(typecode))
+        self.names = self._strings(positions["names"], self.name_offsets)
+        self.country_codes = self._strings(positions["country_codes"],
+                                           self.country_code_offsets)
+
+    def _strings(self, pos, offsets):
+        """ Decodes the strings starting at pos with the given offsets, so
+            that empty strings are kept """
+        blob = self._mapping[pos:pos + offsets[-1]]
+        return [blob[offsets[i]:offsets[i + 1]].decode("utf8")
+                for i in range(len(offsets) - 1)]
+
+    def __len__(self):
+        return len(self.populations)
+
+    def __iter__(self):
+        """ Yields (name, countrycode) for each record, like the readers of
+            the analyzers """
+        names = self.names
+        country_codes = self.country_codes
+        for name_id, country_id in zip(self.name_ids, self.country_ids):
+            yield names[name_id], country_codes[country_id]
+
+    def records(self):
+        """ Yields (name, countrycode, population) for each record """
+        names = self.names
+        country_codes = self.country_codes
+        for name_id, country_id, population in zip(
+                self.name_ids, self.country_ids, self.populations):
+            yield names[name_id], country_codes[country_id], population
+
+    def close(self):
+        """ Releases the memoryviews and the mapping """
+        for name, _, _ in CACHE_LAYOUT:
+            getattr(self, name).release()
+        self._mapping.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load_records(zip_file, member=None, cache_file=None):
+    """ Returns the CityRecords of a geonames zip file from its cache,
+        which is (re)built first if it does not exist, if the size or
+        modification time of the zip file changed or if it was built from
+        a different member
+        zip_file:   Path of the zip file
+        member:     Name of the data file in the archive (see build_cache)
+        cache_file: Path of the cache (default: cache_path(zip_file))
+    >>> import shutil, tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> zip_file = os.path.join(tmp_dir, "TEST.zip")
+    >>> _ = shutil.copy("TEST.zip", zip_file)
+    >>> with load_records(zip_file) as records:
+    ...     print(len(records), sorted(set(records.country_codes)))
+    ...     for (name, countrycode, population) in records.records():
+    ...         print(name, countrycode, population)
+    7 ['AT', 'DE']
+    Hittisau AT 1833
+    Wien DE 1833
+    Wien AT 1833
+    Insbruck DE 1833
+    Hittisau AT 1833
+    Hittisau AT 1833
+    Linz AT 1833
+    >>> os.path.exists(cache_path(zip_file))
+    True
+    >>> stat = os.stat(zip_file)
+    >>> os.utime(zip_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    >>> with load_records(zip_file) as records:
+    ...     print(list(records)[:2])
+    [('Hittisau', 'AT'), ('Wien', 'DE')]
+    >>> CityRecords(cache_path(zip_file), os.stat(zip_file)).close()
+
+    The cache is built again for another member of the archive, and empty
+    names are kept:
+    >>> zip_file = os.path.join(tmp_dir, "TWO.zip")
+    >>> def line(name, country_code, population):
+    ...     cols = ["1", name, "", "", "", "", "P", "", country_code]
+    ...     return "\\t".join(cols + [""] * 5 + [str(population)]) + "\\n"
+    >>> with zipfile.ZipFile(zip_file, "w") as z:
+    ...     z.writestr("A.txt", line("Wien", "AT", 10))
+    ...     z.writestr("B.txt", line("", "DE", 20) + line("Ulm", "", 30))
+    >>> for member in ("A.txt", "B.txt", None):
+    ...     with load_records(zip_file, member) as records:
+    ...         print(records.member, list(records.records()))
+    A.txt [('Wien', 'AT', 10)]
+    B.txt [('', 'DE', 20), ('Ulm', '', 30)]
+    B.txt [('', 'DE', 20), ('Ulm', '', 30)]
+    >>> shutil.rmtree(tmp_dir)
+    """
+    if cache_file is None:
+        cache_file = cache_path(zip_file)
+    source_stat = os.stat(zip_file)
+    if member is None:
+        with zipfile.ZipFile(zip_file) as z:
+            member = _member_name(z)
+    if os.path.exists(cache_file):
+        try:
+            return CityRecords(cache_file, source_stat, member)
+        except ValueError:
+            pass
+    build_cache(zip_file, member, cache_file)
+    return CityRecords(cache_file, source_stat, member)
@@ -2,8 +2,12 @@
 
 import zipfile
 import bisect
+import hashlib
+import heapq
+import operator
 import time
 import os
+import geo_names_cache
 
 """
 Extract world-wide city information from zip files downloaded from
@@ -54,6 +58,26 @@ def read_info_from_zip_file(zip_file):
                 yield (name, country_code)
 
 
+def read_info_from_cache(zip_file):
+    """ Read in (name, country code) pairs from the columnar cache of the
+    zip file (see geo_names_cache), which is built on the first call and
+    whenever the zip file changes.
+
+    >>> cities = list(read_info_from_cache("TEST.zip"))
+    >>> len(cities), cities[0]
+    (7, ('Hittisau', 'AT'))
+    >>> os.remove(geo_names_cache.cache_path("TEST.zip"))
+
+    """
+    # Check if file exists.
+    if not os.path.isfile(zip_file):
+        raise OSError("file \"%s\" not found" % (zip_file))
+
+    with geo_names_cache.load_records(zip_file) as records:
+        for city in records:
+            yield city
+
+
 def read_info_from_txt_file(txt_file):
     """ Read in file content. """
 
@@ -119,10 +143,8 @@ def compute_names_by_sorting(iterable, top_x=3):
         prev_name = cur_name
     # Store last block count and name.
     new_lst.append((prev_name, i))
-    # Sort unified list.
-    new_lst.sort(key=lambda x: x[1], reverse=True)
-    # Return top x counts.
-    return new_lst[:top_x]
+    # Select top x counts (stable like a descending sort).
+    return heapq.nlargest(top_x, new_lst, key=operator.itemgetter(1))
 
 
 def compute_names_by_map(iterable, top_x=3):
@@ -144,12 +166,8 @@ def compute_names_by_map(iterable, top_x=3):
             dic[stats[0]] += 1
         else:
             dic[stats[0]] = 1
-    # Check if dictionary is empty.
-    if not dic:
-        return []
-    # Sort descending and return.
-    sorted_dic_list = sorted(dic.items(), key=lambda dic: dic[1], reverse=True)
-    return sorted_dic_list[:top_x]
+    # Select top x counts with a heap of size top_x instead of sorting all.
+    return heapq.nlargest(top_x, dic.items(), key=operator.itemgetter(1))
 
 
 def compute_names_by_map_set_country(iterable, c_code, top_x=3):
@@ -174,15 +192,116 @@ def compute_names_by_map_set_country(iterable, c_code, top_x=3):
         # Remember city names that exist in given country.
         if stats[1] == c_code:
             country_dic[stats[0]] = 1
-    # Check if dictionary is empty.
-    if not dic:
+    # Select top x counts of the names in the country.
+    return heapq.nlargest(top_x, ((k, v) for k, v in dic.items()
+                                  if k in country_dic),
+                          key=operator.itemgetter(1))
+
+
+def compute_names_by_space_saving(iterable, top_x=3, capacity=1000):
+    """ Compute approximately most frequent city names with the
+    Space-Saving algorithm, which keeps at most capacity counters.
+    When a new name arrives and all counters are in use, the name with
+    the smallest count is replaced and the new name inherits its count.
+    So counts can be too high (by at most the number of names divided by
+    capacity), but every name occurring more often than that is reported.
+    Results are exact if there are at most capacity different names.
+
+    >>> test_iter = [("n1", "A"), ("n2", "B"), ("n1", "C"), ("n2", "D"),
+    ...              ("n1", "B"), ("n3", "A")]
+    >>> compute_names_by_space_saving(test_iter)
+    [('n1', 3), ('n2', 2), ('n3', 1)]
+    >>> compute_names_by_space_saving(test_iter, top_x=1, capacity=2)
+    [('n1', 3)]
+    >>> compute_names_by_space_saving([])
+    []
+    >>> compute_names_by_space_saving(test_iter, capacity=0)
+    Traceback (most recent call last):
+        ...
+    ValueError: capacity must be positive
+
+    """
+    if capacity <= 0:
+        raise ValueError("capacity must be positive")
+    counts = {}
+    # Min-heap of (count, name) with outdated entries, which are skipped
+    # when popped and dropped when the heap gets too large.
+    heap = []
+    for stats in iterable:
+        name = stats[0]
+        if name in counts:
+            counts[name] += 1
+        elif len(counts) < capacity:
+            counts[name] = 1
+        else:
+            # Find the name with the smallest count and replace it.
+            while True:
+                count, min_name = heapq.heappop(heap)
+                if counts.get(min_name) == count:
+                    break
+            del counts[min_name]
+            counts[name] = count + 1
+        heapq.heappush(heap, (counts[name], name))
+        if len(heap) > 4 * capacity:
+            heap = [(v, k) for k, v in counts.items()]
+            heapq.heapify(heap)
+    return heapq.nlargest(top_x, counts.items(), key=operator.itemgetter(1))
+
+
+def compute_names_by_count_min_sketch(iterable, top_x=3, width=1 << 16,
+                                      depth=4):
+    """ Compute approximately most frequent city names with a Count-Min
+    sketch of depth rows of width counters. Each name is counted in one
+    counter per row, chosen by a BLAKE2 hash of the name with a different
+    salt per row, so that names sharing a counter in one row are unlikely
+    to share one in the others. Unlike hash(), the counters do not depend
+    on PYTHONHASHSEED, so runs are reproducible. Its estimate is the
+    minimum of these, which can only be too high. Only the top_x names with the
+    largest estimates seen so far are remembered, so the memory does not
+    depend on the number of different names.
+
+    >>> test_iter = [("n1", "A"), ("n2", "B"), ("n1", "C"), ("n2", "D"),
+    ...              ("n1", "B"), ("n3", "A")]
+    >>> compute_names_by_count_min_sketch(test_iter)
+    [('n1', 3), ('n2', 2), ('n3', 1)]
+    >>> compute_names_by_count_min_sketch(test_iter, top_x=2)
+    [('n1', 3), ('n2', 2)]
+    >>> compute_names_by_count_min_sketch([])
+    []
+
+    """
+    if top_x <= 0:
         return []
-    # Sort descending and return.
-    sorted_dic_list = []
-    for k, v in sorted(dic.items(), key=lambda dic: dic[1], reverse=True):
-        if k in country_dic:
-            sorted_dic_list.append((k, v))
-    return sorted_dic_list[:top_x]
+    rows = [[0] * width for _ in range(depth)]
+    salts = [b"row%d" % i for i in range(depth)]
+    top = {}
+    # Min-heap of (estimate, name) of the remembered names with outdated
+    # entries, which are skipped and dropped like in
+    # compute_names_by_space_saving.
+    heap = []
+    for stats in iterable:
+        name = stats[0]
+        data = name.encode("utf8")
+        estimate = None
+        for row, salt in zip(rows, salts):
+            j = int.from_bytes(hashlib.blake2b(
+                data, digest_size=8, salt=salt).digest(), "little") % width
+            row[j] += 1
+            if estimate is None or row[j] < estimate:
+                estimate = row[j]
+        if name not in top and len(top) >= top_x:
+            # Replace the remembered name with the smallest estimate.
+            while top.get(heap[0][1]) != heap[0][0]:
+                heapq.heappop(heap)
+            if not estimate > heap[0][0]:
+                continue
+            del top[heapq.heappop(heap)[1]]
+        top[name] = estimate
+        heapq.heappush(heap, (estimate, name))
+        if len(heap) > 4 * top_x:
+            heap = [(v, k) for k, v in top.items()]
+            heapq.heapify(heap)
+    return heapq.nlargest(top_x, top.items(), key=operator.itemgetter(1))
 
 
 def compute_names_by_bisect_sorting(iterable, top_x=3):
@@ -222,29 +341,36 @@ def compute_names_by_bisect_sorting(iterable, top_x=3):
         prev_name = cur_name
     # Store last block count and name.
     new_lst.append((prev_name, i))
-    # Sort unified list.
-    new_lst.sort(key=lambda x: x[1], reverse=True)
-    # Return top x counts.
-    return new_lst[:top_x]
+    # Select top x counts (stable like a descending sort).
+    return heapq.nlargest(top_x, new_lst, key=operator.itemgetter(1))
 
 
-def measure_times(file_name, top_x=3):
+def measure_times(file_name, top_x=3, use_cache=False):
     """
     Measure runtimes for the different approaches
     and output top_x city names.
+    With use_cache, read from the columnar cache instead of the zip file.
     """
+    read_info = read_info_from_cache if use_cache else read_info_from_zip_file
     # Sorting.
-    iterable = read_info_from_zip_file(file_name)
+    iterable = read_info(file_name)
     start = time.time()
     sort_results = compute_names_by_sorting(iterable, top_x=top_x)
     end = time.time()
     print("Time elapsed for sorting: %.1f ms" % ((end - start) * 1000))
     # Map.
-    iterable = read_info_from_zip_file(file_name)
+    iterable = read_info(file_name)
     start = time.time()
     map_results = compute_names_by_map(iterable, top_x=top_x)
     end = time.time()
     print("Time elapsed for map: %.1f ms" % ((end - start) * 1000))
+    # Space-Saving (approximate, bounded memory).
+    iterable = read_info(file_name)
+    start = time.time()
+    space_saving_results = compute_names_by_space_saving(iterable,
+                                                         top_x=top_x)
+    end = time.time()
+    print("Time elapsed for Space-Saving: %.1f ms" % ((end - start) * 1000))
     # Report results.
     print("Top %i city names from sorting:" % (top_x))
     for name, count in sort_results:
@@ -252,6 +378,9 @@ def measure_times(file_name, top_x=3):
     print("Top %i city names from map:" % (top_x))
     for name, count in map_results:
         print("%s -> %i" % (name, count))
+    print("Top %i city names from Space-Saving:" % (top_x))
+    for name, count in space_saving_results:
+        print("%s -> %i" % (name, count))
 
 
 if __name__ == "__main__":